@@ -27,6 +27,12 @@ const float FATOR_CORRECAO_DISTANCIA =1.0;// 0.9956; valor real/valor medido(ou
 // Número de leituras a fazer por cada ponto para reduzir o ruído.
 const int NUMERO_DE_AMOSTRAS = 5;
 
+// --- PROTOCOLO DE COMUNICAÇÃO ---
+// true: pede ao servidor o protocolo binário (tramas de registos de 10 bytes
+// com número de sequência). Se o servidor não o suportar, usa o texto.
+const bool PROTOCOLO_BINARIO = true;
+const int REGISTOS_POR_TRAMA = 36;
+
 // =======================================================================
 // ===                 FIM DA CONFIGURAÇÃO DE CALIBRAÇÃO               ===
 // =======================================================================
@@ -55,6 +61,49 @@ Adafruit_VL53L0X lox = Adafruit_VL53L0X();
 // --- VARIÁVEIS GLOBAIS DE CONTROLO ---
 bool homingCompleto = false; long offsetPassosPrato = 0; int status = WL_IDLE_STATUS; int camadaAtual = 1; float alturaMaximaScanMM = 0;
 
+// --- PROTOCOLO BINÁRIO ---
+// Trama: [0xA5 0x5A][n: uint16][n registos]; registo: seq uint32, distância uint16 (mm),
+// ângulo uint16 (centésimos de grau), altura uint16 (centésimos de mm). Tudo little-endian.
+// Uma trama com n = 0 marca o fim do scan.
+const int TAMANHO_REGISTO = 10;
+bool usarBinario = false;
+uint32_t numeroSequencia = 0;
+uint8_t trama[4 + REGISTOS_POR_TRAMA * TAMANHO_REGISTO];
+int registosNaTrama = 0;
+
+void escreverU16(uint8_t* destino, uint16_t valor) { destino[0] = valor & 0xFF; destino[1] = valor >> 8; }
+void escreverU32(uint8_t* destino, uint32_t valor) { for (int i = 0; i < 4; i++) destino[i] = (valor >> (8 * i)) & 0xFF; }
+
+void enviarTrama() {
+  trama[0] = 0xA5; trama[1] = 0x5A;
+  escreverU16(trama + 2, registosNaTrama);
+  client.write(trama, 4 + registosNaTrama * TAMANHO_REGISTO);
+  registosNaTrama = 0;
+}
+
+void acrescentarRegisto(int distancia, int angulo, float alturaMM) {
+  uint8_t* registo = trama + 4 + registosNaTrama * TAMANHO_REGISTO;
+  escreverU32(registo, numeroSequencia++);
+  escreverU16(registo + 4, distancia < 0 ? 0 : distancia);
+  escreverU16(registo + 6, angulo * 100);
+  escreverU16(registo + 8, (uint16_t)round(alturaMM * 100.0));
+  if (++registosNaTrama == REGISTOS_POR_TRAMA) enviarTrama();
+}
+
+bool negociarProtocoloBinario() {
+  client.println("HELLO P3DB/1");
+  String resposta = "";
+  unsigned long inicio = millis();
+  while (millis() - inicio < 2000) {
+    if (client.available()) {
+      char c = client.read();
+      if (c == '\n') break;
+      resposta += c;
+    }
+  }
+  return resposta.startsWith("OK P3DB/1");
+}
+
 void setup() {
   Serial.begin(115200);
   while (!Serial);
@@ -115,6 +164,10 @@ void setup() {
   Serial.print("Conectando ao servidor "); Serial.print(server); Serial.print(":"); Serial.println(port);
   if (!client.connect(server, port)) { Serial.println("Falha na conexão com o servidor Python."); while(1); }
   Serial.println("Conectado ao servidor! A iniciar scan.");
+  if (PROTOCOLO_BINARIO) {
+    usarBinario = negociarProtocoloBinario();
+    Serial.println(usarBinario ? "Protocolo: binário." : "Protocolo: texto (servidor sem suporte binário).");
+  }
   homingCompleto = true;
   delay(1000);
 }
@@ -127,7 +180,9 @@ void loop() {
 
   if (alturaAtualZ_mm >= alturaMaximaScanMM) {
     Serial.println("\n--- Altura máxima de scan atingida. Digitalização concluída! ---");
-    client.println("END"); client.stop();
+    if (usarBinario) { if (registosNaTrama > 0) enviarTrama(); enviarTrama(); }  // A trama vazia é o "END"
+    else client.println("END");
+    client.stop();
     motorZ.disableOutputs(); motorPrato.disableOutputs();
     while (1);
   }
@@ -162,20 +217,25 @@ void loop() {
       float distanciaMediaLida = (float)somaDistancias / leiturasValidas;
       int distanciaCorrigida = (int)(distanciaMediaLida * FATOR_CORRECAO_DISTANCIA);
       
-      char alturaStr[10];
-      dtostrf(alturaAtualZ_mm, 4, 2, alturaStr);
-      sprintf(dataBuffer, "D:%d,A:%d,Z:%s", distanciaCorrigida, angulo, alturaStr);
-      
-      if (client.connected()) {
-        client.println(dataBuffer);
-      } else {
+      if (!client.connected()) {
         Serial.println("ERRO: Conexão perdida durante o envio de dados.");
         while(1);
       }
+      if (usarBinario) {
+        acrescentarRegisto(distanciaCorrigida, angulo, alturaAtualZ_mm);
+      } else {
+        char alturaStr[10];
+        dtostrf(alturaAtualZ_mm, 4, 2, alturaStr);
+        sprintf(dataBuffer, "D:%d,A:%d,Z:%s", distanciaCorrigida, angulo, alturaStr);
+        client.println(dataBuffer);
+      }
     }
     delay(30);
   }
   
+  // Envia o resto da camada para o servidor não ficar à espera durante a subida do eixo Z.
+  if (usarBinario && registosNaTrama > 0) enviarTrama();
+
   offsetPassosPrato += PASSOS_POR_ROTACAO_PRATO;
   Serial.println("Rotação da camada concluída.");
   Serial.print("Subindo eixo Z para a próxima camada...");
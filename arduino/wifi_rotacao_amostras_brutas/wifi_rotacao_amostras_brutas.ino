@@ -0,0 +1,285 @@
+// =======================================================================
+// ===     CÓDIGO FIRMWARE FINAL E CALIBRADO PARA SCANNER 3D           ===
+// =======================================================================
+// Versão: 2.3 - Amostras em bruto: a fusão das amostras é feita no PC
+// =======================================================================
+// Variante do wifi_rotacao_2_scan que envia TODAS as amostras de cada ângulo
+// (protocolo binário, "HELLO P3DB/1 RAW"). O recetor junta-as com estatística
+// robusta (mediana, média aparada, rejeição de outliers; ver sample_fusion.py),
+// por isso o prato pode parar menos tempo em cada passo. Se o servidor não
+// aceitar as amostras em bruto, a média é feita aqui, como na versão 2.2.
+// =======================================================================
+
+#include <WiFiS3.h>
+#include <Wire.h>
+#include <AccelStepper.h>
+#include <Adafruit_VL53L0X.h>
+#include <math.h>
+
+// --- CONFIGURAÇÕES DE REDE ---
+const char ssid[] = "Vodafone-D433A6";
+const char pass[] = "datreta12345.";
+const char server[] = "192.168.20.73";
+const int port = 5000;
+
+// =======================================================================
+// ===               INÍCIO DA CONFIGURAÇÃO DE CALIBRAÇÃO              ===
+// =======================================================================
+
+// --- CALIBRAÇÃO E MELHORIA DE QUALIDADE ---
+// Fator para corrigir a precisão da distância.
+const float FATOR_CORRECAO_DISTANCIA =1.0;// 0.9956; valor real/valor medido(ou media do valor medido)
+
+// Número de leituras a fazer por cada ponto para reduzir o ruído.
+const int NUMERO_DE_AMOSTRAS = 5;
+
+// --- TEMPOS DE ESPERA ---
+// Com as amostras em bruto não há média a calcular: cada rangingTest já espera
+// pela medição, por isso não é preciso a pausa entre amostras, e basta uma
+// pausa curta depois de cada passo para o prato estabilizar.
+const int ESPERA_ENTRE_AMOSTRAS_MS = 0;
+const int ESPERA_APOS_PASSO_MS = 5;
+// Tempos da versão 2.2, usados se o servidor não aceitar as amostras em bruto.
+const int ESPERA_ENTRE_AMOSTRAS_MEDIA_MS = 5;
+const int ESPERA_APOS_PASSO_MEDIA_MS = 30;
+
+// --- PROTOCOLO DE COMUNICAÇÃO ---
+// Esta variante usa sempre o protocolo binário (tramas de registos de 10 bytes
+// com número de sequência) e pede as amostras em bruto. Se o servidor não
+// suportar o binário, usa o texto com a média feita aqui.
+const bool PROTOCOLO_BINARIO = true;
+const int REGISTOS_POR_TRAMA = 90;
+
+// =======================================================================
+// ===                 FIM DA CONFIGURAÇÃO DE CALIBRAÇÃO               ===
+// =======================================================================
+
+// --- CONFIGURAÇÕES DOS MOTORES E SENSORES ---
+#define TIPO_MOTOR_PRATO AccelStepper::HALF4WIRE
+#define TIPO_MOTOR_Z     AccelStepper::HALF4WIRE
+const int PINO_MOTOR_Z_IN1 = 6; const int PINO_MOTOR_Z_IN2 = 7; const int PINO_MOTOR_Z_IN3 = 8; const int PINO_MOTOR_Z_IN4 = 9;
+const float PASSOS_POR_MM_Z = 2068.20;
+const float ALTURA_CAMADA_MM = 1.0;
+const int   PASSO_ANGULAR_GRAUS = 1;
+const long PASSOS_PARA_SUBIR_INICIAL = round(10.0 * PASSOS_POR_MM_Z);
+const long PASSOS_PARA_SUBIR_CAMADA = round(ALTURA_CAMADA_MM * PASSOS_POR_MM_Z);
+const int PINO_MOTOR_PRATO_IN1 = 2; const int PINO_MOTOR_PRATO_IN2 = 3; const int PINO_MOTOR_PRATO_IN3 = 4; const int PINO_MOTOR_PRATO_IN4 = 5;
+const long PASSOS_POR_ROTACAO_PRATO = 4174;
+const int PINO_FIM_DE_CURSO = 12;
+const float ALTURA_MAXIMA_FISICA_MM = 160.0;
+const int VELOCIDADE_HOMING_Z = 1000;
+
+// --- INICIALIZAÇÃO DOS OBJETOS ---
+WiFiClient client;
+AccelStepper motorZ(TIPO_MOTOR_Z, PINO_MOTOR_Z_IN1, PINO_MOTOR_Z_IN3, PINO_MOTOR_Z_IN2, PINO_MOTOR_Z_IN4);
+AccelStepper motorPrato(TIPO_MOTOR_PRATO, PINO_MOTOR_PRATO_IN1, PINO_MOTOR_PRATO_IN3, PINO_MOTOR_PRATO_IN2, PINO_MOTOR_PRATO_IN4);
+Adafruit_VL53L0X lox = Adafruit_VL53L0X();
+
+// --- VARIÁVEIS GLOBAIS DE CONTROLO ---
+bool homingCompleto = false; long offsetPassosPrato = 0; int status = WL_IDLE_STATUS; int camadaAtual = 1; float alturaMaximaScanMM = 0;
+
+// --- PROTOCOLO BINÁRIO ---
+// Trama: [0xA5 0x5A][n: uint16][n registos]; registo: seq uint32, distância uint16 (mm),
+// ângulo uint16 (centésimos de grau), altura uint16 (centésimos de mm). Tudo little-endian.
+// Uma trama com n = 0 marca o fim do scan.
+const int TAMANHO_REGISTO = 10;
+bool usarBinario = false;
+bool amostrasBrutas = false;
+uint32_t numeroSequencia = 0;
+uint8_t trama[4 + REGISTOS_POR_TRAMA * TAMANHO_REGISTO];
+int registosNaTrama = 0;
+
+void escreverU16(uint8_t* destino, uint16_t valor) { destino[0] = valor & 0xFF; destino[1] = valor >> 8; }
+void escreverU32(uint8_t* destino, uint32_t valor) { for (int i = 0; i < 4; i++) destino[i] = (valor >> (8 * i)) & 0xFF; }
+
+void enviarTrama() {
+  trama[0] = 0xA5; trama[1] = 0x5A;
+  escreverU16(trama + 2, registosNaTrama);
+  client.write(trama, 4 + registosNaTrama * TAMANHO_REGISTO);
+  registosNaTrama = 0;
+}
+
+void acrescentarRegisto(int distancia, int angulo, float alturaMM) {
+  uint8_t* registo = trama + 4 + registosNaTrama * TAMANHO_REGISTO;
+  escreverU32(registo, numeroSequencia++);
+  escreverU16(registo + 4, distancia < 0 ? 0 : distancia);
+  escreverU16(registo + 6, angulo * 100);
+  escreverU16(registo + 8, (uint16_t)round(alturaMM * 100.0));
+  if (++registosNaTrama == REGISTOS_POR_TRAMA) enviarTrama();
+}
+
+// Devolve a resposta do servidor ("OK P3DB/1 RAW", "OK P3DB/1", "OK TEXT", ...).
+String negociarProtocolo() {
+  client.println("HELLO P3DB/1 RAW");
+  String resposta = "";
+  unsigned long inicio = millis();
+  while (millis() - inicio < 2000) {
+    if (client.available()) {
+      char c = client.read();
+      if (c == '\n') break;
+      resposta += c;
+    }
+  }
+  return resposta;
+}
+
+void setup() {
+  Serial.begin(115200);
+  while (!Serial);
+
+  Serial.println("\n--- Scanner 3D - MODO CALIBRADO FINAL ---");
+  Serial.print("Fator de Correção de Distância: "); Serial.println(FATOR_CORRECAO_DISTANCIA, 4);
+
+  Serial.print("Tentando conectar a rede: "); Serial.println(ssid);
+  while (status != WL_CONNECTED) { status = WiFi.begin(ssid, pass); delay(5000); Serial.print("."); }
+  Serial.println("\nWiFi conectado com sucesso!"); Serial.print("Endereço IP do Arduino: "); Serial.println(WiFi.localIP());
+  Serial.println("Inicializando sensor VL53L0X...");
+  if (!lox.begin()) { Serial.println(F("Falha ao iniciar o sensor VL53L0X.")); while (1); }
+  Serial.println("Sensor VL53L0X OK."); pinMode(PINO_FIM_DE_CURSO, INPUT_PULLUP);
+  
+  motorZ.setMaxSpeed(700); motorZ.setAcceleration(350);
+  motorPrato.setMaxSpeed(700); motorPrato.setAcceleration(400);
+
+  Serial.println("Fase 1: Homing do eixo Z...");
+  motorZ.setSpeed(VELOCIDADE_HOMING_Z);
+  unsigned long tempoPrimeiroSinalLow = 0; const int intervaloDebounce = 50; bool botaoConfirmadoPressionado = false;
+  while (!botaoConfirmadoPressionado) {
+    motorZ.runSpeed();
+    if (digitalRead(PINO_FIM_DE_CURSO) == LOW) {
+      if (tempoPrimeiroSinalLow == 0) tempoPrimeiroSinalLow = millis();
+      else if (millis() - tempoPrimeiroSinalLow > intervaloDebounce) botaoConfirmadoPressionado = true;
+    } else { tempoPrimeiroSinalLow = 0; }
+  }
+  motorZ.stop(); motorZ.setCurrentPosition(0);
+  Serial.println("Ponto zero físico (fim de curso) encontrado!");
+
+  Serial.print("Subindo para a posição inicial de scan...");
+  motorZ.moveTo(-PASSOS_PARA_SUBIR_INICIAL);
+  while (motorZ.distanceToGo() != 0) motorZ.run();
+  motorZ.setCurrentPosition(0); motorPrato.setCurrentPosition(0);
+  Serial.println(" Posição inicial atingida.");
+  
+  Serial.println("\n----------------------------------------------------");
+  
+  // CORREÇÃO: Limpa qualquer dado antigo do buffer serial
+  while (Serial.available() > 0) {
+    Serial.read();
+  }
+
+  Serial.println("Por favor, insira a altura máxima do scan em milímetros (mm)");
+  while (Serial.available() == 0) { delay(100); }
+  alturaMaximaScanMM = Serial.parseFloat();
+  if (alturaMaximaScanMM <= 0 || alturaMaximaScanMM > ALTURA_MAXIMA_FISICA_MM) { 
+    if (alturaMaximaScanMM > ALTURA_MAXIMA_FISICA_MM) {
+        Serial.print("AVISO: Altura excede o limite físico. Ajustando para "); Serial.print(ALTURA_MAXIMA_FISICA_MM); Serial.println(" mm."); 
+        alturaMaximaScanMM = ALTURA_MAXIMA_FISICA_MM; 
+    } else {
+        Serial.println("AVISO: Altura inválida. Usando o valor máximo de 160 mm.");
+        alturaMaximaScanMM = ALTURA_MAXIMA_FISICA_MM;
+    }
+  }
+  Serial.print("Altura máxima do scan definida para: "); Serial.print(alturaMaximaScanMM); Serial.println(" mm");
+  Serial.println("----------------------------------------------------"); delay(2000);
+  Serial.print("Conectando ao servidor "); Serial.print(server); Serial.print(":"); Serial.println(port);
+  if (!client.connect(server, port)) { Serial.println("Falha na conexão com o servidor Python."); while(1); }
+  Serial.println("Conectado ao servidor! A iniciar scan.");
+  if (PROTOCOLO_BINARIO) {
+    String resposta = negociarProtocolo();
+    usarBinario = resposta.startsWith("OK P3DB/1");
+    amostrasBrutas = usarBinario && resposta.indexOf("RAW") >= 0;
+    Serial.println(usarBinario ? "Protocolo: binário." : "Protocolo: texto (servidor sem suporte binário).");
+    Serial.println(amostrasBrutas ? "Amostras em bruto: a fusão é feita no servidor."
+                                  : "Amostras em bruto recusadas: a média é feita no Arduino.");
+  }
+  homingCompleto = true;
+  delay(1000);
+}
+
+void loop() {
+  if (!homingCompleto) return;
+  if (!client.connected()) { Serial.println("ERRO: Servidor desconectado. Parando o scan."); while(1); }
+  
+  float alturaAtualZ_mm = (camadaAtual - 1) * ALTURA_CAMADA_MM;
+
+  if (alturaAtualZ_mm >= alturaMaximaScanMM) {
+    Serial.println("\n--- Altura máxima de scan atingida. Digitalização concluída! ---");
+    if (usarBinario) { if (registosNaTrama > 0) enviarTrama(); enviarTrama(); }  // A trama vazia é o "END"
+    else client.println("END");
+    client.stop();
+    motorZ.disableOutputs(); motorPrato.disableOutputs();
+    while (1);
+  }
+  
+  Serial.print("Iniciando rotação da camada #"); Serial.print(camadaAtual);
+  Serial.print(" (Altura atual: "); Serial.print(alturaAtualZ_mm, 2);
+  Serial.print(" mm / "); Serial.print(alturaMaximaScanMM); Serial.print(" mm)");
+  Serial.println();
+  
+  char dataBuffer[100];
+  
+  for (int angulo = 0; angulo < 360; angulo += PASSO_ANGULAR_GRAUS) {
+    long posicaoAlvo = round((angulo / 360.0) * PASSOS_POR_ROTACAO_PRATO);
+    motorPrato.moveTo(posicaoAlvo + offsetPassosPrato);
+    while (motorPrato.distanceToGo() != 0) motorPrato.run();
+    
+    if (!client.connected()) {
+      Serial.println("ERRO: Conexão perdida durante o envio de dados.");
+      while(1);
+    }
+
+    // --- AMOSTRAS EM BRUTO: cada amostra vai para o servidor com o seu ângulo ---
+    if (amostrasBrutas) {
+      VL53L0X_RangingMeasurementData_t measure;
+      for (int i = 0; i < NUMERO_DE_AMOSTRAS; i++) {
+        lox.rangingTest(&measure, false);
+        // Fora de alcance (RangeStatus 4) vai como 0: o servidor conta-a e descarta-a.
+        int distancia = (measure.RangeStatus != 4) ? (int)(measure.RangeMilliMeter * FATOR_CORRECAO_DISTANCIA) : 0;
+        acrescentarRegisto(distancia, angulo, alturaAtualZ_mm);
+        if (ESPERA_ENTRE_AMOSTRAS_MS > 0) delay(ESPERA_ENTRE_AMOSTRAS_MS);
+      }
+      delay(ESPERA_APOS_PASSO_MS);
+      continue;
+    }
+
+    // --- LÓGICA DE MEDIÇÃO OTIMIZADA ---
+    long somaDistancias = 0;
+    int leiturasValidas = 0;
+    VL53L0X_RangingMeasurementData_t measure;
+
+    for (int i = 0; i < NUMERO_DE_AMOSTRAS; i++) {
+      lox.rangingTest(&measure, false);
+      if (measure.RangeStatus != 4) {
+        somaDistancias += measure.RangeMilliMeter;
+        leiturasValidas++;
+      }
+      delay(ESPERA_ENTRE_AMOSTRAS_MEDIA_MS);
+    }
+
+    if (leiturasValidas > 0) {
+      float distanciaMediaLida = (float)somaDistancias / leiturasValidas;
+      int distanciaCorrigida = (int)(distanciaMediaLida * FATOR_CORRECAO_DISTANCIA);
+      
+      if (usarBinario) {
+        acrescentarRegisto(distanciaCorrigida, angulo, alturaAtualZ_mm);
+      } else {
+        char alturaStr[10];
+        dtostrf(alturaAtualZ_mm, 4, 2, alturaStr);
+        sprintf(dataBuffer, "D:%d,A:%d,Z:%s", distanciaCorrigida, angulo, alturaStr);
+        client.println(dataBuffer);
+      }
+    }
+    delay(ESPERA_APOS_PASSO_MEDIA_MS);
+  }
+  
+  // Envia o resto da camada para o servidor não ficar à espera durante a subida do eixo Z.
+  if (usarBinario && registosNaTrama > 0) enviarTrama();
+
+  offsetPassosPrato += PASSOS_POR_ROTACAO_PRATO;
+  Serial.println("Rotação da camada concluída.");
+  Serial.print("Subindo eixo Z para a próxima camada...");
+  motorZ.move(-PASSOS_PARA_SUBIR_CAMADA);
+  while (motorZ.distanceToGo() != 0) motorZ.run();
+  camadaAtual++;
+  Serial.println(" Posicionado.");
+  delay(100);
+}
\ No newline at end of file
@@ -0,0 +1,258 @@
+# --- START OF FILE batch_remesh.py ---
+"""
+Regeneração em lote das malhas de um arquivo de scans.
+
+Aceita pastas e/ou padrões glob de ficheiros de pontos (.p3ds, .txt ou a grelha
+.grid.npz do scan_grid.py) e gera o STL de cada um num pool de processos, no
+modo headless. Numa pasta com o .p3ds e a grelha do mesmo scan, só o .p3ds é
+usado: a grelha deriva dele e daria o mesmo STL. Cada trabalho corre
+no seu próprio processo, que é terminado se exceder o tempo limite. Os
+ficheiros cujo STL já existe e é mais recente do que os pontos são saltados
+(a não ser com --forcar). No fim é mostrada uma tabela com os tempos, o número
+de pontos e o número de triângulos de cada ficheiro.
+
+    python batch_remesh.py scans/ resultados/*.txt --workers 8 --limite 300
+"""
+
+import argparse
+import contextlib
+import glob
+import io
+import multiprocessing
+import os
+import sys
+import time
+from multiprocessing.connection import wait
+
+import point_store
+from scan_grid import GRID_EXTENSION, ScanGrid, is_scan_grid
+
+REMESH_WORKERS = os.cpu_count() or 1
+REMESH_TIMEOUT_SECONDS = 600.0
+POINT_FILE_EXTENSIONS = ('.p3ds', '.txt', GRID_EXTENSION)
+
+STATUS_DONE = "concluido"
+STATUS_SKIPPED = "atualizado"
+STATUS_FAILED = "falhou"
+STATUS_TIMEOUT = "tempo esgotado"
+
+
+def find_point_files(patterns):
+    """Expande pastas e padrões glob numa lista ordenada (sem repetidos) de ficheiros de pontos."""
+    found = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            found.update(os.path.join(pattern, name) for name in os.listdir(pattern)
+                         if name.lower().endswith(POINT_FILE_EXTENSIONS))
+        else:
+            found.update(path for path in (glob.glob(pattern) or [pattern])
+                         if os.path.isfile(path) and path.lower().endswith(POINT_FILE_EXTENSIONS))
+    # Uma grelha com o seu .p3ds ao lado daria o mesmo STL (e escreveria no mesmo ficheiro).
+    bases = {_base_path(path) for path in found if not is_scan_grid(path)}
+    return sorted(path for path in found if not (is_scan_grid(path) and _base_path(path) in bases))
+
+def _base_path(data_path):
+    """Caminho sem a extensão (a de uma grelha, .grid.npz, é dupla)."""
+    return data_path[:-len(GRID_EXTENSION)] if is_scan_grid(data_path) else os.path.splitext(data_path)[0]
+
+def output_path(data_path, output_dir=None):
+    base = os.path.basename(_base_path(data_path))
+    return os.path.join(output_dir or os.path.dirname(data_path), base + ".stl")
+
+def is_up_to_date(data_path, stl_path):
+    return os.path.exists(stl_path) and os.path.getmtime(stl_path) >= os.path.getmtime(data_path)
+
+def count_points(data_path):
+    """
+    Número de pontos: células válidas numa grelha, linhas não vazias no
+    texto. Os .p3ds não passam por aqui (o cabeçalho já tem o total).
+    """
+    if is_scan_grid(data_path):
+        return ScanGrid.load(data_path).point_count
+    with open(data_path, 'rb') as f:
+        return sum(1 for line in f if line.strip())
+
+def _remesh_worker(connection, data_path, stl_path, use_cache, streaming=False):
+    """
+    Executado no processo do trabalho: envia ('pontos', n) se o pai não os
+    pôde contar pelo cabeçalho, e depois ('ok', triângulos) ou (estado, mensagem).
+    """
+    log = io.StringIO()
+    try:
+        if not point_store.is_point_store(data_path):
+            connection.send(('pontos', count_points(data_path)))
+        with contextlib.redirect_stdout(log):
+            if streaming:
+                from streaming_mesh import build_streaming_solid
+                triangle_count = build_streaming_solid(data_path, stl_path)
+            else:
+                from generate_stl import build_universal_solid
+                from mesh_cache import MeshCache
+                # O paralelismo é entre ficheiros: cada trabalho reconstrói as camadas em série.
+                mesh = build_universal_solid(data_path, stl_path, workers=1, headless=True,
+                                             cache=MeshCache() if use_cache else None)
+                triangle_count = None if mesh is None else len(mesh.triangles)
+        if triangle_count is None:
+            errors = [line for line in log.getvalue().splitlines() if 'erro' in line.lower()]
+            connection.send((STATUS_FAILED, errors[-1].strip() if errors else "malha não gerada"))
+        else:
+            connection.send(('ok', triangle_count))
+    except Exception as e:
+        connection.send((STATUS_FAILED, str(e) or type(e).__name__))
+    finally:
+        connection.close()
+
+
+class RemeshJob:
+    """Um ficheiro a processar e o respetivo resultado."""
+
+    def __init__(self, data_path, stl_path):
+        self.data_path = data_path
+        self.stl_path = stl_path
+        self.status = None
+        self.message = ""
+        self.point_count = None
+        self.triangle_count = None
+        self.started_at = None
+        self.finished_at = None
+        self.process = None
+        self.connection = None
+
+    @property
+    def run_time_s(self):
+        return None if self.finished_at is None else self.finished_at - self.started_at
+
+    def start(self, use_cache, streaming=False):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        self.connection = receiver
+        self.process = multiprocessing.Process(target=_remesh_worker,
+                                               args=(sender, self.data_path, self.stl_path, use_cache, streaming))
+        self.started_at = time.perf_counter()
+        self.process.start()
+        sender.close()
+
+    def collect(self):
+        """Lê o resultado do processo (se já o enviou). Devolve True quando o trabalho terminou."""
+        alive = self.process.is_alive()  # Antes de ler: se já tinha terminado, tudo o que enviou está no pipe
+        while self.connection.poll():
+            try:
+                status, value = self.connection.recv()
+            except EOFError:
+                status, value = STATUS_FAILED, "o processo terminou sem resultado"
+            if status == 'pontos':
+                self.point_count = value
+                continue
+            if status == 'ok':
+                self.status, self.triangle_count = STATUS_DONE, value
+            else:
+                self.status, self.message = status, value
+            self.finish()
+            return True
+        if alive:
+            return False
+        self.status = STATUS_FAILED
+        self.message = f"o processo terminou com o código {self.process.exitcode}"
+        self.finish()
+        return True
+
+    def cancel(self, status, message):
+        self.process.terminate()
+        self.status, self.message = status, message
+        self.finish()
+
+    def finish(self):
+        self.finished_at = time.perf_counter()
+        self.process.join()
+        self.connection.close()
+
+
+def run_batch(data_paths, output_dir=None, workers=REMESH_WORKERS, timeout_s=REMESH_TIMEOUT_SECONDS,
+              force=False, use_cache=False, streaming=False):
+    """Processa todos os ficheiros com no máximo `workers` processos em simultâneo. Devolve os trabalhos."""
+    jobs = []
+    pending = []
+    for data_path in data_paths:
+        job = RemeshJob(data_path, output_path(data_path, output_dir))
+        # Só o cabeçalho dos .p3ds é lido aqui; os outros formatos são contados no processo do trabalho.
+        try:
+            if point_store.is_point_store(data_path):
+                job.point_count = point_store.read_header(data_path)['valid_count']
+        except (OSError, ValueError) as e:
+            job.status, job.message = STATUS_FAILED, str(e)
+            jobs.append(job)
+            continue
+        if not force and is_up_to_date(data_path, job.stl_path):
+            job.status = STATUS_SKIPPED
+        else:
+            pending.append(job)
+        jobs.append(job)
+
+    running = []
+    while pending or running:
+        while pending and len(running) < workers:
+            job = pending.pop(0)
+            job.start(use_cache, streaming)
+            running.append(job)
+
+        # Acorda quando um trabalho envia o resultado ou termina, ou para verificar os limites de tempo.
+        next_deadline = min(job.started_at + timeout_s for job in running)
+        wait([job.connection for job in running] + [job.process.sentinel for job in running],
+             timeout=max(0.0, next_deadline - time.perf_counter()))
+
+        still_running = []
+        for job in running:
+            if job.collect():
+                print(f"[{job.status}] {job.data_path}")
+            elif time.perf_counter() - job.started_at > timeout_s:
+                job.cancel(STATUS_TIMEOUT, f"mais de {timeout_s:g} s")
+                print(f"[{job.status}] {job.data_path}")
+            else:
+                still_running.append(job)
+        running = still_running
+    return jobs
+
+def print_summary(jobs, elapsed_s):
+    name_width = max([len(job.data_path) for job in jobs] + [8])
+    print(f"\n{'Ficheiro':{name_width}s} {'Estado':>15s} {'Tempo':>8s} {'Pontos':>9s} {'Triângulos':>11s}")
+    for job in jobs:
+        run_time = f"{job.run_time_s:6.2f} s" if job.run_time_s is not None else "-"
+        points = str(job.point_count) if job.point_count is not None else "-"
+        triangles = str(job.triangle_count) if job.triangle_count is not None else "-"
+        print(f"{job.data_path:{name_width}s} {job.status:>15s} {run_time:>8s} {points:>9s} {triangles:>11s}"
+              + (f"  {job.message}" if job.message else ""))
+
+    counts = {}
+    for job in jobs:
+        counts[job.status] = counts.get(job.status, 0) + 1
+    print(f"\n{len(jobs)} ficheiro(s) em {elapsed_s:.1f} s: "
+          + ", ".join(f"{n} {status}" for status, n in counts.items()))
+
+def main():
+    parser = argparse.ArgumentParser(description="Regenera em lote as malhas de vários ficheiros de pontos.")
+    parser.add_argument('entradas', nargs='+', help="Pastas ou padrões glob (ex.: 'scans/*.p3ds').")
+    parser.add_argument('--pasta-saida', help="Pasta dos STL (por omissão, a de cada ficheiro de pontos).")
+    parser.add_argument('--workers', type=int, default=REMESH_WORKERS, help="Processos em simultâneo.")
+    parser.add_argument('--limite', type=float, default=REMESH_TIMEOUT_SECONDS,
+                        help="Tempo máximo de cada ficheiro, em segundos.")
+    parser.add_argument('--forcar', action='store_true', help="Regenera mesmo os STL já atualizados.")
+    parser.add_argument('--cache', action='store_true', help="Usa a cache de malhas (mesh_cache.py).")
+    parser.add_argument('--fluxo', action='store_true',
+                        help="Gera cada STL em fluxo, com memória constante (streaming_mesh.py; ignora --cache).")
+    args = parser.parse_args()
+
+    data_paths = find_point_files(args.entradas)
+    if not data_paths:
+        print("[ERRO] Nenhum ficheiro de pontos encontrado.")
+        return 1
+    if args.pasta_saida:
+        os.makedirs(args.pasta_saida, exist_ok=True)
+
+    print(f"{len(data_paths)} ficheiro(s) de pontos, {max(1, args.workers)} processo(s).")
+    started_at = time.perf_counter()
+    jobs = run_batch(data_paths, args.pasta_saida, max(1, args.workers), args.limite, args.forcar, args.cache,
+                     args.fluxo)
+    print_summary(jobs, time.perf_counter() - started_at)
+    return 1 if any(job.status in (STATUS_FAILED, STATUS_TIMEOUT) for job in jobs) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+# --- START OF FILE benchmark_ingest.py ---
+"""
+Benchmark ponta-a-ponta da receção: arranca um ScannerServer local, liga-lhe
+N scanners simulados e mede
+
+    * pontos/s ingeridos (todos os scanners juntos; com --amostras, também amostras/s);
+    * latência por ponto, desde o envio até estar no ficheiro (p50/p95/máx);
+    * tempo desde o 'END' até o STL estar escrito (se a geração de malha estiver ativa).
+
+Exemplos:
+    python benchmark_ingest.py --scanners 8 --camadas 60
+    python benchmark_ingest.py --scanners 1 --taxa 4000 --malha --json resultado.json
+"""
+
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+import numpy as np
+
+import point_store
+from scanner_receiver import ScannerServer
+from scanner_simulator import SENSOR_OFFSET_MM, add_arguments, build_readings, make_scanners
+
+SAMPLE_INTERVAL_SECONDS = 0.001  # Frequência com que os cabeçalhos dos ficheiros são consultados
+
+
+async def sample_disk_counts(server, samples, session_ids, stop):
+    """Regista (instante, pontos em disco) para cada sessão, identificada pela porta do cliente."""
+    paths = {}
+    while not stop.is_set():
+        for session in list(server.sessions.values()):
+            paths.setdefault(session.peer[1], session.data_path)
+            session_ids.setdefault(session.peer[1], session.session_id)
+        now = time.perf_counter()
+        for port, path in paths.items():
+            try:
+                count = point_store.read_header(path)['valid_count']
+            except (OSError, ValueError):
+                continue
+            log = samples.setdefault(port, [])
+            if not log or log[-1][1] != count:
+                log.append((now, count))
+        await asyncio.sleep(SAMPLE_INTERVAL_SECONDS)
+
+def readings_ready(scanner, sent_count, samples_per_reading):
+    """
+    Leituras que o recetor já pode gravar depois de `sent_count` envios. Com
+    amostras em bruto, cada leitura é a fusão de `samples_per_reading` amostras
+    e o último ângulo só é fundido quando chega o seguinte (ou o 'END').
+    """
+    if not scanner.raw_accepted:
+        return sent_count
+    if sent_count == len(scanner.readings):
+        return sent_count // samples_per_reading
+    return (sent_count - 1) // samples_per_reading
+
+def point_latencies(scanner, disk_log, valid_cumulative, samples_per_reading=1):
+    """Para cada lote enviado, tempo até o disco conter todos os seus pontos válidos."""
+    if not disk_log:
+        return []
+    disk_times = np.array([t for t, _ in disk_log])
+    disk_counts = np.array([n for _, n in disk_log])
+    latencies = []
+    for sent_at, sent_count in scanner.sent_log:
+        ready = readings_ready(scanner, sent_count, samples_per_reading)
+        if ready == 0:
+            continue
+        needed = valid_cumulative[ready - 1]
+        idx = np.searchsorted(disk_counts, needed)
+        if idx < len(disk_counts):
+            latencies.append(max(0.0, disk_times[idx] - sent_at))
+    return latencies
+
+async def run_benchmark(args):
+    readings = build_readings(args)
+    valid = (readings[:, 0] > 0) & (readings[:, 0] < SENSOR_OFFSET_MM)
+    valid_cumulative = np.cumsum(valid)
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        server = await ScannerServer(host='127.0.0.1', port=0, output_dir=output_dir,
+                                     meshing_workers=args.workers_malha if args.malha else 0,
+                                     angle_step_deg=args.passo).start()
+        samples, session_ids, stop = {}, {}, asyncio.Event()
+        sampler = asyncio.create_task(sample_disk_counts(server, samples, session_ids, stop))
+
+        scanners = make_scanners(readings, args)
+        started_at = time.perf_counter()
+        await asyncio.gather(*[scanner.run('127.0.0.1', server.port) for scanner in scanners])
+
+        # Espera que o servidor feche todas as sessões (o último flush conta para o tempo).
+        while server.sessions:
+            await asyncio.sleep(SAMPLE_INTERVAL_SECONDS)
+        ingest_s = time.perf_counter() - started_at
+        await asyncio.sleep(10 * SAMPLE_INTERVAL_SECONDS)
+        stop.set()
+        await sampler
+
+        stl_times = []
+        if args.malha:
+            await server.close(wait_for_meshing=True)
+            # Os trabalhos de malha e os envios usam o mesmo relógio (time.perf_counter()).
+            for scanner in scanners:
+                job = server.meshing_pool.jobs.get(session_ids.get(scanner.local_port))
+                if job is not None and job.finished_at is not None and scanner.end_sent_at is not None:
+                    stl_times.append(job.finished_at - scanner.end_sent_at)
+        else:
+            await server.close()
+
+        points_on_disk = sum(log[-1][1] for log in samples.values() if log)
+        # Com amostras em bruto, cada scanner envia várias amostras por ponto.
+        samples_sent = sum(scanner.points_sent for scanner in scanners if scanner.raw_accepted)
+        latencies = []
+        for scanner in scanners:
+            latencies += point_latencies(scanner, samples.get(scanner.local_port, []), valid_cumulative,
+                                         args.amostras)
+
+    result = {
+        'scanners': args.scanners,
+        # Pontos válidos, a mesma unidade de 'pontos_em_disco' e 'pontos_por_segundo'.
+        'pontos_por_scanner': int(valid_cumulative[-1]) if len(valid_cumulative) else 0,
+        'pontos_em_disco': int(points_on_disk),
+        'tempo_rececao_s': ingest_s,
+        'pontos_por_segundo': points_on_disk / ingest_s if ingest_s > 0 else 0.0,
+        'amostras_enviadas': int(samples_sent),
+        'amostras_por_segundo': samples_sent / ingest_s if ingest_s > 0 else 0.0,
+        'latencia_p50_ms': float(np.percentile(latencies, 50) * 1000) if latencies else None,
+        'latencia_p95_ms': float(np.percentile(latencies, 95) * 1000) if latencies else None,
+        'latencia_max_ms': float(np.max(latencies) * 1000) if latencies else None,
+        'end_ate_stl_s': stl_times,
+    }
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da receção de dados do scanner.")
+    add_arguments(parser)
+    parser.add_argument('--malha', action='store_true', help="Gera também o STL e mede o tempo END -> STL.")
+    parser.add_argument('--workers-malha', type=int, default=2)
+    parser.add_argument('--json', help="Grava o resultado neste ficheiro JSON.")
+    parser.set_defaults(scanners=8, camadas=60)
+    args = parser.parse_args()
+
+    result = asyncio.run(run_benchmark(args))
+
+    print("\n--- Resultado do Benchmark de Receção ---")
+    print(f"Scanners: {result['scanners']}  |  pontos por scanner: {result['pontos_por_scanner']}")
+    print(f"Pontos em disco: {result['pontos_em_disco']} em {result['tempo_rececao_s']:.2f} s "
+          f"-> {result['pontos_por_segundo']:.0f} pontos/s")
+    if result['amostras_enviadas']:
+        print(f"Amostras em bruto: {result['amostras_enviadas']} -> {result['amostras_por_segundo']:.0f} amostras/s")
+    if result['latencia_p50_ms'] is not None:
+        print(f"Latência envio -> disco: p50 {result['latencia_p50_ms']:.1f} ms, "
+              f"p95 {result['latencia_p95_ms']:.1f} ms, máx {result['latencia_max_ms']:.1f} ms")
+    if result['end_ate_stl_s']:
+        print(f"END -> STL: {', '.join(f'{t:.2f} s' for t in result['end_ate_stl_s'])}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Resultado gravado em '{args.json}'.")
+
+if __name__ == "__main__":
+    main()
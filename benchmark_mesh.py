@@ -0,0 +1,240 @@
+# --- START OF FILE benchmark_mesh.py ---
+"""
+Benchmark da geração de malha para scans de tamanho crescente.
+
+Gera nuvens de pontos sintéticas (cilindro, caixa e a forma "torcida" do
+simulador) para vários tamanhos, desde o scan atual (passo de 1°, ~2 camadas)
+até passos de 0,1° com milhares de camadas, e mede em separado cada fase do
+`build_universal_solid`:
+
+    carregar -> camadas -> splines -> topologia -> pos-processamento -> exportacao
+
+O pós-processamento e a exportação usam o mesh_io (modo headless) ou, com
+--open3d, o open3d. O pico de memória de cada fase é medido com tracemalloc
+numa passagem separada (para não afetar os tempos).
+
+Os resultados podem ser gravados em JSON e comparados com uma baseline: se
+alguma fase ficar mais de --tolerancia vezes mais lenta, o benchmark termina
+com erro (útil antes de levar uma alteração para a oficina).
+
+    python benchmark_mesh.py                       # varrimento rápido
+    python benchmark_mesh.py --completo --json resultado.json
+    python benchmark_mesh.py --gravar-baseline     # grava benchmarks/baseline_mesh.json
+    python benchmark_mesh.py --baseline benchmarks/baseline_mesh.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+import mesh_io
+from generate_stl import (CONTOUR_METHOD, CONTOUR_METHODS, MERGE_DISTANCE_MM, NUM_POINTS_PER_LAYER,
+                          SPLINE_WORKERS, split_layers, resample_layers, build_mesh_arrays)
+from point_store import PointStoreWriter, load_points
+from calibration_profiles import DEFAULT_PROFILE, get_profile, project_readings
+from scanner_simulator import SHAPES, generate_readings
+
+BASELINE_PATH = os.path.join("benchmarks", "baseline_mesh.json")
+STAGES = ('carregar', 'camadas', 'splines', 'topologia', 'pos_processamento', 'exportacao')
+
+# (passo angular em graus, número de camadas)
+QUICK_SIZES = ((1.0, 2), (1.0, 50), (0.5, 200))
+FULL_SIZES = QUICK_SIZES + ((0.25, 500), (0.1, 1000), (0.1, 3000))
+
+REGRESSION_TOLERANCE = 1.5   # Uma fase falha se demorar mais do que tolerância x baseline...
+REGRESSION_SLACK_S = 0.005   # ... mais esta margem absoluta (evita falsos alarmes em fases muito curtas)
+
+
+def make_scan(filepath, shape, angle_step_deg, layers, noise_mm=0.3, seed=0):
+    """Grava um scan sintético em formato .p3ds, tal como o recetor o gravaria."""
+    profile = get_profile(DEFAULT_PROFILE)
+    readings = generate_readings(shape, angle_step_deg, layers, noise_mm=noise_mm,
+                                 sensor_offset_mm=profile.sensor_offset_mm, seed=seed)
+    points, valid = project_readings(readings, profile)
+    with PointStoreWriter(filepath, profile.constants, profile.name, store_raw=True) as writer:
+        writer.write(points, readings[valid])
+    return len(points)
+
+def run_stages(data_path, output_path, num_points_per_layer, workers, use_open3d, on_stage,
+               contour_method=CONTOUR_METHOD):
+    """
+    Corre o pipeline fase a fase, chamando `on_stage(nome)` antes de cada uma e
+    `on_stage(None)` no fim. Devolve o número de camadas e de triângulos.
+    """
+    on_stage('carregar')
+    points_mm = np.asarray(load_points(data_path), dtype=np.float64)
+    on_stage('camadas')
+    layers = split_layers(points_mm)
+    on_stage('splines')
+    rings = resample_layers(layers, num_points_per_layer, workers=workers, method=contour_method)
+    on_stage('topologia')
+    vertices, triangles = build_mesh_arrays(rings)
+
+    on_stage('pos_processamento')
+    if use_open3d:
+        import open3d as o3d
+        mesh = o3d.geometry.TriangleMesh(vertices=o3d.utility.Vector3dVector(vertices),
+                                         triangles=o3d.utility.Vector3iVector(triangles))
+        mesh.merge_close_vertices(MERGE_DISTANCE_MM)
+        mesh.scale(0.001, center=(0, 0, 0))
+        mesh.compute_vertex_normals()
+        on_stage('exportacao')
+        o3d.io.write_triangle_mesh(output_path, mesh)
+        triangle_count = len(mesh.triangles)
+    else:
+        vertices, triangles = mesh_io.merge_close_vertices(vertices, triangles, MERGE_DISTANCE_MM)
+        vertices = vertices * 0.001
+        on_stage('exportacao')
+        mesh_io.write_mesh(output_path, vertices, triangles)
+        triangle_count = len(triangles)
+    on_stage(None)
+    return len(layers), triangle_count
+
+class StageTimer:
+    """Duração de cada fase, em segundos."""
+
+    def __init__(self):
+        self.times = {}
+        self.current = None
+        self.started_at = None
+
+    def __call__(self, stage):
+        now = time.perf_counter()
+        if self.current is not None:
+            self.times[self.current] = now - self.started_at
+        self.current, self.started_at = stage, now
+
+class StageMemory:
+    """Pico de memória alocada (tracemalloc) em cada fase, em MB."""
+
+    def __init__(self):
+        self.peaks = {}
+        self.current = None
+
+    def __call__(self, stage):
+        if self.current is not None:
+            self.peaks[self.current] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.reset_peak()
+        self.current = stage
+
+def benchmark_case(shape, angle_step_deg, layers, args, work_dir):
+    data_path = os.path.join(work_dir, f"{shape}_{angle_step_deg:g}_{layers}.p3ds")
+    output_path = os.path.join(work_dir, "saida.stl")
+    point_count = make_scan(data_path, shape, angle_step_deg, layers)
+
+    best = {}
+    for _ in range(args.repeticoes):
+        timer = StageTimer()
+        layer_count, triangle_count = run_stages(data_path, output_path, args.pontos_por_camada,
+                                                 args.workers, args.open3d, timer, args.contornos)
+        for stage, t in timer.times.items():
+            best[stage] = min(best.get(stage, np.inf), t)
+
+    memory = StageMemory()
+    tracemalloc.start()
+    try:
+        run_stages(data_path, output_path, args.pontos_por_camada, args.workers, args.open3d, memory,
+                   args.contornos)
+    finally:
+        tracemalloc.stop()
+    os.remove(data_path)
+
+    return {
+        'forma': shape,
+        'passo_graus': angle_step_deg,
+        'camadas_pedidas': layers,
+        'pontos': point_count,
+        'camadas': layer_count,
+        'triangulos': triangle_count,
+        'tempos_s': best,
+        'total_s': sum(best.values()),
+        'pico_memoria_mb': memory.peaks,
+    }
+
+def case_key(case):
+    return f"{case['forma']}/{case['passo_graus']:g}/{case['camadas_pedidas']}"
+
+def compare_with_baseline(cases, baseline, tolerance, slack_s):
+    """Devolve a lista de regressões (texto) em relação à baseline."""
+    reference = {case_key(case): case for case in baseline['casos']}
+    regressions = []
+    for case in cases:
+        base = reference.get(case_key(case))
+        if base is None:
+            continue
+        for stage, t in case['tempos_s'].items():
+            limit = base['tempos_s'].get(stage, np.inf) * tolerance + slack_s
+            if t > limit:
+                regressions.append(f"{case_key(case)} {stage}: {t * 1000:.1f} ms "
+                                   f"(baseline {base['tempos_s'][stage] * 1000:.1f} ms)")
+    return regressions
+
+def print_table(cases):
+    header = f"{'Caso':22s} {'Pontos':>9s} {'Triâng.':>9s} " + " ".join(f"{s[:9]:>9s}" for s in STAGES)
+    print("\nTempos por fase (ms) e pico de memória da fase mais pesada:")
+    print(header + f" {'Total':>9s} {'Mem. MB':>8s}")
+    for case in cases:
+        times = " ".join(f"{case['tempos_s'].get(s, 0) * 1000:9.1f}" for s in STAGES)
+        print(f"{case_key(case):22s} {case['pontos']:9d} {case['triangulos']:9d} {times} "
+              f"{case['total_s'] * 1000:9.1f} {max(case['pico_memoria_mb'].values()):8.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark das fases da geração de malha.")
+    parser.add_argument('--formas', nargs='+', choices=sorted(SHAPES), default=sorted(SHAPES))
+    parser.add_argument('--completo', action='store_true', help="Inclui os tamanhos de produção (0,1° e milhares de camadas).")
+    parser.add_argument('--repeticoes', type=int, default=3, help="Repetições por caso (conta a mais rápida).")
+    parser.add_argument('--pontos-por-camada', type=int, default=NUM_POINTS_PER_LAYER)
+    parser.add_argument('--workers', type=int, default=SPLINE_WORKERS, help="Processos para as splines.")
+    parser.add_argument('--open3d', action='store_true', help="Pós-processa e exporta com o open3d.")
+    parser.add_argument('--contornos', choices=CONTOUR_METHODS, default=CONTOUR_METHOD,
+                        help="Reconstrução das camadas (a fase 'splines').")
+    parser.add_argument('--json', help="Grava os resultados neste ficheiro JSON.")
+    parser.add_argument('--baseline', help="Compara com esta baseline e falha se houver regressões.")
+    parser.add_argument('--gravar-baseline', nargs='?', const=BASELINE_PATH, help="Grava os resultados como baseline.")
+    parser.add_argument('--tolerancia', type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args()
+
+    sizes = FULL_SIZES if args.completo else QUICK_SIZES
+    cases = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for shape in args.formas:
+            for angle_step_deg, layers in sizes:
+                case = benchmark_case(shape, angle_step_deg, layers, args, work_dir)
+                cases.append(case)
+                slowest = max(case['tempos_s'], key=case['tempos_s'].get)
+                print(f"{case_key(case):22s} {case['total_s']:7.2f} s (fase dominante: {slowest})")
+    print_table(cases)
+
+    result = {
+        'maquina': {'python': platform.python_version(), 'numpy': np.__version__,
+                    'plataforma': platform.platform(), 'cpus': os.cpu_count()},
+        'parametros': {'pontos_por_camada': args.pontos_por_camada, 'workers': args.workers,
+                       'open3d': args.open3d, 'repeticoes': args.repeticoes, 'contornos': args.contornos},
+        'casos': cases,
+    }
+    for path in (args.json, args.gravar_baseline):
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, indent=2, ensure_ascii=False)
+            print(f"Resultados gravados em '{path}'.")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare_with_baseline(cases, json.load(f), args.tolerancia, REGRESSION_SLACK_S)
+        if regressions:
+            print(f"\n[FALHA] {len(regressions)} regressão(ões) em relação a '{args.baseline}':")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\nSem regressões em relação a '{args.baseline}'.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
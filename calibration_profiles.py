@@ -0,0 +1,190 @@
+# --- START OF FILE calibration_profiles.py ---
+"""
+Registo de perfis de calibração e re-projeção de scans já gravados.
+
+Um perfil junta as três constantes da geometria da montagem
+(SENSOR_OFFSET_MM, OFFSET_X, OFFSET_Y) e, opcionalmente, a inclinação do eixo
+(TILT_X, TILT_Y: deslocamento do centro em mm por mm de altura, estimado por
+calibration_solver.py). Os perfis de origem estão em
+BUILTIN_PROFILES; outros podem ser acrescentados em PROFILES_FILENAME (JSON),
+que tem prioridade sobre os de origem com o mesmo nome.
+
+Como os ficheiros .p3ds guardam também as leituras em bruto
+(distância, ângulo, altura), incluindo as que o perfil rejeitou, um scan pode
+ser re-projetado com outro perfil sem ser repetido:
+
+    python calibration_profiles.py listar
+    python calibration_profiles.py reprojetar curvo scans/*.p3ds
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+from dataclasses import dataclass, asdict
+import numpy as np
+
+import point_store
+
+PROFILES_FILENAME = "calibration_profiles.json"
+DEFAULT_PROFILE = "quadrado"
+
+
+@dataclass(frozen=True)
+class CalibrationProfile:
+    name: str
+    sensor_offset_mm: float
+    offset_x: float = 0.0
+    offset_y: float = 0.0
+    description: str = ""
+    tilt_x: float = 0.0
+    tilt_y: float = 0.0
+
+    @property
+    def constants(self):
+        return (self.sensor_offset_mm, self.offset_x, self.offset_y)
+
+
+BUILTIN_PROFILES = {
+    # Alta precisão para superfícies suaves (cilindros, estátuas, etc.).
+    'curvo': CalibrationProfile('curvo', 107.35, -24.0, -4.0,
+                                "Objetos curvos/orgânicos."),
+    # Compensa o efeito do "cone de luz" em cantos vivos (caixas, peças).
+    'quadrado': CalibrationProfile('quadrado', 105.10, -24.0, -4.0,
+                                   "Objetos quadrados/cantos vivos."),
+}
+
+
+def load_profiles(filepath=PROFILES_FILENAME):
+    """Devolve todos os perfis conhecidos: os de origem mais os do ficheiro JSON."""
+    profiles = dict(BUILTIN_PROFILES)
+    if os.path.exists(filepath):
+        with open(filepath, 'r', encoding='utf-8') as f:
+            for name, values in json.load(f).items():
+                profiles[name] = CalibrationProfile(name=name, **{k: v for k, v in values.items() if k != 'name'})
+    return profiles
+
+def get_profile(name=DEFAULT_PROFILE, filepath=PROFILES_FILENAME):
+    profiles = load_profiles(filepath)
+    if name not in profiles:
+        raise KeyError(f"Perfil de calibração '{name}' desconhecido. Disponíveis: {', '.join(sorted(profiles))}.")
+    return profiles[name]
+
+def profile_from_header(header):
+    """
+    Perfil com que um ficheiro .p3ds foi gravado. O cabeçalho só guarda as três
+    constantes: a inclinação vem do perfil registado, se as constantes coincidirem.
+    """
+    profile = CalibrationProfile(header['profile'], header['sensor_offset_mm'],
+                                 header['offset_x'], header['offset_y'])
+    registered = load_profiles().get(profile.name)
+    if registered is not None and registered.constants == profile.constants:
+        return registered
+    return profile
+
+def save_profile(profile, filepath=PROFILES_FILENAME):
+    """Acrescenta (ou substitui) um perfil no ficheiro JSON."""
+    stored = {}
+    if os.path.exists(filepath):
+        with open(filepath, 'r', encoding='utf-8') as f:
+            stored = json.load(f)
+    values = asdict(profile)
+    del values['name']
+    stored[profile.name] = values
+    with open(filepath, 'w', encoding='utf-8') as f:
+        json.dump(stored, f, indent=2, ensure_ascii=False)
+
+def project_readings(readings, profile):
+    """
+    Converte leituras (distância, ângulo, altura) em pontos XYZ (mm) com o perfil
+    dado. Leituras fora de 0 < d < sensor_offset_mm são descartadas.
+    Devolve (pontos, máscara das leituras válidas).
+    """
+    distance = readings[:, 0]
+    valid = (distance > 0) & (distance < profile.sensor_offset_mm)
+    radius = profile.sensor_offset_mm - distance[valid]
+    theta_rad = np.deg2rad(readings[valid, 1])
+
+    points = np.empty((radius.size, 3))
+    points[:, 2] = readings[valid, 2]
+    points[:, 0] = profile.offset_x + radius * np.cos(theta_rad)
+    points[:, 1] = profile.offset_y + radius * np.sin(theta_rad)
+    if profile.tilt_x or profile.tilt_y:
+        points[:, 0] += profile.tilt_x * points[:, 2]
+        points[:, 1] += profile.tilt_y * points[:, 2]
+    return points, valid
+
+def project_records(readings, profile):
+    """
+    Como `project_readings`, mas com um ponto por leitura: as rejeitadas ficam
+    com x, y = NaN e a altura da leitura, para serem gravadas junto das outras
+    (ver point_store.FLAG_REJECTED). Devolve (pontos (N, 3), máscara das válidas).
+    """
+    points = np.full((len(readings), 3), np.nan)
+    points[:, 2] = readings[:, 2]
+    valid_points, valid = project_readings(readings, profile)
+    points[valid] = valid_points
+    return points, valid
+
+def reprojected_path(filepath, profile_name, output_dir=None):
+    base, ext = os.path.splitext(os.path.basename(filepath))
+    return os.path.join(output_dir or os.path.dirname(filepath), f"{base}_{profile_name}{ext}")
+
+def reproject_store(filepath, profile, output_filepath=None):
+    """
+    Re-aplica um perfil a um scan gravado, numa única passagem vetorizada sobre
+    as leituras em bruto; o filtro de alcance é o do novo perfil. As leituras
+    rejeitadas continuam no ficheiro novo. Em ficheiros anteriores à versão 3
+    do formato, as que o perfil original descartou já não existem.
+    Devolve (ficheiro criado, pontos válidos).
+    """
+    raw = point_store.open_raw(filepath)
+    if raw is None:
+        raise ValueError(f"'{filepath}' não tem leituras em bruto (foi gravado sem elas).")
+    readings = np.asarray(raw, dtype=np.float64)
+    points, valid = project_records(readings, profile)
+
+    output_filepath = output_filepath or reprojected_path(filepath, profile.name)
+    with point_store.PointStoreWriter(output_filepath, profile.constants, profile.name, store_raw=True) as writer:
+        writer.write(points, readings)
+    return output_filepath, int(np.count_nonzero(valid))
+
+def main():
+    parser = argparse.ArgumentParser(description="Perfis de calibração do scanner 3D.")
+    sub = parser.add_subparsers(dest='comando', required=True)
+    sub.add_parser('listar', help="Mostra os perfis disponíveis.")
+    rep = sub.add_parser('reprojetar', help="Re-aplica um perfil a scans já gravados (.p3ds).")
+    rep.add_argument('perfil')
+    rep.add_argument('ficheiros', nargs='+', help="Ficheiros ou padrões glob (ex.: 'scans/*.p3ds').")
+    rep.add_argument('--pasta-saida', help="Pasta para os ficheiros re-projetados (por omissão, a do original).")
+    args = parser.parse_args()
+
+    if args.comando == 'listar':
+        for profile in load_profiles().values():
+            tilt = (f"  TILT_X={profile.tilt_x:+.4f}  TILT_Y={profile.tilt_y:+.4f}"
+                    if profile.tilt_x or profile.tilt_y else "")
+            print(f"{profile.name:12s} SENSOR_OFFSET_MM={profile.sensor_offset_mm:8.2f}  "
+                  f"OFFSET_X={profile.offset_x:7.2f}  OFFSET_Y={profile.offset_y:7.2f}{tilt}  {profile.description}")
+        return
+
+    profile = get_profile(args.perfil)
+    if args.pasta_saida:
+        os.makedirs(args.pasta_saida, exist_ok=True)
+    filepaths = sorted({path for pattern in args.ficheiros for path in (glob.glob(pattern) or [pattern])})
+    started_at = time.perf_counter()
+    total = 0
+    for filepath in filepaths:
+        try:
+            output, n = reproject_store(filepath, profile,
+                                        reprojected_path(filepath, profile.name, args.pasta_saida))
+        except (OSError, ValueError) as e:
+            print(f"[Erro] {filepath}: {e}")
+            continue
+        total += n
+        print(f"{filepath} -> {output} ({n} pontos)")
+    print(f"\n{len(filepaths)} ficheiro(s), {total} pontos re-projetados com o perfil "
+          f"'{profile.name}' em {time.perf_counter() - started_at:.2f} s.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+# --- START OF FILE calibration_solver.py ---
+"""
+Calibração do scanner a partir de um único scan de um cilindro de referência.
+
+Com o cilindro (de raio conhecido) centrado no prato, o scan é projetado sem
+offsets e, em cada camada, é ajustado um círculo por um estimador algébrico
+de forma fechada (Kåsa ou Pratt), depois de uma seleção robusta de pontos por
+RANSAC. Todas as camadas são resolvidas de uma só vez, com operações
+vetorizadas sobre os momentos de cada camada (sem ciclos por camada):
+
+    SENSOR_OFFSET_MM  corrigido até o raio medido ser o raio de referência
+                      (um erro em SENSOR_OFFSET_MM soma-se diretamente ao raio);
+    OFFSET_X/OFFSET_Y simétrico do centro médio dos círculos (o cilindro deve
+                      ficar centrado na origem);
+    TILT_X/TILT_Y     inclinação do eixo: quanto o centro se desloca por mm de
+                      altura (reta ajustada aos centros de todas as camadas).
+
+O resultado é gravado como um perfil com nome (calibration_profiles.json).
+Como os .p3ds guardam as leituras em bruto, o próprio scan de referência (ou
+qualquer outro) pode ser re-projetado com o novo perfil, sem repetir o scan:
+
+    python calibration_solver.py scans/cilindro.p3ds --raio 25 --nome prato1
+    python calibration_profiles.py reprojetar prato1 scans/*.p3ds
+"""
+
+import argparse
+import sys
+import time
+from dataclasses import dataclass, field
+import numpy as np
+
+import point_store
+from calibration_profiles import (CalibrationProfile, DEFAULT_PROFILE, get_profile, project_readings,
+                                  save_profile)
+
+CIRCLE_METHODS = ('pratt', 'kasa')
+CIRCLE_METHOD = 'pratt'
+RANSAC_ITERATIONS = 32         # Círculos candidatos por camada
+RANSAC_SAMPLE_POINTS = 96      # Pontos de cada camada usados para pontuar os candidatos
+RANSAC_THRESHOLD_MM = 1.5      # Distância máxima ao círculo para um ponto contar como inlier
+MIN_POINTS_PER_LAYER = 20
+MAX_ITERATIONS = 5             # Reprojeções para acertar SENSOR_OFFSET_MM
+CONVERGENCE_MM = 1e-3
+PRATT_NEWTON_STEPS = 30
+
+
+def layer_index(z, tolerance=point_store.LAYER_TOLERANCE_MM):
+    """Índice da camada de cada ponto (alturas iguais a menos de `tolerance`) e a altura de cada camada."""
+    keys, layer_ids = np.unique(np.round(z / tolerance), return_inverse=True)
+    return layer_ids, keys * tolerance
+
+def _centered_moments(x, y, layer_ids, n_layers, mask=None):
+    """Médias e momentos centrados (por camada) usados pelos estimadores algébricos."""
+    if mask is not None:
+        x, y, layer_ids = x[mask], y[mask], layer_ids[mask]
+    counts = np.bincount(layer_ids, minlength=n_layers).astype(np.float64)
+    safe = np.maximum(counts, 1)
+
+    def mean(values):
+        return np.bincount(layer_ids, weights=values, minlength=n_layers) / safe
+
+    mean_x, mean_y = mean(x), mean(y)
+    dx, dy = x - mean_x[layer_ids], y - mean_y[layer_ids]
+    dz = dx * dx + dy * dy
+    moments = {
+        'xx': mean(dx * dx), 'yy': mean(dy * dy), 'xy': mean(dx * dy),
+        'xz': mean(dx * dz), 'yz': mean(dy * dz), 'zz': mean(dz * dz),
+    }
+    moments['z'] = moments['xx'] + moments['yy']
+    return counts, mean_x, mean_y, moments
+
+def _kasa(m):
+    """Kåsa: mínimos quadrados de x² + y² + Dx + Ey + F (sistema 2x2 por camada)."""
+    det = m['xx'] * m['yy'] - m['xy'] ** 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        a = (m['xz'] * m['yy'] - m['yz'] * m['xy']) / (2 * det)
+        b = (m['yz'] * m['xx'] - m['xz'] * m['xy']) / (2 * det)
+    return a, b, np.sqrt(a * a + b * b + m['z'])
+
+def _pratt(m):
+    """
+    Pratt (versão de Newton de Chernov): menos enviesado do que o Kåsa quando
+    só se vê parte do círculo. As iterações de Newton correm em todas as camadas
+    ao mesmo tempo; cada camada para quando converge.
+    """
+    cov_xy = m['xx'] * m['yy'] - m['xy'] ** 2
+    a2 = 4 * cov_xy - 3 * m['z'] ** 2 - m['zz']
+    a1 = m['zz'] * m['z'] + 4 * cov_xy * m['z'] - m['xz'] ** 2 - m['yz'] ** 2 - m['z'] ** 3
+    a0 = (m['xz'] ** 2 * m['yy'] + m['yz'] ** 2 * m['xx'] - m['zz'] * cov_xy
+          - 2 * m['xz'] * m['yz'] * m['xy'] + m['z'] ** 2 * cov_xy)
+
+    root = np.zeros_like(a0)
+    value = np.full_like(a0, np.inf)
+    active = np.isfinite(a0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(PRATT_NEWTON_STEPS):
+            new_value = a0 + root * (a1 + root * (a2 + 4 * root * root))
+            diverged = active & (np.abs(new_value) > np.abs(value))
+            root[diverged] = 0.0
+            active &= ~diverged
+            slope = a1 + root * (2 * a2 + 16 * root * root)
+            step = np.where(active, new_value / slope, 0.0)
+            root = root - step
+            value = new_value
+            negative = active & (root < 0)
+            root[negative] = 0.0
+            active &= ~negative & (np.abs(step) > 1e-12 * np.maximum(np.abs(root), 1e-12))
+            if not active.any():
+                break
+        det = root * root - root * m['z'] + cov_xy
+        a = (m['xz'] * (m['yy'] - root) - m['yz'] * m['xy']) / det / 2
+        b = (m['yz'] * (m['xx'] - root) - m['xz'] * m['xy']) / det / 2
+    return a, b, np.sqrt(a * a + b * b + m['z'] + 2 * root)
+
+def fit_circles(x, y, layer_ids, n_layers, method=CIRCLE_METHOD, mask=None):
+    """
+    Ajusta um círculo a cada camada. Devolve (centros (L, 2), raios (L,),
+    pontos usados (L,)); camadas com menos de 3 pontos ficam com NaN.
+    """
+    if method not in CIRCLE_METHODS:
+        raise ValueError(f"Método '{method}' desconhecido. Disponíveis: {', '.join(CIRCLE_METHODS)}.")
+    counts, mean_x, mean_y, moments = _centered_moments(x, y, layer_ids, n_layers, mask)
+    a, b, radius = (_pratt if method == 'pratt' else _kasa)(moments)
+    centers = np.column_stack((mean_x + a, mean_y + b))
+    too_few = counts < 3
+    centers[too_few] = np.nan
+    radius[too_few] = np.nan
+    return centers, radius, counts
+
+def _circumcircles(ax, ay, bx, by, cx, cy):
+    """Círculo que passa por três pontos (vetorizado). Pontos colineares dão NaN."""
+    d = 2 * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
+    a2, b2, c2 = ax * ax + ay * ay, bx * bx + by * by, cx * cx + cy * cy
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ux = (a2 * (by - cy) + b2 * (cy - ay) + c2 * (ay - by)) / d
+        uy = (a2 * (cx - bx) + b2 * (ax - cx) + c2 * (bx - ax)) / d
+    return ux, uy, np.hypot(ax - ux, ay - uy)
+
+def ransac_inliers(x, y, layer_ids, n_layers, threshold_mm=RANSAC_THRESHOLD_MM,
+                   iterations=RANSAC_ITERATIONS, sample_points=RANSAC_SAMPLE_POINTS, seed=0):
+    """
+    RANSAC em todas as camadas ao mesmo tempo: cada camada gera `iterations`
+    círculos a partir de três pontos ao acaso, pontuados numa amostra de
+    `sample_points` pontos da camada. Devolve a máscara dos inliers do melhor
+    círculo de cada camada.
+    """
+    rng = np.random.default_rng(seed)
+    order = np.argsort(layer_ids, kind='stable')
+    counts = np.bincount(layer_ids, minlength=n_layers)
+    starts = np.cumsum(counts) - counts
+
+    def pick(shape):
+        # Índices (em `order`) ao acaso dentro de cada camada.
+        return order[starts.reshape(-1, *([1] * len(shape)))
+                     + (rng.random((n_layers, *shape)) * counts.reshape(-1, *([1] * len(shape)))).astype(np.intp)]
+
+    has_points = counts > 0
+    triples = pick((iterations, 3))[has_points]
+    ux, uy, radius = _circumcircles(x[triples[..., 0]], y[triples[..., 0]], x[triples[..., 1]],
+                                    y[triples[..., 1]], x[triples[..., 2]], y[triples[..., 2]])
+    probe = pick((sample_points,))[has_points]
+    px, py = x[probe][:, None, :], y[probe][:, None, :]
+    error = np.abs(np.hypot(px - ux[..., None], py - uy[..., None]) - radius[..., None])
+    score = np.where(np.isfinite(radius), (error < threshold_mm).sum(axis=2), -1)
+    best = score.argmax(axis=1)
+
+    rows = np.arange(len(best))
+    best_x = np.full(n_layers, np.nan)
+    best_y = np.full(n_layers, np.nan)
+    best_r = np.full(n_layers, np.nan)
+    best_x[has_points], best_y[has_points], best_r[has_points] = ux[rows, best], uy[rows, best], radius[rows, best]
+    error = np.abs(np.hypot(x - best_x[layer_ids], y - best_y[layer_ids]) - best_r[layer_ids])
+    return error < threshold_mm
+
+
+@dataclass
+class CalibrationResult:
+    sensor_offset_mm: float
+    offset_x: float
+    offset_y: float
+    tilt_x: float
+    tilt_y: float
+    reference_radius_mm: float
+    heights: np.ndarray = field(repr=False)
+    centers: np.ndarray = field(repr=False)
+    radii: np.ndarray = field(repr=False)
+    counts: np.ndarray = field(repr=False)
+    rms_mm: float = 0.0
+    inlier_fraction: float = 1.0
+    iterations: int = 0
+    elapsed_s: float = 0.0
+
+    def profile(self, name, description=""):
+        return CalibrationProfile(name, round(self.sensor_offset_mm, 3), round(self.offset_x, 3),
+                                  round(self.offset_y, 3), description,
+                                  round(self.tilt_x, 6), round(self.tilt_y, 6))
+
+    def describe(self):
+        used = self.counts >= MIN_POINTS_PER_LAYER
+        tilt_deg = np.degrees(np.arctan(np.hypot(self.tilt_x, self.tilt_y)))
+        lines = [
+            f"Camadas usadas: {used.sum()} de {len(self.counts)}  |  inliers: {self.inlier_fraction:.1%}  |  "
+            f"{self.iterations} iteração(ões) em {self.elapsed_s * 1000:.1f} ms",
+            f"Raio medido: {np.nanmedian(self.radii[used]):.3f} mm (referência {self.reference_radius_mm:.3f} mm, "
+            f"desvio entre camadas {np.nanstd(self.radii[used]):.3f} mm), erro RMS {self.rms_mm:.3f} mm",
+            f"SENSOR_OFFSET_MM = {self.sensor_offset_mm:.3f}",
+            f"OFFSET_X = {self.offset_x:.3f}",
+            f"OFFSET_Y = {self.offset_y:.3f}",
+            f"TILT_X = {self.tilt_x:+.5f}  TILT_Y = {self.tilt_y:+.5f}  (inclinação do eixo: {tilt_deg:.3f}°)",
+        ]
+        return "\n".join(lines)
+
+
+def _weighted_line(z, values, weights):
+    """Reta (ordenada na origem, declive) ajustada por mínimos quadrados pesados."""
+    if len(z) < 2 or np.ptp(z) == 0:
+        return np.average(values, weights=weights), 0.0
+    slope, intercept = np.polyfit(z, values, 1, w=np.sqrt(weights))
+    return intercept, slope
+
+def solve_calibration(readings, reference_radius_mm=None, sensor_offset_mm=None, method=CIRCLE_METHOD,
+                      use_ransac=True, threshold_mm=RANSAC_THRESHOLD_MM):
+    """
+    Estima as constantes de calibração a partir das leituras em bruto
+    (distância, ângulo, altura) de um cilindro centrado no prato. Sem
+    `reference_radius_mm`, SENSOR_OFFSET_MM fica como está (`sensor_offset_mm`,
+    por omissão o do perfil DEFAULT_PROFILE) e só os offsets e a inclinação são
+    estimados.
+    """
+    started_at = time.perf_counter()
+    readings = np.asarray(readings, dtype=np.float64)
+    if sensor_offset_mm is None:
+        sensor_offset_mm = get_profile(DEFAULT_PROFILE).sensor_offset_mm
+    layer_ids, heights = layer_index(readings[:, 2])
+    n_layers = len(heights)
+    theta_rad = np.deg2rad(readings[:, 1])
+    cos_t, sin_t = np.cos(theta_rad), np.sin(theta_rad)
+
+    inliers = None
+    iterations = 0
+    for iterations in range(1, MAX_ITERATIONS + 1):
+        radius = sensor_offset_mm - readings[:, 0]
+        valid = (readings[:, 0] > 0) & (radius > 0)
+        x, y = radius * cos_t, radius * sin_t
+        if inliers is None:
+            # A seleção de pontos é feita uma vez: as correções seguintes são pequenas.
+            inliers = valid & ransac_inliers(x, y, layer_ids, n_layers, threshold_mm) if use_ransac else valid
+        centers, radii, counts = fit_circles(x, y, layer_ids, n_layers, method, mask=inliers & valid)
+        used = counts >= MIN_POINTS_PER_LAYER
+        if not used.any():
+            raise ValueError(f"Nenhuma camada com pelo menos {MIN_POINTS_PER_LAYER} pontos válidos.")
+        if reference_radius_mm is None:
+            break
+        # Um erro em SENSOR_OFFSET_MM soma-se ao raio de todas as camadas.
+        error = np.average(radii[used], weights=counts[used]) - reference_radius_mm
+        sensor_offset_mm -= error
+        if abs(error) < CONVERGENCE_MM:
+            break
+
+    if reference_radius_mm is not None:
+        # Círculos finais com o SENSOR_OFFSET_MM já corrigido.
+        radius = sensor_offset_mm - readings[:, 0]
+        x, y = radius * cos_t, radius * sin_t
+        centers, radii, counts = fit_circles(x, y, layer_ids, n_layers, method, mask=inliers & valid)
+
+    z, weights = heights[used], counts[used]
+    center_x0, slope_x = _weighted_line(z, centers[used, 0], weights)
+    center_y0, slope_y = _weighted_line(z, centers[used, 1], weights)
+
+    fitted = inliers & valid & used[layer_ids]
+    residual = (np.hypot(x[fitted] - centers[layer_ids[fitted], 0], y[fitted] - centers[layer_ids[fitted], 1])
+                - radii[layer_ids[fitted]])
+    return CalibrationResult(
+        sensor_offset_mm=float(sensor_offset_mm),
+        offset_x=float(-center_x0), offset_y=float(-center_y0),
+        tilt_x=float(-slope_x), tilt_y=float(-slope_y),
+        reference_radius_mm=float(reference_radius_mm if reference_radius_mm is not None else np.nan),
+        heights=heights, centers=centers, radii=radii, counts=counts,
+        rms_mm=float(np.sqrt(np.mean(residual ** 2))) if len(residual) else float('nan'),
+        inlier_fraction=float(fitted.sum() / max(valid.sum(), 1)),
+        iterations=iterations,
+        elapsed_s=time.perf_counter() - started_at,
+    )
+
+def check_profile(readings, profile):
+    """Raio e centro (médios) do cilindro projetado com `profile`: deve dar o raio de referência na origem."""
+    points, _ = project_readings(np.asarray(readings, dtype=np.float64), profile)
+    x, y = points[:, 0], points[:, 1]
+    layer_ids, heights = layer_index(points[:, 2])
+    inliers = ransac_inliers(x, y, layer_ids, len(heights))
+    centers, radii, counts = fit_circles(x, y, layer_ids, len(heights), mask=inliers)
+    used = counts >= MIN_POINTS_PER_LAYER
+    return np.average(radii[used], weights=counts[used]), np.average(centers[used], axis=0, weights=counts[used])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibra o scanner a partir do scan de um cilindro de referência.")
+    parser.add_argument('scan', help="Scan do cilindro (.p3ds com leituras em bruto).")
+    parser.add_argument('--raio', type=float, help="Raio real do cilindro (mm). Sem ele, SENSOR_OFFSET_MM não é alterado.")
+    parser.add_argument('--perfil-inicial', default=DEFAULT_PROFILE,
+                        help="Perfil de onde vem o SENSOR_OFFSET_MM inicial.")
+    parser.add_argument('--metodo', choices=CIRCLE_METHODS, default=CIRCLE_METHOD)
+    parser.add_argument('--sem-ransac', action='store_true', help="Usa todos os pontos válidos.")
+    parser.add_argument('--limiar', type=float, default=RANSAC_THRESHOLD_MM, help="Limiar do RANSAC (mm).")
+    parser.add_argument('--nome', help="Grava o resultado como perfil com este nome.")
+    args = parser.parse_args()
+
+    raw = point_store.open_raw(args.scan)
+    if raw is None:
+        print(f"[ERRO] '{args.scan}' não tem leituras em bruto.")
+        return 1
+    initial = get_profile(args.perfil_inicial)
+    try:
+        result = solve_calibration(raw, args.raio, initial.sensor_offset_mm, args.metodo,
+                                   not args.sem_ransac, args.limiar)
+    except ValueError as e:
+        print(f"[ERRO] {e}")
+        return 1
+
+    print(f"\n--- Calibração a partir de '{args.scan}' ({len(raw)} leituras) ---")
+    print(result.describe())
+    if args.nome:
+        description = f"Calibrado em {time.strftime('%Y-%m-%d')} com '{args.scan}'"
+        if args.raio:
+            description += f" (cilindro de {args.raio:g} mm)"
+        profile = result.profile(args.nome, description)
+        save_profile(profile)
+        radius, center = check_profile(raw, profile)
+        print(f"\nPerfil '{args.nome}' gravado. Verificação: raio {radius:.3f} mm, "
+              f"centro ({center[0]:+.3f}, {center[1]:+.3f}) mm.")
+        print(f"Para o usar: CALIBRATION_PROFILE = \"{args.nome}\" em scanner_receiver.py, ou "
+              f"'python calibration_profiles.py reprojetar {args.nome} <scans>' para os já gravados.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,134 +1,460 @@
 # --- START OF FILE generate_stl.py ---
 
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import numpy as np
-import open3d as o3d
 from scipy.interpolate import splprep, splev
 
-def build_universal_solid(input_filepath, output_filepath):
+from point_store import load_points
+from scan_grid import ScanGrid, is_scan_grid
+from metrics import get_metrics
+import mesh_io
+
+# O open3d só é importado quando é mesmo usado (modo normal, com janela). No modo
+# `headless` a malha é exportada por mesh_io e o open3d nunca é carregado; as fases
+# em numpy (camadas, splines, topologia) são também usadas pelo recetor.
+
+# --- PARÂMETROS DA MALHA ---
+LAYER_TOLERANCE_MM = 0.1     # Salto de Z a partir do qual começa uma nova camada
+MIN_POINTS_PER_LAYER = 10    # Camadas com menos pontos (ou iguais) são descartadas
+NUM_POINTS_PER_LAYER = 180   # Pontos de cada anel depois da reconstrução
+SPLINE_SMOOTHING = 3.0       # Parâmetro `s` do splprep
+MERGE_DISTANCE_MM = 0.01     # Distância do merge_close_vertices final
+LAYERING_SPLIT = "saltos_z"  # Camadas separadas pelos saltos de Z (`split_layers`)
+LAYERING_GRID = "grelha"     # Camadas da grelha camada x ângulo (scan_grid.py)
+
+# --- RECONSTRUÇÃO DOS CONTORNOS ---
+CONTOUR_METHODS = ("spline", "fourier")
+CONTOUR_METHOD = "spline"    # "spline": splprep por camada; "fourier": todas as camadas de uma vez
+FOURIER_HARMONICS = 24       # Harmónicos mantidos no modo "fourier" (menos = mais suave)
+FOURIER_GRID_POINTS = 360    # Ângulos da grelha regular onde cada camada é amostrada (passo de 1°)
+
+# --- RECONSTRUÇÃO EM PARALELO ---
+SPLINE_WORKERS = os.cpu_count() or 1  # Processos (ou threads) para as splines; 1 = em série
+SPLINE_EXECUTOR = "process"           # "process" ou "thread"
+MIN_LAYERS_PER_WORKER = 8             # Abaixo disto o arranque do pool não compensa
+
+
+def split_layers(points_mm, tolerance=LAYER_TOLERANCE_MM, min_points=MIN_POINTS_PER_LAYER):
     """
-    Constrói uma malha 3D sólida e fechada a partir de uma nuvem de pontos,
-    garantindo tampas perfeitamente planas através de triangulação em leque.
+    Separa a nuvem de pontos em camadas sem ciclos em Python: uma nova camada
+    começa sempre que Z salta mais do que `tolerance` entre pontos consecutivos.
+    Devolve uma lista de vistas (sem cópia) do array original.
+    """
+    if len(points_mm) == 0:
+        return []
+    breaks = np.flatnonzero(np.abs(np.diff(points_mm[:, 2])) > tolerance) + 1
+    bounds = np.concatenate(([0], breaks, [len(points_mm)]))
+    sizes = np.diff(bounds)
+    keep = np.flatnonzero(sizes > min_points)
+    return [points_mm[bounds[k]:bounds[k + 1]] for k in keep]
+
+def fit_layer_spline(layer, smoothing=SPLINE_SMOOTHING):
+    """
+    Ajusta uma spline periódica ao contorno de uma camada (pontos ordenados pelo
+    ângulo em torno do centro). Devolve (tck, u_min, u_max, z_médio), que pode
+    ser avaliado a qualquer resolução com `evaluate_layer_spline`.
+    """
+    points_2d = layer[:, :2]
+    center_2d = np.mean(points_2d, axis=0)
+    angles = np.arctan2(points_2d[:, 1] - center_2d[1], points_2d[:, 0] - center_2d[0])
+    sorted_indices = np.argsort(angles)
+    sorted_points_2d = points_2d[sorted_indices]
+    tck, u = splprep([sorted_points_2d[:, 0], sorted_points_2d[:, 1]], s=smoothing, per=True)
+    return tck, u.min(), u.max(), np.mean(layer[:, 2])
+
+def evaluate_layer_spline(spline, num_points_per_layer=NUM_POINTS_PER_LAYER, u_new=None):
+    """
+    Avalia a spline de uma camada em `num_points_per_layer` pontos igualmente
+    espaçados no parâmetro (ou nos parâmetros `u_new`). Devolve (pontos, 3).
+    """
+    tck, u_min, u_max, z_mean = spline
+    if u_new is None:
+        # `endpoint=False` evita a criação de um vértice duplicado no final de cada anel.
+        u_new = np.linspace(u_min, u_max, num_points_per_layer, endpoint=False)
+    x_new, y_new = splev(u_new, tck, der=0)
+    return np.column_stack((x_new, y_new, np.full(len(u_new), z_mean)))
+
+def resample_layer(layer, num_points_per_layer=NUM_POINTS_PER_LAYER, smoothing=SPLINE_SMOOTHING):
+    """
+    Reconstrói o contorno de uma camada com uma spline periódica e devolve
+    `num_points_per_layer` pontos (x, y, z) igualmente espaçados no parâmetro.
+    """
+    return evaluate_layer_spline(fit_layer_spline(layer, smoothing), num_points_per_layer)
+
+def _fill_periodic_gaps(values, empty):
+    """Interpolação linear periódica (ao longo de cada linha) nas posições `empty`."""
+    rows, width = values.shape
+    # Três cópias seguidas de cada linha: o vizinho anterior/seguinte pode estar na volta anterior/seguinte.
+    position = np.where(np.tile(empty, 3), -1, np.arange(3 * width))
+    previous = np.maximum.accumulate(position, axis=1)[:, width:2 * width]
+    position[position < 0] = 3 * width
+    following = np.minimum.accumulate(position[:, ::-1], axis=1)[:, ::-1][:, width:2 * width]
+    tiled = np.tile(values, 3)
+    row = np.arange(rows)[:, None]
+    left, right = tiled[row, previous], tiled[row, following]
+    weight = (np.arange(width, 2 * width) - previous) / np.maximum(following - previous, 1)
+    return left + (right - left) * weight
+
+def resample_layers_fourier(layers, num_points_per_layer=NUM_POINTS_PER_LAYER, harmonics=FOURIER_HARMONICS,
+                            grid_points=FOURIER_GRID_POINTS):
+    """
+    Reconstrói todas as camadas de uma só vez como sinais raio-ângulo: cada
+    camada é amostrada numa grelha regular de `grid_points` ângulos em torno do
+    seu centro (média das leituras de cada ângulo), suavizada por uma FFT
+    truncada em `harmonics` harmónicos e reamostrada em `num_points_per_layer`
+    ângulos igualmente espaçados. Devolve (camadas, pontos, 3), como
+    `resample_layers`.
+
+    Os ângulos sem leituras são preenchidos por interpolação linear entre os
+    vizinhos com leituras (um ajuste de mínimos quadrados só aos ângulos com
+    leituras oscilaria dentro das falhas maiores). Pressupõe que cada contorno
+    é visto do centro como uma função do ângulo, o que é o caso dos scans do
+    prato rotativo.
+    """
+    num_layers = len(layers)
+    if 2 * harmonics >= min(grid_points, num_points_per_layer):
+        raise ValueError(f"São precisos mais de {2 * harmonics} pontos por anel para {harmonics} harmónicos.")
+    sizes = np.array([len(layer) for layer in layers])
+    points = np.concatenate(layers) if num_layers else np.empty((0, 3))
+    layer_ids = np.repeat(np.arange(num_layers), sizes)
+
+    def layer_mean(values):
+        return np.bincount(layer_ids, weights=values, minlength=num_layers) / sizes
+
+    center_x, center_y, z_mean = layer_mean(points[:, 0]), layer_mean(points[:, 1]), layer_mean(points[:, 2])
+    dx, dy = points[:, 0] - center_x[layer_ids], points[:, 1] - center_y[layer_ids]
+    bins = (np.floor((np.arctan2(dy, dx) + np.pi) * (grid_points / (2 * np.pi))).astype(np.intp)) % grid_points
+
+    # Raio médio em cada (camada, ângulo) da grelha.
+    cells = layer_ids * grid_points + bins
+    counts = np.bincount(cells, minlength=num_layers * grid_points).reshape(num_layers, grid_points)
+    sums = np.bincount(cells, weights=np.hypot(dx, dy), minlength=num_layers * grid_points)
+    empty = counts == 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        grid = sums.reshape(num_layers, grid_points) / counts
+
+    gaps = np.flatnonzero(empty.any(axis=1))
+    if len(gaps):
+        grid[gaps] = np.where(empty[gaps], _fill_periodic_gaps(grid[gaps], empty[gaps]), grid[gaps])
+
+    # Espectro truncado, reamostrado diretamente para `num_points_per_layer` ângulos.
+    spectrum = np.zeros((num_layers, num_points_per_layer // 2 + 1), dtype=np.complex128)
+    spectrum[:, :harmonics + 1] = np.fft.rfft(grid, axis=1)[:, :harmonics + 1]
+    radius = np.fft.irfft(spectrum, num_points_per_layer, axis=1) * (num_points_per_layer / grid_points)
+
+    # A grelha começa em -pi; cada célula representa o ângulo do seu centro.
+    angles = -np.pi + (np.arange(num_points_per_layer) + 0.5 * num_points_per_layer / grid_points) \
+        * (2 * np.pi / num_points_per_layer)
+    rings = np.empty((num_layers, num_points_per_layer, 3))
+    rings[..., 0] = center_x[:, None] + radius * np.cos(angles)
+    rings[..., 1] = center_y[:, None] + radius * np.sin(angles)
+    rings[..., 2] = z_mean[:, None]
+    return rings
+
+def _resample_chunk(layers, num_points_per_layer, smoothing):
+    """Executado num processo/thread do pool: reconstrói um bloco de camadas seguidas."""
+    return [resample_layer(layer, num_points_per_layer, smoothing) for layer in layers]
+
+def _fit_chunk(layers, smoothing):
+    """Executado num processo/thread do pool: ajusta as splines de um bloco de camadas."""
+    return [fit_layer_spline(layer, smoothing) for layer in layers]
+
+def _split_chunks(layers, num_chunks):
+    """Divide a lista de camadas em blocos contíguos (mantém a ordem original)."""
+    bounds = np.linspace(0, len(layers), num_chunks + 1).astype(int)
+    return [layers[bounds[k]:bounds[k + 1]] for k in range(num_chunks)]
+
+def _map_layers(chunk_function, layers, args, workers, executor):
+    """
+    Aplica `chunk_function(bloco, *args)` a todas as camadas, em blocos contíguos
+    distribuídos por `workers` processos (ou threads, com `executor="thread"`).
+    Os resultados são devolvidos pela ordem original. Com `workers <= 1`, poucas
+    camadas ou se o pool não puder ser criado, corre em série.
+    """
+    num_chunks = min(workers or 1, len(layers) // MIN_LAYERS_PER_WORKER)
+    if num_chunks > 1:
+        pool_class = ThreadPoolExecutor if executor == "thread" else ProcessPoolExecutor
+        chunks = _split_chunks([np.ascontiguousarray(layer) for layer in layers], num_chunks)
+        try:
+            with pool_class(max_workers=num_chunks) as pool:
+                return [result for chunk in pool.map(chunk_function, chunks,
+                                                     *[[arg] * num_chunks for arg in args])
+                        for result in chunk]
+        except (OSError, RuntimeError) as e:
+            # Ex.: sem permissão para criar processos, ou pool interrompido.
+            print(f"[Aviso] Reconstrução em paralelo indisponível ({e}); a continuar em série.")
+    return chunk_function(layers, *args)
+
+def resample_layers(layers, num_points_per_layer=NUM_POINTS_PER_LAYER, smoothing=SPLINE_SMOOTHING,
+                    workers=SPLINE_WORKERS, executor=SPLINE_EXECUTOR, method="spline",
+                    harmonics=FOURIER_HARMONICS):
+    """
+    Reconstrói todas as camadas para um único array (camadas, pontos, 3).
+    As camadas são independentes, por isso são distribuídas em blocos contíguos
+    por `workers` processos (ou threads, com `executor="thread"`). Os blocos são
+    recolhidos pela ordem original, e cada camada é calculada exatamente como no
+    caminho em série, pelo que o resultado é idêntico byte a byte.
+    Com `method="fourier"` usa `resample_layers_fourier` (sem pool: é vetorizado).
+    """
+    if method == "fourier":
+        return resample_layers_fourier(layers, num_points_per_layer, harmonics)
+    if method != "spline":
+        raise ValueError(f"Método de reconstrução '{method}' desconhecido. Disponíveis: {', '.join(CONTOUR_METHODS)}.")
+    rings = np.empty((len(layers), num_points_per_layer, 3))
+    results = _map_layers(_resample_chunk, layers, (num_points_per_layer, smoothing), workers, executor)
+    for i, ring in enumerate(results):
+        rings[i] = ring
+    return rings
+
+def fit_layers(layers, smoothing=SPLINE_SMOOTHING, workers=SPLINE_WORKERS, executor=SPLINE_EXECUTOR):
+    """Ajusta as splines de todas as camadas (em paralelo, como `resample_layers`)."""
+    return _map_layers(_fit_chunk, layers, (smoothing,), workers, executor)
+
+def wall_triangles(first_ring, num_rings, n):
+    """
+    Triângulos das paredes entre os anéis `first_ring` .. `first_ring + num_rings - 1`
+    (cada anel com `n` vértices seguidos): dois triângulos por quadrilátero,
+    pela mesma ordem do ciclo original.
+    """
+    j = np.arange(n)
+    j_next = (j + 1) % n
+    lower = ((first_ring + np.arange(num_rings - 1)) * n)[:, None]
+    p1 = lower + j
+    p2 = lower + j_next
+    p3 = p1 + n
+    p4 = p2 + n
+    return np.stack((np.stack((p1, p2, p3), axis=-1),
+                     np.stack((p2, p4, p3), axis=-1)), axis=2).reshape(-1, 3)
+
+def cap_triangles(num_rings, n):
+    """
+    Tampas em leque na base e no topo. Os centros são os dois vértices a
+    seguir aos anéis (base primeiro, depois topo).
+    """
+    j = np.arange(n)
+    j_next = (j + 1) % n
+    bottom_center_index = num_rings * n
+    top_center_index = bottom_center_index + 1
+    top_start = (num_rings - 1) * n
+    bottom = np.column_stack((np.full(n, bottom_center_index), j_next, j))
+    top = np.column_stack((np.full(n, top_center_index), top_start + j, top_start + j_next))
+    return np.concatenate((bottom, top))
+
+def build_mesh_arrays(rings):
+    """
+    Constrói os vértices e os triângulos do sólido a partir dos anéis
+    (camadas, pontos, 3): paredes entre anéis consecutivos e tampas planas em
+    leque na base e no topo. Toda a topologia é gerada por aritmética de
+    índices, num único array de vértices pré-alocado.
+    """
+    num_layers, n = rings.shape[:2]
+    ring_vertex_count = num_layers * n
+
+    # Vértices: todos os anéis, depois o centro da base e o centro do topo.
+    vertices = np.empty((ring_vertex_count + 2, 3))
+    vertices[:ring_vertex_count] = rings.reshape(-1, 3)
+    vertices[ring_vertex_count] = rings[0].mean(axis=0)
+    vertices[ring_vertex_count + 1] = rings[-1].mean(axis=0)
+
+    triangles = np.concatenate((wall_triangles(0, num_layers, n),
+                                cap_triangles(num_layers, n))).astype(np.int32)
+    return vertices, triangles
+
+def finalize_mesh(vertices, triangles, output_filepath, headless=False, merge=True):
+    """
+    Junta os vértices coincidentes (se `merge`), converte de mm para metros,
+    calcula as normais e grava o ficheiro. Devolve a malha: um
+    `open3d.geometry.TriangleMesh` ou, com `headless=True`, um
+    `mesh_io.TriangleMesh` (sem importar o open3d; apenas .stl e .ply binários).
+    """
+    metrics = get_metrics()
+    if headless:
+        with metrics.stage('pos_processamento'):
+            if merge:
+                vertices, triangles = mesh_io.merge_close_vertices(vertices, triangles, MERGE_DISTANCE_MM)
+            vertices = vertices * 0.001
+        with metrics.stage('exportacao'):
+            mesh_io.write_mesh(output_filepath, vertices, triangles)
+        print(f"\nMalha final criada com {len(triangles)} triângulos.")
+        print(f"[SUCESSO] Malha 3D sólida exportada para '{output_filepath}'.")
+        return mesh_io.TriangleMesh(vertices, triangles)
+
+    import open3d as o3d
+
+    with metrics.stage('pos_processamento'):
+        final_mesh = o3d.geometry.TriangleMesh(
+            vertices=o3d.utility.Vector3dVector(vertices),
+            triangles=o3d.utility.Vector3iVector(triangles)
+        )
+
+        if merge:
+            final_mesh.merge_close_vertices(MERGE_DISTANCE_MM)
+        final_mesh.scale(0.001, center=(0,0,0))
+        final_mesh.compute_vertex_normals()
+
+    print(f"\nMalha final criada com {len(final_mesh.triangles)} triângulos.")
+
+    with metrics.stage('exportacao'):
+        o3d.io.write_triangle_mesh(output_filepath, final_mesh)
+    print(f"[SUCESSO] Malha 3D sólida exportada para '{output_filepath}'.")
+    return final_mesh
+
+def _load_input_points(input_filepath):
+    """
+    Carrega os pontos em mm (float64) e, se o ficheiro for uma grelha
+    (scan_grid.py), a própria grelha, lida uma só vez. Devolve (pontos, grelha
+    ou None), ou (None, None), com uma mensagem, se não for possível.
     """
-    print(f"\n A iniciar a construção da malha a partir de '{input_filepath}'")
-    
-    # --- PASSO 1: Carregar os Dados ---
     try:
-        points_mm = np.loadtxt(input_filepath, delimiter=",")
+        grid = ScanGrid.load(input_filepath) if is_scan_grid(input_filepath) else None
+        points_mm = grid.to_xyz() if grid is not None else np.asarray(load_points(input_filepath), dtype=np.float64)
         if points_mm.shape[0] < 50:
             print(f"[Erro] Ficheiro contém muito poucos pontos ({points_mm.shape[0]}). A abortar.")
-            return
+            return None, None
         print(f"Nuvem de pontos carregada com {points_mm.shape[0]} pontos.")
+        return points_mm, grid
     except Exception as e:
         print(f"[Erro] Falha ao carregar o ficheiro '{input_filepath}': {e}")
-        return
-
-    # --- PASSO 2: Separar Pontos em Camadas ---
-    print("A separar os pontos em camadas...")
-    layers = []
-    if len(points_mm) > 0:
-        current_layer = [points_mm[0]]
-        for i in range(1, len(points_mm)):
-            if abs(points_mm[i, 2] - current_layer[0][2]) > 0.1:
-                if len(current_layer) > 10:
-                    layers.append(np.array(current_layer))
-                current_layer = []
-            current_layer.append(points_mm[i])
-        if len(current_layer) > 10:
-            layers.append(np.array(current_layer))
-    print(f"Detectadas {len(layers)} camadas válidas.")
-
-    if len(layers) < 2:
-        print("[ERRO] Não foram detectadas camadas suficientes (precisa de pelo menos 2).")
-        return
-
-    # --- PASSO 3: RECONSTRUIR CADA CAMADA COM SPLINES ---
-    print("A reconstruir o contorno de cada camada com splines...")
-    resampled_layers = []
-    num_points_per_layer = 180 
-
-    for layer in layers:
-        points_2d = layer[:, :2]
-        center_2d = np.mean(points_2d, axis=0)
-        angles = np.arctan2(points_2d[:, 1] - center_2d[1], points_2d[:, 0] - center_2d[0])
-        sorted_indices = np.argsort(angles)
-        sorted_points_2d = points_2d[sorted_indices]
-        tck, u = splprep([sorted_points_2d[:, 0], sorted_points_2d[:, 1]], s=3.0, per=True)
-        
-        # <-- A CORREÇÃO ESTÁ AQUI: Adicionar `endpoint=False`
-        # Isto evita a criação de um vértice duplicado no final de cada anel.
-        u_new = np.linspace(u.min(), u.max(), num_points_per_layer, endpoint=False)
-        
-        x_new, y_new = splev(u_new, tck, der=0)
-        z_mean = np.mean(layer[:, 2])
-        resampled_layer = np.vstack((x_new, y_new, np.full(num_points_per_layer, z_mean))).T
-        resampled_layers.append(resampled_layer)
-
-    # --- PASSO 4: CONSTRUIR VÉRTICES E PAREDES ---
-    print("A construir as paredes da malha...")
-    all_vertices = np.vstack(resampled_layers)
-    all_triangles = []
-
-    for i in range(len(resampled_layers) - 1):
-        lower_layer_start_index = i * num_points_per_layer
-        upper_layer_start_index = (i + 1) * num_points_per_layer
-        
-        for j in range(num_points_per_layer):
-            p1 = lower_layer_start_index + j
-            p2 = lower_layer_start_index + (j + 1) % num_points_per_layer
-            p3 = upper_layer_start_index + j
-            p4 = upper_layer_start_index + (j + 1) % num_points_per_layer
-            
-            all_triangles.append([p1, p2, p3])
-            all_triangles.append([p2, p4, p3])
-
-    # --- PASSO 5: CRIAR TAMPAS PLANAS COM TRIANGULAÇÃO EM LEQUE ---
-    print("A criar tampas planas para a base e o topo...")
-    
-    # Tampa da Base
-    bottom_layer_vertices = resampled_layers[0]
-    bottom_center_point = np.mean(bottom_layer_vertices, axis=0)
-    all_vertices = np.vstack([all_vertices, bottom_center_point])
-    bottom_center_index = len(all_vertices) - 1
-    
-    for j in range(num_points_per_layer):
-        p1 = j
-        p2 = (j + 1) % num_points_per_layer
-        all_triangles.append([bottom_center_index, p2, p1])
-
-    # Tampa do Topo
-    top_layer_vertices = resampled_layers[-1]
-    top_center_point = np.mean(top_layer_vertices, axis=0)
-    all_vertices = np.vstack([all_vertices, top_center_point])
-    top_center_index = len(all_vertices) - 1
-    
-    top_layer_start_index = (len(resampled_layers) - 1) * num_points_per_layer
-    for j in range(num_points_per_layer):
-        p1 = top_layer_start_index + j
-        p2 = top_layer_start_index + (j + 1) % num_points_per_layer
-        all_triangles.append([top_center_index, p1, p2])
-
-    # --- PASSO 6: JUNTAR TUDO E FINALIZAR ---
+        return None, None
+
+def stage_keys(source_key, num_points_per_layer=NUM_POINTS_PER_LAYER, contour_method=CONTOUR_METHOD,
+               layering=LAYERING_SPLIT):
+    """
+    Chaves da cache de cada fase: cada uma depende da anterior e dos parâmetros
+    da própria fase. `layering` diz como as camadas são formadas (saltos de Z ou
+    a grelha): os mesmos pontos podem dar camadas diferentes num e noutro caso.
+    """
+    from mesh_cache import content_hash
+    if layering == LAYERING_GRID:
+        layers_key = content_hash(source_key, layering, MIN_POINTS_PER_LAYER)
+    else:
+        layers_key = content_hash(source_key, layering, LAYER_TOLERANCE_MM, MIN_POINTS_PER_LAYER)
+    if contour_method == "fourier":
+        rings_key = content_hash(layers_key, num_points_per_layer, contour_method, FOURIER_HARMONICS,
+                                 FOURIER_GRID_POINTS)
+    else:
+        rings_key = content_hash(layers_key, num_points_per_layer, SPLINE_SMOOTHING)
+    mesh_key = content_hash(rings_key, MERGE_DISTANCE_MM)
+    return {'camadas': layers_key, 'aneis': rings_key, 'malha': mesh_key}
+
+def build_universal_solid(input_filepath, output_filepath, show_result=True,
+                          num_points_per_layer=NUM_POINTS_PER_LAYER, workers=SPLINE_WORKERS,
+                          headless=False, cache=None, contour_method=CONTOUR_METHOD):
+    """
+    Constrói uma malha 3D sólida e fechada a partir de uma nuvem de pontos,
+    garantindo tampas perfeitamente planas através de triangulação em leque.
+    Com `show_result=False` não abre a janela de visualização (uso em servidor).
+    `workers` é o número de processos usados na reconstrução das camadas.
+    Com `headless=True` não usa o open3d nem a interface gráfica (uso em lote).
+    Com uma `cache` (mesh_cache.MeshCache), as fases já calculadas para os
+    mesmos pontos e parâmetros são reaproveitadas.
+    `contour_method` escolhe a reconstrução das camadas: "spline" (uma spline
+    por camada) ou "fourier" (todas as camadas de uma vez, ver FOURIER_HARMONICS).
+    Devolve a malha final, ou None se não foi possível construí-la.
+    A duração de cada fase é registada em `metrics.get_metrics()`.
+    """
+    print(f"\n A iniciar a construção da malha a partir de '{input_filepath}'")
+    metrics = get_metrics()
+    points_mm = grid = None
+    keys = None
+    cached_mesh = cached_rings = cached_layers = None
+
+    # --- PASSO 0: Procurar a fase mais avançada já na cache ---
+    if cache is not None:
+        source_key = cache.source_key(input_filepath)
+        if source_key is None:
+            with metrics.stage('carregar'):
+                points_mm, grid = _load_input_points(input_filepath)
+            if points_mm is None:
+                return
+            source_key = cache.remember_source(input_filepath, points_mm)
+        keys = stage_keys(source_key, num_points_per_layer, contour_method,
+                          LAYERING_GRID if is_scan_grid(input_filepath) else LAYERING_SPLIT)
+        cached_mesh = cache.get('malha', keys['malha'])
+        if cached_mesh is None:
+            cached_rings = cache.get('aneis', keys['aneis'])
+            if cached_rings is None:
+                cached_layers = cache.get('camadas', keys['camadas'])
+
+    if cached_mesh is not None:
+        print("Malha encontrada na cache.")
+        all_vertices, all_triangles = cached_mesh['vertices'], cached_mesh['triangles']
+    else:
+        if cached_rings is not None:
+            print("Contornos das camadas encontrados na cache.")
+            rings = cached_rings['rings']
+        else:
+            if cached_layers is not None:
+                print("Camadas encontradas na cache.")
+                layers = np.split(cached_layers['points'], cached_layers['bounds'][1:-1])
+            else:
+                # --- PASSO 1: Carregar os Dados ---
+                if points_mm is None:
+                    with metrics.stage('carregar'):
+                        points_mm, grid = _load_input_points(input_filepath)
+                    if points_mm is None:
+                        return
+
+                # --- PASSO 2: Separar Pontos em Camadas ---
+                print("A separar os pontos em camadas...")
+                with metrics.stage('camadas'):
+                    if grid is not None:
+                        # A grelha já está separada por camadas: não há saltos de Z a procurar.
+                        layers = grid.layers(MIN_POINTS_PER_LAYER)
+                    else:
+                        layers = split_layers(points_mm)
+                if cache is not None:
+                    cache.put('camadas', keys['camadas'],
+                              points=np.concatenate(layers) if layers else np.empty((0, 3)),
+                              bounds=np.cumsum([0] + [len(layer) for layer in layers]))
+            print(f"Detectadas {len(layers)} camadas válidas.")
+
+            if len(layers) < 2:
+                print("[ERRO] Não foram detectadas camadas suficientes (precisa de pelo menos 2).")
+                return
+
+            # --- PASSO 3: RECONSTRUIR O CONTORNO DE CADA CAMADA ---
+            if contour_method == "fourier":
+                print(f"A reconstruir o contorno de todas as camadas (série de Fourier, {FOURIER_HARMONICS} harmónicos)...")
+            else:
+                print("A reconstruir o contorno de cada camada com splines...")
+            with metrics.stage('splines', camadas=len(layers), metodo=contour_method):
+                rings = resample_layers(layers, num_points_per_layer, workers=workers, method=contour_method)
+            if cache is not None:
+                cache.put('aneis', keys['aneis'], rings=rings)
+
+        # --- PASSOS 4 e 5: CONSTRUIR VÉRTICES, PAREDES E TAMPAS PLANAS EM LEQUE ---
+        print("A construir as paredes da malha e as tampas planas para a base e o topo...")
+        with metrics.stage('topologia'):
+            all_vertices, all_triangles = build_mesh_arrays(rings)
+        if cache is not None:
+            # Guarda a malha já com os vértices juntos: reexportar não repete o merge.
+            all_vertices, all_triangles = mesh_io.merge_close_vertices(all_vertices, all_triangles,
+                                                                       MERGE_DISTANCE_MM)
+            cache.put('malha', keys['malha'], vertices=all_vertices, triangles=all_triangles)
+
+    if cache is not None:
+        print(cache.describe())
+        cache.save()
+
+    # --- PASSOS 6 e 7: JUNTAR TUDO, FINALIZAR E GUARDAR ---
     print("A combinar e finalizar o modelo...")
-    final_mesh = o3d.geometry.TriangleMesh(
-        vertices=o3d.utility.Vector3dVector(all_vertices),
-        triangles=o3d.utility.Vector3iVector(all_triangles)
-    )
-    
-    final_mesh.merge_close_vertices(0.01)
-    final_mesh.scale(0.001, center=(0,0,0))
-    final_mesh.compute_vertex_normals()
-    
-    print(f"\nMalha final criada com {len(final_mesh.triangles)} triângulos.")
-    
-    # --- PASSO 7: GUARDAR E VISUALIZAR ---
-    o3d.io.write_triangle_mesh(output_filepath, final_mesh)
-    print(f"[SUCESSO] Malha 3D sólida exportada para '{output_filepath}'.")
+    final_mesh = finalize_mesh(all_vertices, all_triangles, output_filepath, headless,
+                               merge=cache is None)
+
+    if headless or not show_result:
+        return final_mesh
 
+    import open3d as o3d
+    if points_mm is None:
+        points_mm = np.asarray(load_points(input_filepath), dtype=np.float64)
     pcd_original = o3d.geometry.PointCloud()
     pcd_original.points = o3d.utility.Vector3dVector(points_mm / 1000.0)
     pcd_original.paint_uniform_color([0.8, 0.2, 0.2])
-    
+
     o3d.visualization.draw_geometries(
-        [pcd_original, final_mesh], 
+        [pcd_original, final_mesh],
         window_name="Resultado (Vermelho = Original, Cinza = Final)"
-    )
\ No newline at end of file
+    )
+    return final_mesh
@@ -0,0 +1,98 @@
+# --- START OF FILE incremental_mesher.py ---
+"""
+Geração da malha em direto, enquanto o scan ainda está a decorrer.
+
+O `IncrementalMesher` recebe os pontos à medida que chegam ao recetor. Assim
+que Z muda (a camada atual terminou), reconstrói o contorno dessa camada com a
+mesma spline do `generate_stl` e acrescenta as paredes que a ligam ao anel
+anterior. No 'END' só falta a última camada e as tampas, por isso o tempo entre
+o fim do scan e o STL já não depende do número de camadas.
+
+As camadas são separadas pelos mesmos critérios do `generate_stl.split_layers`
+(salto de Z acima de LAYER_TOLERANCE_MM, camadas com MIN_POINTS_PER_LAYER pontos
+ou menos descartadas), pelo que os vértices e triângulos obtidos são os mesmos
+de `build_mesh_arrays` sobre o ficheiro completo.
+"""
+
+import numpy as np
+
+from generate_stl import (LAYER_TOLERANCE_MM, MIN_POINTS_PER_LAYER, NUM_POINTS_PER_LAYER,
+                          SPLINE_SMOOTHING, resample_layer, wall_triangles, cap_triangles)
+
+
+class IncrementalMesher:
+    """
+    Constrói os anéis e as paredes camada a camada. `add_points()` aceita lotes
+    de qualquer tamanho (N, 3) em mm; `finish()` fecha a malha e devolve
+    (vértices, triângulos), ou None se não houver camadas suficientes.
+    """
+
+    def __init__(self, num_points_per_layer=NUM_POINTS_PER_LAYER, tolerance=LAYER_TOLERANCE_MM,
+                 min_points=MIN_POINTS_PER_LAYER, smoothing=SPLINE_SMOOTHING):
+        self.num_points_per_layer = num_points_per_layer
+        self.tolerance = tolerance
+        self.min_points = min_points
+        self.smoothing = smoothing
+        self.current_layer = []   # Lotes (ou fatias) da camada ainda aberta
+        self.current_count = 0
+        self.last_z = None
+        self.rings = []
+        self.walls = []
+        self.error = None
+
+    @property
+    def ring_count(self):
+        return len(self.rings)
+
+    def add_points(self, points):
+        """Acrescenta pontos; fecha (e reconstrói) todas as camadas que terminam neste lote."""
+        if self.error is not None or len(points) == 0:
+            return
+        z = points[:, 2]
+        breaks = np.flatnonzero(np.abs(np.diff(z, prepend=z[0] if self.last_z is None else self.last_z))
+                                > self.tolerance)
+        start = 0
+        for cut in breaks:
+            self._append(points[start:cut])
+            self._close_layer()
+            start = cut
+        self._append(points[start:])
+        self.last_z = z[-1]
+
+    def _append(self, points):
+        if len(points):
+            self.current_layer.append(np.array(points, dtype=np.float64))
+            self.current_count += len(points)
+
+    def _close_layer(self):
+        layer_count = self.current_count
+        layer = np.concatenate(self.current_layer) if self.current_layer else None
+        self.current_layer = []
+        self.current_count = 0
+        if layer_count <= self.min_points:
+            return
+        try:
+            ring = resample_layer(layer, self.num_points_per_layer, self.smoothing)
+        except Exception as e:
+            # Uma camada degenerada invalida a malha em direto; quem chama
+            # pode recorrer à geração completa a partir do ficheiro.
+            self.error = f"camada {len(self.rings)}: {e}"
+            return
+        self.rings.append(ring)
+        if len(self.rings) > 1:
+            self.walls.append(wall_triangles(len(self.rings) - 2, 2, self.num_points_per_layer))
+
+    def finish(self):
+        """Fecha a última camada e acrescenta as tampas. Devolve (vértices, triângulos) ou None."""
+        if self.error is None:
+            self._close_layer()
+        if self.error is not None or len(self.rings) < 2:
+            return None
+        n = self.num_points_per_layer
+        ring_vertex_count = len(self.rings) * n
+        vertices = np.empty((ring_vertex_count + 2, 3))
+        vertices[:ring_vertex_count] = np.concatenate(self.rings)
+        vertices[ring_vertex_count] = self.rings[0].mean(axis=0)
+        vertices[ring_vertex_count + 1] = self.rings[-1].mean(axis=0)
+        triangles = np.concatenate(self.walls + [cap_triangles(len(self.rings), n)]).astype(np.int32)
+        return vertices, triangles
@@ -1,116 +1,287 @@
 # --- START OF FILE live_visualizer.py (Corrigido para Tempo Real) ---
 
+import argparse
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 import numpy as np
 import time
+import glob
 import os
 
+from point_store import PointTail
+from point_feed import PointFeedClient, POINTS, POINTS_LOST, SESSION_END, SESSION_START
+
 # --- CONFIGURAÇÕES ---
-DATA_FILENAME = "3dScanner_Data.txt"
+SCANS_DIR = "scans"  # Pasta onde o scanner_receiver grava cada sessão
 UPDATE_INTERVAL_SECONDS = 0.5 # Com que frequência o script verifica o ficheiro
+FEED_UPDATE_INTERVAL_SECONDS = 0.02  # Com o canal do recetor (point_feed.py), os pontos chegam sem polling
+RENDER_BUDGET_POINTS = 30000  # Acima disto, o gráfico recebe uma vista decimada da nuvem
+RENDER_DECIMATION = "voxel"   # "voxel" (um ponto por voxel) ou "passo" (um ponto em cada N)
+RENDER_VOXEL_MM = 1.0         # Aresta dos voxels da decimação "voxel"
 
-def read_new_points(file_handle):
-    """Lê todas as novas linhas disponíveis e retorna-as como um array numpy em mm."""
-    new_lines = file_handle.readlines()
-    if not new_lines:
-        return None
-    
-    new_points = []
-    for line in new_lines:
-        line = line.strip()
-        if line:
-            try:
-                # Assume que os dados estão separados por vírgulas
-                coords = [float(val) for val in line.split(',')]
-                new_points.append(coords)
-            except (ValueError, IndexError):
-                # Ignora linhas mal formatadas
-                pass
-    
-    return np.array(new_points) if new_points else None
+def find_latest_scan():
+    """Devolve o ficheiro de sessão mais recente em SCANS_DIR (ou None)."""
+    files = glob.glob(os.path.join(SCANS_DIR, "*.p3ds"))
+    return max(files, key=os.path.getmtime) if files else None
 
-def set_equal_aspect_3d(ax, all_points):
+class PointBuffer:
+    """
+    Nuvem de pontos que cresce sem copiar tudo a cada lote: a capacidade duplica
+    quando enche, por isso acrescentar custa O(pontos novos) amortizado. Os
+    limites dos eixos (`lower`, `upper`) são atualizados só com os pontos novos.
+    """
+
+    def __init__(self, capacity=4096):
+        self.data = np.empty((capacity, 3))
+        self.size = 0
+        self.lower = np.full(3, np.inf)
+        self.upper = np.full(3, -np.inf)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def points(self):
+        """Vista (sem cópia) dos pontos acumulados."""
+        return self.data[:self.size]
+
+    def append(self, points):
+        if len(points) == 0:
+            return
+        needed = self.size + len(points)
+        if needed > len(self.data):
+            grown = np.empty((max(needed, 2 * len(self.data)), 3))
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size:needed] = points
+        self.size = needed
+        np.minimum(self.lower, points.min(axis=0), out=self.lower)
+        np.maximum(self.upper, points.max(axis=0), out=self.upper)
+
+    def clear(self):
+        self.size = 0
+        self.lower.fill(np.inf)
+        self.upper.fill(-np.inf)
+
+
+class VoxelDecimator:
+    """Guarda o primeiro ponto que cai em cada voxel; só os pontos novos são analisados."""
+
+    def __init__(self, voxel_mm=RENDER_VOXEL_MM):
+        self.voxel_mm = voxel_mm
+        self.occupied = set()
+        self.buffer = PointBuffer()
+
+    def add(self, points):
+        if len(points) == 0:
+            return
+        # Índices dos voxels empacotados num único inteiro (21 bits por eixo).
+        cells = np.floor(points / self.voxel_mm).astype(np.int64) + (1 << 20)
+        keys = (cells[:, 0] << 42) | (cells[:, 1] << 21) | cells[:, 2]
+        keys, first = np.unique(keys, return_index=True)
+        is_new = np.array([key not in self.occupied for key in keys.tolist()], dtype=bool)
+        self.occupied.update(keys[is_new].tolist())
+        self.buffer.append(points[np.sort(first[is_new])])
+
+    def clear(self):
+        self.occupied.clear()
+        self.buffer.clear()
+
+
+def render_view(buffer, decimator=None, budget=RENDER_BUDGET_POINTS):
+    """
+    Pontos a entregar ao matplotlib: todos até `budget`; acima disso, os
+    representantes de cada voxel (se houver `decimator`) e, se ainda forem
+    demasiados, um em cada N. Devolve sempre vistas, sem copiar a nuvem.
+    """
+    points = buffer.points
+    if len(points) <= budget:
+        return points
+    if decimator is not None:
+        points = decimator.buffer.points
+    stride = -(-len(points) // budget)
+    return points[::stride]
+
+def set_equal_aspect_3d(ax, lower, upper):
     """
     Ajusta os limites dos eixos para que a escala seja 1:1:1,
     dando uma representação visual correta das proporções do objeto.
+    `lower` e `upper` são os mínimos e máximos de X, Y e Z.
     """
-    if len(all_points) == 0:
+    if not np.all(np.isfinite(lower)):
         return
 
-    x_vals, y_vals, z_vals = all_points[:, 0], all_points[:, 1], all_points[:, 2]
-    max_range = np.array([
-        x_vals.max() - x_vals.min(), 
-        y_vals.max() - y_vals.min(), 
-        z_vals.max() - z_vals.min()
-    ]).max()
+    max_range = (upper - lower).max()
     
     # Adiciona uma margem de 10%
     max_range *= 1.1 
 
-    mid_x = (x_vals.max() + x_vals.min()) * 0.5
-    mid_y = (y_vals.max() + y_vals.min()) * 0.5
-    mid_z = (z_vals.max() + z_vals.min()) * 0.5
+    mid_x, mid_y, mid_z = (upper + lower) * 0.5
     
     ax.set_xlim(mid_x - max_range / 2, mid_x + max_range / 2)
     ax.set_ylim(mid_y - max_range / 2, mid_y + max_range / 2)
     ax.set_zlim(mid_z - max_range / 2, mid_z + max_range / 2)
 
-def main():
-    print("--- Visualizador em Tempo Real com Matplotlib ---")
-    print(f"A observar o ficheiro: '{DATA_FILENAME}'...")
+class LivePlot:
+    """A janela do matplotlib e a nuvem acumulada da sessão que está a ser mostrada."""
 
-    plt.ion() # Ativa o modo interativo do Matplotlib
-    fig = plt.figure(figsize=(10, 10))
-    ax = fig.add_subplot(111, projection='3d')
-    
-    ax.set_xlabel('X (mm)')
-    ax.set_ylabel('Y (mm)')
-    ax.set_zlabel('Z (mm)')
-    
-    # O 'scatter_plot' é o objeto que vamos atualizar com os novos pontos
-    scatter_plot = ax.scatter([], [], [], s=5, c='blue', alpha=0.7)
-    plt.show()
+    def __init__(self):
+        plt.ion() # Ativa o modo interativo do Matplotlib
+        self.fig = plt.figure(figsize=(10, 10))
+        self.ax = self.fig.add_subplot(111, projection='3d')
+        
+        self.ax.set_xlabel('X (mm)')
+        self.ax.set_ylabel('Y (mm)')
+        self.ax.set_zlabel('Z (mm)')
+        
+        # O 'scatter_plot' é o objeto que vamos atualizar com os novos pontos
+        self.scatter_plot = self.ax.scatter([], [], [], s=5, c='blue', alpha=0.7)
+        plt.show()
+
+        self.all_points = PointBuffer()
+        self.decimator = VoxelDecimator() if RENDER_DECIMATION == "voxel" else None
+        self.lost_points = 0
+
+    @property
+    def is_open(self):
+        return plt.fignum_exists(self.fig.number)
 
-    all_points = np.empty((0, 3))
+    def clear(self):
+        self.all_points.clear()
+        if self.decimator is not None:
+            self.decimator.clear()
+        self.lost_points = 0
 
-    # Verifica se o ficheiro existe antes de tentar abrir
-    if not os.path.exists(DATA_FILENAME):
-        print(f"Aviso: Ficheiro '{DATA_FILENAME}' não encontrado. A aguardar que seja criado...")
-        # Cria um ficheiro vazio para evitar erros
-        open(DATA_FILENAME, 'a').close()
+    def add(self, new_points_batch):
+        # Adiciona os novos pontos (sem copiar os anteriores)
+        self.all_points.append(new_points_batch)
+        if self.decimator is not None:
+            self.decimator.add(new_points_batch)
 
+    def redraw(self):
+        # Atualiza os dados do gráfico, no máximo com RENDER_BUDGET_POINTS pontos
+        shown = render_view(self.all_points, self.decimator)
+        self.scatter_plot._offsets3d = (shown[:, 0], shown[:, 1], shown[:, 2])
+        title = f"Nuvem de Pontos ({len(self.all_points)} pontos"
+        if len(shown) < len(self.all_points):
+            title += f", {len(shown)} desenhados"
+        if self.lost_points:
+            title += f", {self.lost_points} não recebidos"
+        self.ax.set_title(title + ")")
+        
+        # Reajusta os eixos para manter a escala correta
+        set_equal_aspect_3d(self.ax, self.all_points.lower, self.all_points.upper)
+        
+        # Redesenha o gráfico
+        self.fig.canvas.draw_idle()
+
+def follow_feed(plot, client, only_session=None):
+    """
+    Mostra os pontos publicados pelo recetor à medida que chegam. Fica preso a
+    uma sessão (`only_session` ou a primeira que aparecer): com vários scanners
+    em simultâneo, as mensagens das outras são ignoradas. Só depois de a sessão
+    mostrada terminar é que passa para a próxima que começar.
+    """
+    session_id = only_session
+    session_ended = False
+    while plot.is_open and not client.closed:
+        changed = False
+        for message in client.poll():
+            if message.session_id != session_id:
+                starts_next = session_id is None or (session_ended and message.kind == SESSION_START)
+                if only_session is not None or not starts_next:
+                    continue
+                session_id = message.session_id
+                session_ended = False
+                print(f"A mostrar a sessão '{session_id}'.")
+                plot.clear()
+                changed = True
+            if message.kind == POINTS:
+                plot.add(message.points)
+                changed = True
+            elif message.kind == POINTS_LOST:
+                # O visualizador não acompanhou o ritmo: o recetor descartou estes lotes.
+                plot.lost_points += message.fields['pontos']
+                changed = True
+            elif message.kind == SESSION_END:
+                session_ended = True
+                print(f"Sessão '{session_id}' terminada ({message.fields['pontos']} pontos).")
+        if changed:
+            plot.redraw()
+        plt.pause(FEED_UPDATE_INTERVAL_SECONDS)
+    if client.closed:
+        print("O recetor fechou o canal de pontos.")
+
+def follow_files(plot, data_filename):
+    """Lê os pontos acrescentados ao ficheiro indicado (ou ao scan mais recente em SCANS_DIR)."""
+    follow_latest = data_filename is None
+    tail = PointTail(data_filename) if data_filename else None
     try:
-        with open(DATA_FILENAME, 'r') as file_handle:
-            print("A aguardar novos pontos... (Pressione Ctrl+C na consola ou feche a janela para parar)")
-            
-            # --- LÓGICA PRINCIPAL ---
-            while plt.fignum_exists(fig.number):
-                # Tenta ler novas linhas a partir da posição atual do ficheiro
-                new_points_batch = read_new_points(file_handle)
-                
-                if new_points_batch is not None and len(new_points_batch) > 0:
-                    # Adiciona os novos pontos à lista de todos os pontos
-                    all_points = np.vstack((all_points, new_points_batch))
-                    
-                    # Atualiza os dados do gráfico
-                    scatter_plot._offsets3d = (all_points[:, 0], all_points[:, 1], all_points[:, 2])
-                    ax.set_title(f"Nuvem de Pontos ({len(all_points)} pontos)")
-                    
-                    # Reajusta os eixos para manter a escala correta
-                    set_equal_aspect_3d(ax, all_points)
-                    
-                    # Redesenha o gráfico
-                    fig.canvas.draw_idle()
-
-                # Espera um pouco antes de verificar o ficheiro novamente
+        while plot.is_open:
+            # Quando o recetor inicia uma nova sessão, passa a mostrar essa.
+            if follow_latest:
+                latest = find_latest_scan()
+                if latest and (tail is None or latest != tail.filepath):
+                    print(f"A mostrar a sessão '{latest}'.")
+                    if tail is not None:
+                        tail.close()
+                    tail = PointTail(latest)
+                    plot.clear()
+            if tail is None:
                 plt.pause(UPDATE_INTERVAL_SECONDS)
+                continue
+
+            # Lê apenas os pontos acrescentados desde a última verificação
+            new_points_batch = tail.read_new()
+            
+            if new_points_batch is not None and len(new_points_batch) > 0:
+                plot.add(new_points_batch)
+                plot.redraw()
+
+            # Espera um pouco antes de verificar o ficheiro novamente
+            plt.pause(UPDATE_INTERVAL_SECONDS)
+    finally:
+        if tail is not None:
+            tail.close()
+
+def main():
+    # Sem ficheiro, subscreve os pontos publicados pelo recetor ou, se não
+    # estiver a correr, segue o scan mais recente.
+    parser = argparse.ArgumentParser(description="Mostra a nuvem de pontos de um scan em tempo real.")
+    parser.add_argument('ficheiro', nargs='?', help="Ficheiro de pontos a seguir (.p3ds ou .txt).")
+    parser.add_argument('--sessao', help="Mostra só esta sessão do recetor (por omissão, a primeira que aparecer).")
+    args = parser.parse_args()
+    data_filename = args.ficheiro
+
+    print("--- Visualizador em Tempo Real com Matplotlib ---")
+    client = None
+    if data_filename is None:
+        try:
+            client = PointFeedClient()
+            print("A receber os pontos diretamente do recetor.")
+        except OSError:
+            print(f"Recetor não encontrado: a seguir o scan mais recente em '{SCANS_DIR}/'...")
+    else:
+        print(f"A observar o ficheiro: '{data_filename}'...")
+        # O ficheiro pode ainda não existir: o PointTail espera que o recetor o crie.
+        if not os.path.exists(data_filename):
+            print(f"Aviso: Ficheiro '{data_filename}' não encontrado. A aguardar que seja criado...")
+
+    plot = LivePlot()
+    try:
+        print("A aguardar novos pontos... (Pressione Ctrl+C na consola ou feche a janela para parar)")
+        if client is not None:
+            follow_feed(plot, client, args.sessao)
+        if plot.is_open:
+            follow_files(plot, data_filename)
 
     except Exception as e:
         print(f"\nOcorreu um erro inesperado: {e}")
     finally:
+        if client is not None:
+            client.close()
         plt.ioff()
         print("\nVisualização terminada.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,255 @@
+# --- START OF FILE merge_scans.py ---
+"""
+Junção de várias passagens do mesmo objeto numa única nuvem de pontos.
+
+Quando um objeto é digitalizado outra vez (para preencher zonas que ficaram na
+sombra) ou virado ao contrário e digitalizado de novo, as sessões são juntadas
+aqui em vez de se concatenarem os ficheiros:
+
+    1. registo: cada sessão é alinhada com o que já foi juntado por ICP
+       (ponto-a-plano, com os piores pares descartados) sobre cópias reduzidas
+       a um ponto por voxel de ICP_VOXEL_MM. As sessões marcadas como viradas
+       começam rodadas 180° em torno de X, e são experimentadas várias
+       rotações em torno de Z;
+    2. fusão: os pontos entram numa grelha de voxels (MERGE_VOXEL_MM em X/Y,
+       uma fatia por camada em Z), indexada por um único inteiro por voxel.
+       Os pontos do mesmo voxel, da mesma passagem ou de passagens diferentes,
+       são substituídos pela sua média, por isso a nuvem final tem um tamanho
+       limitado pela superfície do objeto e não pelo número de passagens;
+    3. saída: um .p3ds com os pontos ordenados por camada (e por ângulo), pronto
+       para o `build_universal_solid`.
+
+    python merge_scans.py fundido.p3ds scans/passagem1.p3ds scans/passagem2.p3ds
+    python merge_scans.py fundido.p3ds scans/frente.p3ds scans/virado.p3ds --virado 1 --stl fundido.stl
+"""
+
+import argparse
+import sys
+import time
+import numpy as np
+from scipy.spatial import cKDTree
+
+import point_store
+from point_store import PointStoreWriter, load_points
+
+MERGE_VOXEL_MM = 0.5        # Lado (X/Y) dos voxels da nuvem final
+DEFAULT_LAYER_HEIGHT_MM = 1.0  # Altura das camadas se não for possível estimá-la da primeira sessão
+ICP_VOXEL_MM = 2.0          # Redução das cópias usadas no registo
+ICP_MAX_ITERATIONS = 100
+ICP_TRIM_FRACTION = 0.8     # Fração dos pares (os mais próximos) usada em cada iteração
+ICP_TOLERANCE_MM = 1e-3     # Para quando cada iteração já move os pontos menos do que isto
+FLIPPED_START_ANGLES = 8    # Rotações em torno de Z experimentadas nas sessões viradas
+
+_KEY_OFFSET = 1 << 20       # Índices dos voxels empacotados num inteiro (21 bits por eixo)
+
+
+def pack_keys(cells):
+    cells = cells.astype(np.int64) + _KEY_OFFSET
+    return (cells[:, 0] << 42) | (cells[:, 1] << 21) | cells[:, 2]
+
+def voxel_downsample(points, voxel_mm):
+    """Um ponto (a média) por voxel cúbico de `voxel_mm`."""
+    _, inverse, counts = np.unique(pack_keys(np.floor(points / voxel_mm)), return_inverse=True,
+                                   return_counts=True)
+    reduced = np.empty((len(counts), 3))
+    for axis in range(3):
+        reduced[:, axis] = np.bincount(inverse, weights=points[:, axis], minlength=len(counts)) / counts
+    return reduced
+
+def estimate_layer_height(z, tolerance=point_store.LAYER_TOLERANCE_MM):
+    """Distância mais comum entre camadas consecutivas (mediana), ou None com menos de duas camadas."""
+    heights = np.unique(np.round(z / tolerance)) * tolerance
+    if len(heights) < 2:
+        return None
+    return float(np.median(np.diff(heights)))
+
+
+class VoxelGrid:
+    """
+    Acumula pontos numa grelha de voxels: soma de X e Y e número de pontos por
+    voxel. Cada `add()` junta o lote à grelha numa única passagem vetorizada
+    (a memória usada é a dos voxels ocupados, não a dos pontos recebidos).
+    """
+
+    def __init__(self, voxel_mm, layer_height_mm, z_origin):
+        self.voxel_mm = voxel_mm
+        self.layer_height_mm = layer_height_mm
+        self.z_origin = z_origin
+        self.keys = np.empty(0, dtype=np.int64)
+        self.sums = np.empty((0, 2))
+        self.counts = np.empty(0, dtype=np.int64)
+        self.point_count = 0
+
+    def layer_of(self, z):
+        return np.round((z - self.z_origin) / self.layer_height_mm).astype(np.int64)
+
+    def add(self, points):
+        if len(points) == 0:
+            return
+        cells = np.column_stack((np.floor(points[:, :2] / self.voxel_mm), self.layer_of(points[:, 2])))
+        keys, inverse = np.unique(np.concatenate((self.keys, pack_keys(cells))), return_inverse=True)
+        sums = np.empty((len(keys), 2))
+        for axis in range(2):
+            weights = np.concatenate((self.sums[:, axis], points[:, axis]))
+            sums[:, axis] = np.bincount(inverse, weights=weights, minlength=len(keys))
+        counts = np.bincount(inverse, weights=np.concatenate((self.counts, np.ones(len(points)))),
+                             minlength=len(keys)).astype(np.int64)
+        self.keys, self.sums, self.counts = keys, sums, counts
+        self.point_count += len(points)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def points(self):
+        """Um ponto por voxel (média em X/Y, altura da camada em Z), ordenado por camada e por ângulo."""
+        layers = ((self.keys & ((1 << 21) - 1)) - _KEY_OFFSET)
+        points = np.empty((len(self.keys), 3))
+        points[:, :2] = self.sums / self.counts[:, None]
+        points[:, 2] = self.z_origin + layers * self.layer_height_mm
+        center = points[:, :2].mean(axis=0) if len(points) else np.zeros(2)
+        angles = np.arctan2(points[:, 1] - center[1], points[:, 0] - center[0])
+        return points[np.lexsort((angles, layers))]
+
+
+ICP_NORMAL_NEIGHBOURS = 10  # Vizinhos usados para estimar a normal de cada ponto fixo
+
+
+def estimate_normals(points, tree, neighbours=ICP_NORMAL_NEIGHBOURS):
+    """Normal de cada ponto: direção de menor variância dos `neighbours` vizinhos (todas de uma vez)."""
+    _, indices = tree.query(points, k=min(neighbours, len(points)))
+    local = points[indices] - points[indices].mean(axis=1, keepdims=True)
+    _, vectors = np.linalg.eigh(np.einsum('nki,nkj->nij', local, local))
+    return vectors[:, :, 0]
+
+def _rotation_from_vector(omega):
+    """Rotação de ângulo |omega| em torno de omega (fórmula de Rodrigues)."""
+    angle = np.linalg.norm(omega)
+    if angle < 1e-12:
+        return np.eye(3)
+    k = omega / angle
+    skew = np.array([[0.0, -k[2], k[1]], [k[2], 0.0, -k[0]], [-k[1], k[0], 0.0]])
+    return np.eye(3) + np.sin(angle) * skew + (1 - np.cos(angle)) * skew @ skew
+
+def icp(moving, fixed_tree, fixed_normals, initial=np.eye(4), iterations=ICP_MAX_ITERATIONS,
+        trim=ICP_TRIM_FRACTION):
+    """
+    ICP ponto-a-plano (cada passo é um sistema linear 6x6) com os pares mais
+    afastados descartados: só a fração `trim` mais próxima conta, para tolerar
+    zonas que só uma das sessões vê. Desliza melhor ao longo das superfícies do
+    que o ponto-a-ponto, sobretudo em formas quase simétricas.
+    Devolve (matriz 4x4, erro RMS dos pares usados em mm).
+    """
+    transform = initial.copy()
+    keep = max(6, int(len(moving) * trim))
+    for _ in range(iterations):
+        current = moving @ transform[:3, :3].T + transform[:3, 3]
+        distances, indices = fixed_tree.query(current)
+        closest = np.argpartition(distances, keep - 1)[:keep]
+        p, q, n = current[closest], fixed_tree.data[indices[closest]], fixed_normals[indices[closest]]
+        # Linearização para rotações pequenas: (p x n)·omega + n·t = (q - p)·n
+        system = np.column_stack((np.cross(p, n), n))
+        solution, *_ = np.linalg.lstsq(system, np.einsum('ij,ij->i', q - p, n), rcond=None)
+        step = np.eye(4)
+        step[:3, :3], step[:3, 3] = _rotation_from_vector(solution[:3]), solution[3:]
+        transform = step @ transform
+        # Deslocamento máximo provocado por esta iteração (rotação no ponto mais afastado + translação).
+        if np.linalg.norm(solution[:3]) * np.abs(current).max() + np.linalg.norm(solution[3:]) < ICP_TOLERANCE_MM:
+            break
+    distances, _ = fixed_tree.query(moving @ transform[:3, :3].T + transform[:3, 3])
+    return transform, float(np.sqrt(np.mean(np.partition(distances, keep - 1)[:keep] ** 2)))
+
+def _start_transforms(moving, fixed, flipped):
+    """Transformações iniciais: identidade ou, nas sessões viradas, 180° em X e várias rotações em Z."""
+    if not flipped:
+        return [np.eye(4)]
+    starts = []
+    moving_center, fixed_center = moving.mean(axis=0), fixed.mean(axis=0)
+    for angle in np.arange(FLIPPED_START_ANGLES) * (2 * np.pi / FLIPPED_START_ANGLES):
+        c, s = np.cos(angle), np.sin(angle)
+        rotation = np.array([[c, -s, 0.0], [s, c, 0.0], [0.0, 0.0, 1.0]]) @ np.diag((1.0, -1.0, -1.0))
+        start = np.eye(4)
+        start[:3, :3] = rotation
+        start[:3, 3] = fixed_center - rotation @ moving_center
+        starts.append(start)
+    return starts
+
+def register(moving_points, fixed_points, flipped=False, voxel_mm=ICP_VOXEL_MM):
+    """Alinha `moving_points` com `fixed_points` (cópias reduzidas). Devolve (matriz 4x4, erro RMS)."""
+    moving = voxel_downsample(moving_points, voxel_mm)
+    fixed = voxel_downsample(fixed_points, voxel_mm)
+    tree = cKDTree(fixed)
+    normals = estimate_normals(fixed, tree)
+    results = [icp(moving, tree, normals, start) for start in _start_transforms(moving, fixed, flipped)]
+    return min(results, key=lambda result: result[1])
+
+def apply_transform(points, transform):
+    return points @ transform[:3, :3].T + transform[:3, 3]
+
+
+def merge_scans(input_paths, output_path, voxel_mm=MERGE_VOXEL_MM, layer_height_mm=None,
+                registration=True, flipped=()):
+    """
+    Junta as sessões `input_paths` (a primeira é a referência) num único
+    .p3ds. `flipped` são os índices das sessões digitalizadas com o objeto
+    virado. Devolve a lista (ficheiro, pontos, erro RMS do registo ou None) de
+    cada sessão e a grelha de voxels com o resultado.
+    """
+    reference = np.asarray(load_points(input_paths[0]), dtype=np.float64)
+    if layer_height_mm is None:
+        layer_height_mm = estimate_layer_height(reference[:, 2]) or DEFAULT_LAYER_HEIGHT_MM
+    grid = VoxelGrid(voxel_mm, layer_height_mm, float(reference[:, 2].min()) if len(reference) else 0.0)
+    grid.add(reference)
+    report = [(input_paths[0], len(reference), None)]
+
+    for index, path in enumerate(input_paths[1:], start=1):
+        points = np.asarray(load_points(path), dtype=np.float64)
+        rms = None
+        if registration and len(points):
+            transform, rms = register(points, grid.points(), flipped=index in flipped)
+            points = apply_transform(points, transform)
+        grid.add(points)
+        report.append((path, len(points), rms))
+
+    calibration, profile_name = (0.0, 0.0, 0.0), ""
+    if point_store.is_point_store(input_paths[0]):
+        header = point_store.read_header(input_paths[0])
+        calibration = (header['sensor_offset_mm'], header['offset_x'], header['offset_y'])
+        profile_name = header['profile']
+    with PointStoreWriter(output_path, calibration, profile_name) as writer:
+        writer.write(grid.points())
+    return report, grid
+
+def main():
+    parser = argparse.ArgumentParser(description="Junta várias passagens do mesmo objeto numa só nuvem de pontos.")
+    parser.add_argument('saida', help="Ficheiro de pontos a criar (.p3ds).")
+    parser.add_argument('entradas', nargs='+', help="Sessões a juntar (.p3ds ou .txt); a primeira é a referência.")
+    parser.add_argument('--voxel', type=float, default=MERGE_VOXEL_MM, help="Lado dos voxels da fusão (mm).")
+    parser.add_argument('--altura-camada', type=float, help="Altura das camadas (mm); por omissão, a da primeira sessão.")
+    parser.add_argument('--virado', type=int, action='append', default=[],
+                        help="Índice (a partir de 0) de uma sessão com o objeto virado ao contrário.")
+    parser.add_argument('--sem-registo', action='store_true', help="Junta as sessões sem as alinhar.")
+    parser.add_argument('--stl', help="Gera também a malha da nuvem fundida (modo sem janela).")
+    args = parser.parse_args()
+
+    started_at = time.perf_counter()
+    try:
+        report, grid = merge_scans(args.entradas, args.saida, args.voxel, args.altura_camada,
+                                   not args.sem_registo, set(args.virado))
+    except (OSError, ValueError) as e:
+        print(f"[ERRO] {e}")
+        return 1
+    for index, (path, count, rms) in enumerate(report):
+        alignment = "referência" if index == 0 else ("sem registo" if rms is None else f"ICP: erro {rms:.2f} mm")
+        print(f"  {path}: {count} pontos ({alignment})")
+    print(f"{grid.point_count} pontos -> {len(grid)} pontos em '{args.saida}' "
+          f"(voxel {grid.voxel_mm:g} mm, camadas de {grid.layer_height_mm:g} mm) "
+          f"em {time.perf_counter() - started_at:.2f} s.")
+
+    if args.stl:
+        from generate_stl import build_universal_solid
+        if build_universal_solid(args.saida, args.stl, show_result=False, headless=True) is None:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+# --- START OF FILE mesh_cache.py ---
+"""
+Cache em disco, endereçada pelo conteúdo, dos resultados intermédios do
+`generate_stl`.
+
+Cada fase é guardada num ficheiro .npz cujo nome é o hash das suas entradas:
+
+    camadas = H(pontos, LAYER_TOLERANCE_MM, MIN_POINTS_PER_LAYER)
+    aneis   = H(camadas, num_points_per_layer, SPLINE_SMOOTHING)
+    malha   = H(aneis, MERGE_DISTANCE_MM)            (já com os vértices juntos)
+
+Como cada chave depende apenas da anterior e dos parâmetros da fase, mudar
+só o ficheiro de saída (ou um parâmetro tardio) reaproveita tudo o que está
+antes. Para não reler um ficheiro de pontos já visto, o índice guarda o hash
+do conteúdo indexado por (caminho, tamanho, data de modificação).
+
+O tamanho total é limitado (MESH_CACHE_MAX_BYTES): quando é excedido, são
+apagadas as entradas usadas há mais tempo (LRU pela data de acesso).
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+
+MESH_CACHE_DIR = ".mesh_cache"
+MESH_CACHE_MAX_BYTES = 512 * 1024 * 1024
+INDEX_FILENAME = "index.json"
+STAGES = ('camadas', 'aneis', 'malha')
+
+
+def content_hash(*parts):
+    """Hash de arrays numpy (conteúdo, tipo e forma) e de parâmetros simples."""
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            part = np.ascontiguousarray(part)
+            h.update(f"{part.dtype.str}{part.shape}".encode())
+            h.update(part.data)
+        else:
+            h.update(repr(part).encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class MeshCache:
+    """
+    Cache LRU limitada em tamanho. `get()`/`put()` trabalham com dicionários de
+    arrays; `stats` conta acertos e falhas por fase (acumulados em disco).
+    """
+
+    def __init__(self, directory=MESH_CACHE_DIR, max_bytes=MESH_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, INDEX_FILENAME)
+        self.sources, self.total_stats = self._read_index()
+        self.new_sources = {}
+        self.stats = {stage: {'acertos': 0, 'falhas': 0} for stage in STAGES}
+
+    def _read_index(self):
+        """(fontes, estatisticas) do índice em disco; vazios se não existir ou estiver corrompido."""
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            return index.get('fontes', {}), index.get('estatisticas', {})
+        except (OSError, ValueError):
+            return {}, {}  # Índice corrompido: começa do zero, as entradas continuam válidas
+
+    # --- Chaves ---
+
+    @staticmethod
+    def _signature(filepath):
+        st = os.stat(filepath)
+        return [st.st_size, st.st_mtime_ns]
+
+    def source_key(self, filepath):
+        """Hash do conteúdo já conhecido para este ficheiro, ou None se mudou ou nunca foi visto."""
+        entry = self.sources.get(os.path.abspath(filepath))
+        try:
+            if entry is not None and entry[:2] == self._signature(filepath):
+                return entry[2]
+        except OSError:
+            pass
+        return None
+
+    def remember_source(self, filepath, points):
+        """Calcula o hash dos pontos e regista-o no índice. Devolve a chave."""
+        key = content_hash(points)
+        entry = self._signature(filepath) + [key]
+        self.sources[os.path.abspath(filepath)] = self.new_sources[os.path.abspath(filepath)] = entry
+        return key
+
+    # --- Entradas ---
+
+    def _path(self, stage, key):
+        return os.path.join(self.directory, f"{stage}-{key}.npz")
+
+    def get(self, stage, key):
+        """Devolve o dicionário de arrays guardado, ou None. Atualiza a data de acesso."""
+        path = self._path(stage, key)
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+            os.utime(path)
+        except (OSError, ValueError):
+            self.stats[stage]['falhas'] += 1
+            return None
+        self.stats[stage]['acertos'] += 1
+        return arrays
+
+    def put(self, stage, key, **arrays):
+        path = self._path(stage, key)
+        temp_path = f"{path}.{os.getpid()}.tmp"  # Vários processos podem partilhar a cache
+        with open(temp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def entries(self):
+        """(caminho, tamanho, último acesso) de todas as entradas, das mais antigas para as mais recentes."""
+        found = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz'):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue  # Apagada entretanto por outro processo
+                found.append((entry.path, st.st_size, st.st_mtime))
+        return sorted(found, key=lambda e: e[2])
+
+    def size_bytes(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Apaga as entradas menos usadas até o total caber em `max_bytes`."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    # --- Estatísticas ---
+
+    def save(self):
+        """
+        Grava o índice de ficheiros e acumula as estatísticas desta sessão.
+        Vários processos (o batch_remesh.py com --cache) podem gravar o mesmo
+        índice: o que está em disco é relido imediatamente antes e só se lhe
+        juntam as fontes e os contadores desta sessão, e o ficheiro é
+        substituído de uma vez (ficheiro temporário + os.replace), para nunca
+        se ler um índice a meio da escrita.
+        """
+        sources, total_stats = self._read_index()
+        sources.update(self.new_sources)
+        totals = {stage: dict(total_stats.get(stage, {'acertos': 0, 'falhas': 0})) for stage in STAGES}
+        for stage, counts in self.stats.items():
+            for name, value in counts.items():
+                totals[stage][name] = totals[stage].get(name, 0) + value
+        temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'fontes': sources, 'estatisticas': totals}, f, indent=2)
+        os.replace(temp_path, self.index_path)
+        self.sources, self.total_stats, self.new_sources = sources, totals, {}
+        self.stats = {stage: {'acertos': 0, 'falhas': 0} for stage in STAGES}
+
+    def describe(self):
+        parts = [f"{stage}: {c['acertos']} acerto(s)/{c['falhas']} falha(s)" for stage, c in self.stats.items()]
+        return (f"Cache '{self.directory}' ({self.size_bytes() / 1e6:.1f} MB de "
+                f"{self.max_bytes / 1e6:.0f} MB) - " + ", ".join(parts))
@@ -0,0 +1,162 @@
+# --- START OF FILE mesh_io.py ---
+"""
+Exportação de malhas sem open3d: STL binário e PLY binário escritos
+diretamente a partir dos arrays de vértices e triângulos.
+
+As normais das faces (e, no PLY, dos vértices) são calculadas de forma
+vetorizada e cada ficheiro é escrito como um único array estruturado, sem
+qualquer ciclo em Python por triângulo.
+
+    STL binário: [cabeçalho 80 bytes][nº de triângulos uint32]
+                 [normal 3xf4][v1 3xf4][v2 3xf4][v3 3xf4][atributo u2] x N
+"""
+
+import os
+import struct
+from dataclasses import dataclass
+import numpy as np
+
+STL_HEADER_SIZE = 80
+STL_TRIANGLE_DTYPE = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')])
+PLY_VERTEX_DTYPE = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4'),
+                             ('nx', '<f4'), ('ny', '<f4'), ('nz', '<f4')])
+PLY_FACE_DTYPE = np.dtype([('count', 'u1'), ('indices', '<i4', (3,))])
+
+
+@dataclass
+class TriangleMesh:
+    """Malha mínima (vértices (N, 3), triângulos (M, 3)) devolvida no modo sem open3d."""
+    vertices: np.ndarray
+    triangles: np.ndarray
+
+
+def face_normals(vertices, triangles, normalize=True):
+    """Normais das faces pela regra da mão direita (v1 - v0) x (v2 - v0)."""
+    v0 = vertices[triangles[:, 0]]
+    normals = np.cross(vertices[triangles[:, 1]] - v0, vertices[triangles[:, 2]] - v0)
+    if normalize:
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        np.divide(normals, lengths, out=normals, where=lengths > 0)
+    return normals
+
+def vertex_normals(vertices, triangles):
+    """Normais dos vértices: soma das normais das faces (ponderadas pela área), normalizada."""
+    weighted = face_normals(vertices, triangles, normalize=False)
+    flat = triangles.ravel()
+    normals = np.empty((len(vertices), 3))
+    for axis in range(3):
+        normals[:, axis] = np.bincount(flat, weights=np.repeat(weighted[:, axis], 3), minlength=len(vertices))
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    np.divide(normals, lengths, out=normals, where=lengths > 0)
+    return normals
+
+def merge_close_vertices(vertices, triangles, distance):
+    """
+    Junta os vértices a menos de `distance` uns dos outros (equivalente ao
+    `merge_close_vertices` do open3d): cada grupo passa a ser um único vértice,
+    na posição média, e os triângulos são re-indexados.
+    """
+    from scipy.spatial import cKDTree
+
+    pairs = cKDTree(vertices).query_pairs(distance, output_type='ndarray')
+    if len(pairs) == 0:
+        return vertices, triangles
+
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+    n = len(vertices)
+    graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+    _, labels = connected_components(graph, directed=False)
+    # Renumera os grupos pela ordem do primeiro vértice de cada um.
+    _, first_index, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    order = np.argsort(first_index)
+    remap = np.empty_like(order)
+    remap[order] = np.arange(len(order))
+    new_index = remap[inverse]
+
+    counts = np.bincount(new_index)
+    merged = np.empty((len(counts), 3))
+    for axis in range(3):
+        merged[:, axis] = np.bincount(new_index, weights=vertices[:, axis]) / counts
+    return merged, new_index[triangles].astype(triangles.dtype)
+
+def write_binary_stl(filepath, vertices, triangles, header=b"generate_stl"):
+    """Grava um STL binário. Devolve o número de triângulos escritos."""
+    records = np.empty(len(triangles), dtype=STL_TRIANGLE_DTYPE)
+    records['normal'] = face_normals(vertices, triangles)
+    records['vertices'] = vertices[triangles]
+    records['attribute'] = 0
+    with open(filepath, 'wb') as f:
+        f.write(header[:STL_HEADER_SIZE].ljust(STL_HEADER_SIZE, b'\0'))
+        f.write(struct.pack('<I', len(records)))
+        records.tofile(f)
+    return len(records)
+
+class StreamingSTLWriter:
+    """
+    STL binário escrito aos bocados: `write(vertices, triangles)` acrescenta
+    triângulos (os índices referem-se aos `vertices` dessa chamada) e `close()`
+    corrige o número de triângulos no cabeçalho. Nada fica em memória entre chamadas.
+    """
+
+    def __init__(self, filepath, header=b"generate_stl"):
+        self.file_handle = open(filepath, 'wb')
+        self.file_handle.write(header[:STL_HEADER_SIZE].ljust(STL_HEADER_SIZE, b'\0'))
+        self.file_handle.write(struct.pack('<I', 0))
+        self.triangle_count = 0
+
+    def write(self, vertices, triangles):
+        records = np.empty(len(triangles), dtype=STL_TRIANGLE_DTYPE)
+        records['normal'] = face_normals(vertices, triangles)
+        records['vertices'] = vertices[triangles]
+        records['attribute'] = 0
+        records.tofile(self.file_handle)
+        self.triangle_count += len(records)
+
+    def close(self):
+        if not self.file_handle.closed:
+            self.file_handle.seek(STL_HEADER_SIZE)
+            self.file_handle.write(struct.pack('<I', self.triangle_count))
+            self.file_handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def write_binary_ply(filepath, vertices, triangles):
+    """Grava um PLY binário (little-endian) com normais por vértice. Devolve o número de triângulos."""
+    vertex_records = np.empty(len(vertices), dtype=PLY_VERTEX_DTYPE)
+    normals = vertex_normals(vertices, triangles)
+    for i, axis in enumerate('xyz'):
+        vertex_records[axis] = vertices[:, i]
+        vertex_records['n' + axis] = normals[:, i]
+    face_records = np.empty(len(triangles), dtype=PLY_FACE_DTYPE)
+    face_records['count'] = 3
+    face_records['indices'] = triangles
+
+    header = (
+        "ply\n"
+        "format binary_little_endian 1.0\n"
+        f"element vertex {len(vertex_records)}\n"
+        "property float x\nproperty float y\nproperty float z\n"
+        "property float nx\nproperty float ny\nproperty float nz\n"
+        f"element face {len(face_records)}\n"
+        "property list uchar int vertex_indices\n"
+        "end_header\n"
+    )
+    with open(filepath, 'wb') as f:
+        f.write(header.encode('ascii'))
+        vertex_records.tofile(f)
+        face_records.tofile(f)
+    return len(face_records)
+
+def write_mesh(filepath, vertices, triangles):
+    """Escolhe o formato pela extensão do ficheiro (.stl ou .ply)."""
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension == '.stl':
+        return write_binary_stl(filepath, vertices, triangles)
+    if extension == '.ply':
+        return write_binary_ply(filepath, vertices, triangles)
+    raise ValueError(f"Formato de malha não suportado: '{extension}' (use .stl ou .ply).")
@@ -0,0 +1,232 @@
+# --- START OF FILE mesh_lod.py ---
+"""
+Exportação em vários níveis de detalhe (LOD) a partir de uma única reconstrução.
+
+As splines de cada camada são ajustadas uma só vez; cada nível avalia-as com
+a sua própria resolução:
+
+    * `points_per_layer`: pontos de cada anel;
+    * `layer_step`: mantém uma camada em cada N (a primeira e a última ficam sempre);
+    * `adaptivity`: 0 = pontos igualmente espaçados no parâmetro da spline;
+      1 = pontos distribuídos só pela curvatura. Valores intermédios misturam os
+      dois, pelo que as faces planas de uma caixa ficam com poucos vértices e os
+      cantos com muitos. Todos os anéis de um nível têm o mesmo número de pontos,
+      por isso as paredes são construídas como no `generate_stl`.
+
+Para cada nível é reportado o número de triângulos, o tamanho do ficheiro e o
+desvio máximo (mm) em relação à malha de resolução completa (a mesma do
+`build_universal_solid`).
+
+    python mesh_lod.py 3dScanner_Data.txt
+    python mesh_lod.py scans/20250101-120000-001.p3ds --formato ply
+"""
+
+import argparse
+import os
+import time
+from dataclasses import dataclass
+import numpy as np
+from scipy.interpolate import splev
+from scipy.spatial import cKDTree
+
+import mesh_io
+from generate_stl import (NUM_POINTS_PER_LAYER, MERGE_DISTANCE_MM, SPLINE_WORKERS, split_layers,
+                          fit_layers, evaluate_layer_spline, build_mesh_arrays)
+from point_store import load_points
+
+CURVATURE_SAMPLES = 2048  # Amostras densas de cada spline usadas para medir a curvatura
+DEVIATION_CANDIDATES = 8  # Vértices mais próximos cujos triângulos são testados por ponto
+
+
+@dataclass(frozen=True)
+class LodLevel:
+    name: str
+    points_per_layer: int
+    layer_step: int = 1
+    adaptivity: float = 0.0
+
+
+LOD_LEVELS = (
+    LodLevel('impressao', NUM_POINTS_PER_LAYER, 1, 0.0),
+    LodLevel('pre-visualizacao', 72, 2, 0.6),
+    LodLevel('web', 36, 4, 0.8),
+)
+
+
+def adaptive_parameters(spline, num_points, adaptivity):
+    """
+    Parâmetros `u` para `num_points` pontos no anel, com densidade proporcional
+    a (1 - adaptivity) * comprimento + adaptivity * ângulo de viragem.
+    """
+    tck, u_min, u_max, _ = spline
+    if adaptivity <= 0:
+        return np.linspace(u_min, u_max, num_points, endpoint=False)
+
+    u = np.linspace(u_min, u_max, CURVATURE_SAMPLES, endpoint=False)
+    dx, dy = splev(u, tck, der=1)
+    ddx, ddy = splev(u, tck, der=2)
+    speed = np.hypot(dx, dy)
+    # Curvatura * comprimento do troço = ângulo de viragem em cada amostra.
+    turning = np.abs(dx * ddy - dy * ddx) / np.maximum(speed, 1e-12) ** 2
+    length_share = speed / speed.sum()
+    turning_share = turning / turning.sum() if turning.sum() > 0 else length_share
+    density = (1.0 - adaptivity) * length_share + adaptivity * turning_share
+
+    # Inverte a distribuição acumulada: o primeiro ponto continua em u_min.
+    cumulative = np.concatenate(([0.0], np.cumsum(density)[:-1]))
+    targets = np.arange(num_points) / num_points
+    return np.interp(targets, cumulative, u)
+
+def kept_layers(layer_count, layer_step):
+    """Índices das camadas mantidas: uma em cada `layer_step`, mais sempre a última."""
+    keep = list(range(0, layer_count, layer_step))
+    if keep[-1] != layer_count - 1:
+        keep.append(layer_count - 1)
+    return keep
+
+def build_level(splines, level):
+    """Vértices e triângulos (mm) de um nível a partir das splines já ajustadas."""
+    keep = kept_layers(len(splines), level.layer_step)
+    rings = np.empty((len(keep), level.points_per_layer, 3))
+    for i, k in enumerate(keep):
+        u_new = adaptive_parameters(splines[k], level.points_per_layer, level.adaptivity)
+        rings[i] = evaluate_layer_spline(splines[k], u_new=u_new)
+    return build_mesh_arrays(rings)
+
+def closest_points_on_triangles(points, a, b, c):
+    """
+    Ponto mais próximo de cada `points[i]` no triângulo (a[i], b[i], c[i]),
+    pelas regiões de Voronoi do triângulo (Ericson, "Real-Time Collision
+    Detection", 5.1.5), tudo vetorizado.
+    """
+    ab, ac, ap = b - a, c - a, points - a
+    d1 = np.einsum('ij,ij->i', ab, ap)
+    d2 = np.einsum('ij,ij->i', ac, ap)
+    bp = points - b
+    d3 = np.einsum('ij,ij->i', ab, bp)
+    d4 = np.einsum('ij,ij->i', ac, bp)
+    cp = points - c
+    d5 = np.einsum('ij,ij->i', ab, cp)
+    d6 = np.einsum('ij,ij->i', ac, cp)
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Interior da face.
+        denom = va + vb + vc
+        v = vb / denom
+        w = vc / denom
+        result = a + ab * v[:, None] + ac * w[:, None]
+
+        # Arestas (a ordem das atribuições segue a precedência das regiões).
+        on_bc = (va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0)
+        t = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+        result = np.where(on_bc[:, None], b + (c - b) * t[:, None], result)
+        on_ac = (vb <= 0) & (d2 >= 0) & (d6 <= 0)
+        t = d2 / (d2 - d6)
+        result = np.where(on_ac[:, None], a + ac * t[:, None], result)
+        on_ab = (vc <= 0) & (d1 >= 0) & (d3 <= 0)
+        t = d1 / (d1 - d3)
+        result = np.where(on_ab[:, None], a + ab * t[:, None], result)
+
+    # Vértices.
+    result = np.where(((d6 >= 0) & (d5 <= d6))[:, None], c, result)
+    result = np.where(((d3 >= 0) & (d4 <= d3))[:, None], b, result)
+    result = np.where(((d1 <= 0) & (d2 <= 0))[:, None], a, result)
+    return result
+
+def vertex_triangle_index(triangles, vertex_count):
+    """Triângulos incidentes em cada vértice: triângulos[starts[v]:starts[v + 1]] (formato CSR)."""
+    flat = triangles.ravel()
+    order = np.argsort(flat, kind='stable')
+    starts = np.searchsorted(flat[order], np.arange(vertex_count + 1))
+    return order // 3, starts
+
+def point_to_mesh_distance(points, vertices, triangles, candidates=DEVIATION_CANDIDATES, chunk_size=65536):
+    """
+    Distância de cada ponto à superfície da malha. Para cada ponto são testados
+    os triângulos incidentes nos `candidates` vértices mais próximos, o que
+    cobre também os triângulos compridos das tampas em leque.
+    """
+    incident, starts = vertex_triangle_index(triangles, len(vertices))
+    corners = vertices[triangles]
+    tree = cKDTree(vertices)
+    best = np.full(len(points), np.inf)
+    for first in range(0, len(points), chunk_size):
+        chunk = points[first:first + chunk_size]
+        _, nearest = tree.query(chunk, k=min(candidates, len(vertices)))
+        nearest = nearest.reshape(len(chunk), -1).ravel()
+        counts = starts[nearest + 1] - starts[nearest]
+        pair_point = np.repeat(np.repeat(np.arange(len(chunk)), len(nearest) // len(chunk)), counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        pair_triangle = incident[np.repeat(starts[nearest], counts) + within]
+
+        p = chunk[pair_point]
+        closest = closest_points_on_triangles(p, corners[pair_triangle, 0], corners[pair_triangle, 1],
+                                              corners[pair_triangle, 2])
+        distance = np.linalg.norm(p - closest, axis=1)
+        chunk_best = best[first:first + chunk_size]
+        np.minimum.at(chunk_best, pair_point, distance)
+    return best
+
+def max_deviation(reference, simplified):
+    """Desvio máximo (Hausdorff simétrico, avaliado nos vértices) entre duas malhas (vértices, triângulos)."""
+    return max(point_to_mesh_distance(reference[0], *simplified).max(),
+               point_to_mesh_distance(simplified[0], *reference).max())
+
+def level_path(output_base, level, extension):
+    return f"{output_base}_{level.name}{extension}"
+
+def export_lods(input_filepath, output_base, levels=LOD_LEVELS, extension='.stl', workers=SPLINE_WORKERS):
+    """
+    Gera e grava todos os níveis. Devolve uma lista de dicionários com o
+    nome do nível, ficheiro, pontos por anel, camadas, triângulos, tamanho e
+    desvio máximo em mm.
+    """
+    points_mm = np.asarray(load_points(input_filepath), dtype=np.float64)
+    layers = split_layers(points_mm)
+    if len(layers) < 2:
+        raise ValueError(f"'{input_filepath}': não foram detectadas camadas suficientes (precisa de pelo menos 2).")
+    splines = fit_layers(layers, workers=workers)
+
+    reference = build_level(splines, LodLevel('referencia', NUM_POINTS_PER_LAYER))
+    report = []
+    for level in levels:
+        started_at = time.perf_counter()
+        vertices, triangles = build_level(splines, level)
+        vertices, triangles = mesh_io.merge_close_vertices(vertices, triangles, MERGE_DISTANCE_MM)
+        deviation = max_deviation(reference, (vertices, triangles))
+        filepath = level_path(output_base, level, extension)
+        mesh_io.write_mesh(filepath, vertices * 0.001, triangles)
+        report.append({
+            'nivel': level.name,
+            'ficheiro': filepath,
+            'pontos_por_camada': level.points_per_layer,
+            'camadas': len(kept_layers(len(splines), level.layer_step)),
+            'triangulos': len(triangles),
+            'bytes': os.path.getsize(filepath),
+            'desvio_max_mm': float(deviation),
+            'tempo_s': time.perf_counter() - started_at,
+        })
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta a malha em vários níveis de detalhe.")
+    parser.add_argument('entrada', help="Ficheiro de pontos (.p3ds ou .txt).")
+    parser.add_argument('--saida-base', help="Prefixo dos ficheiros de saída (por omissão, o da entrada).")
+    parser.add_argument('--formato', choices=('stl', 'ply'), default='stl')
+    args = parser.parse_args()
+
+    output_base = args.saida_base or os.path.splitext(args.entrada)[0]
+    started_at = time.perf_counter()
+    report = export_lods(args.entrada, output_base, extension='.' + args.formato)
+
+    print(f"\n{'Nível':18s} {'Pts/anel':>8s} {'Camadas':>8s} {'Triângulos':>11s} {'Tamanho':>10s} {'Desvio máx':>11s}")
+    for row in report:
+        print(f"{row['nivel']:18s} {row['pontos_por_camada']:8d} {row['camadas']:8d} {row['triangulos']:11d} "
+              f"{row['bytes'] / 1024:8.0f} KB {row['desvio_max_mm']:8.3f} mm")
+    print(f"\n{len(report)} nível(is) gerado(s) em {time.perf_counter() - started_at:.2f} s.")
+
+if __name__ == "__main__":
+    main()
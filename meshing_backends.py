@@ -0,0 +1,349 @@
+# --- START OF FILE meshing_backends.py ---
+"""
+Métodos de geração de malha com uma interface comum, e comparação entre eles.
+
+Todos os métodos recebem a nuvem de pontos (N, 3) em mm e os parâmetros
+(`MeshParams`) e devolvem (vértices, triângulos), em mm:
+
+    vertices, triangles = mesh(points, MeshParams(), backend='fourier')
+
+Métodos registados (ver `BACKENDS`):
+
+    camadas           splines por camada e tampas em leque (o `build_universal_solid`)
+    fourier           o mesmo, com os contornos reconstruídos por série de Fourier
+    alpha             alpha shape da triangulação de Delaunay 3D (scipy), com a
+                      suavização Laplaciana do antigo generate_stl_test.py
+    delaunay_pyvista  o caminho do antigo test_files/generate_stl_test.py (pyvista)
+    poisson           reconstrução de Poisson do open3d
+
+Os que usam a nuvem completa (sem camadas) começam por reduzi-la a um ponto por
+voxel de `MeshParams.voxel_mm`: sem isso, o Delaunay e o Poisson não terminam
+em scans densos. Os que dependem de bibliotecas opcionais só aparecem como
+disponíveis se elas estiverem instaladas.
+
+A comparação corre cada método num processo à parte, com um tempo limite
+(o de cada método, ou --limite), e mostra o tempo, a memória, os triângulos e
+o desvio da malha em relação à nuvem de pontos original. Com --tolerancia,
+indica o método mais rápido cujo desvio (percentil 95) fica dentro dela:
+
+    python meshing_backends.py scans/peca.p3ds
+    python meshing_backends.py scans/peca.p3ds --metodos fourier alpha --tolerancia 0.5 --json comparacao.json
+"""
+
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import sys
+import time
+from dataclasses import asdict, dataclass, replace
+import numpy as np
+
+from generate_stl import (FOURIER_HARMONICS, NUM_POINTS_PER_LAYER, split_layers, resample_layers,
+                          build_mesh_arrays)
+from merge_scans import voxel_downsample
+from metrics import peak_rss_mb
+from point_store import load_points
+
+DEVIATION_SAMPLE_POINTS = 20000  # Pontos da nuvem original usados para medir o desvio
+POISSON_DENSITY_QUANTILE = 0.02  # Vértices de Poisson com menor densidade de pontos descartados
+
+STATUS_DONE = "concluido"
+STATUS_FAILED = "falhou"
+STATUS_TIMEOUT = "tempo esgotado"
+STATUS_UNAVAILABLE = "indisponivel"
+
+
+@dataclass(frozen=True)
+class MeshParams:
+    num_points_per_layer: int = NUM_POINTS_PER_LAYER
+    harmonics: int = FOURIER_HARMONICS
+    voxel_mm: float = 1.5              # Redução da nuvem nos métodos sem camadas
+    alpha_mm: float = 8.0              # Raio máximo das esferas do alpha shape (o caminho antigo usava 40 mm,
+                                       # que com a nuvem reduzida tapa as concavidades)
+    smoothing_iterations: int = 10     # O caminho antigo usava 50, que encolhe as peças pequenas
+    smoothing_relaxation: float = 0.1
+    poisson_depth: int = 8
+
+
+@dataclass(frozen=True)
+class MeshBackend:
+    name: str
+    function: object
+    full_cloud: bool           # Usa a nuvem completa (com redução por voxels) em vez das camadas
+    budget_s: float            # Tempo limite por omissão na comparação
+    requires: tuple = ()       # Módulos opcionais necessários
+    description: str = ""
+
+    @property
+    def available(self):
+        return all(importlib.util.find_spec(module) is not None for module in self.requires)
+
+
+BACKENDS = {}
+
+def register_backend(name, full_cloud=False, budget_s=60.0, requires=(), description=""):
+    """Decorador: regista `function(points, params) -> (vértices, triângulos)` com o nome `name`."""
+    def decorator(function):
+        BACKENDS[name] = MeshBackend(name, function, full_cloud, budget_s, tuple(requires), description)
+        return function
+    return decorator
+
+def available_backends():
+    return [name for name, backend in BACKENDS.items() if backend.available]
+
+def mesh(points, params=MeshParams(), backend='camadas'):
+    """Gera a malha de `points` (N, 3) em mm com o método `backend`. Devolve (vértices, triângulos)."""
+    entry = BACKENDS.get(backend)
+    if entry is None:
+        raise ValueError(f"Método de malha '{backend}' desconhecido. Disponíveis: {', '.join(BACKENDS)}.")
+    if not entry.available:
+        raise ValueError(f"O método '{backend}' precisa de: {', '.join(entry.requires)}.")
+    points = np.asarray(points, dtype=np.float64)
+    if entry.full_cloud:
+        points = voxel_downsample(points, params.voxel_mm)
+    return entry.function(points, params)
+
+
+# --- MÉTODOS POR CAMADAS ---
+
+def _layered(points, params, method):
+    layers = split_layers(points)
+    if len(layers) < 2:
+        raise ValueError(f"Foram detectadas {len(layers)} camadas válidas (precisa de pelo menos 2).")
+    rings = resample_layers(layers, params.num_points_per_layer, workers=1, method=method,
+                            harmonics=params.harmonics)
+    return build_mesh_arrays(rings)
+
+@register_backend('camadas', budget_s=120.0, description="Splines por camada e tampas em leque.")
+def layered_spline_backend(points, params):
+    return _layered(points, params, "spline")
+
+@register_backend('fourier', budget_s=30.0, description="Camadas com contornos por série de Fourier.")
+def layered_fourier_backend(points, params):
+    return _layered(points, params, "fourier")
+
+
+# --- MÉTODOS SOBRE A NUVEM COMPLETA ---
+
+def laplacian_smooth(vertices, triangles, iterations, relaxation):
+    """Suavização Laplaciana: cada vértice aproxima-se `relaxation` da média dos vizinhos, `iterations` vezes."""
+    from scipy.sparse import coo_matrix
+
+    if iterations <= 0 or len(triangles) == 0:
+        return vertices
+    edges = np.concatenate((triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]))
+    edges = np.concatenate((edges, edges[:, ::-1]))
+    n = len(vertices)
+    adjacency = coo_matrix((np.ones(len(edges)), (edges[:, 0], edges[:, 1])), shape=(n, n)).tocsr()
+    adjacency.data[:] = 1.0  # Arestas repetidas (partilhadas por dois triângulos) contam uma vez
+    degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    degree[degree == 0] = 1.0
+    vertices = vertices.copy()
+    for _ in range(iterations):
+        vertices += relaxation * (adjacency @ vertices / degree[:, None] - vertices)
+    return vertices
+
+def alpha_shape_surface(points, alpha):
+    """
+    Superfície de um alpha shape: tetraedros de Delaunay com raio da esfera
+    circunscrita até `alpha` e as faces que pertencem a um só deles, orientadas
+    para fora. Devolve (vértices usados, triângulos).
+    """
+    from scipy.spatial import Delaunay
+
+    tetrahedra = Delaunay(points).simplices
+    a, b, c, d = (points[tetrahedra[:, k]] for k in range(4))
+    u, v, w = b - a, c - a, d - a
+    volume6 = np.einsum('ij,ij->i', u, np.cross(v, w))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = ((np.einsum('ij,ij->i', u, u)[:, None] * np.cross(v, w)
+                   + np.einsum('ij,ij->i', v, v)[:, None] * np.cross(w, u)
+                   + np.einsum('ij,ij->i', w, w)[:, None] * np.cross(u, v)) / (2 * volume6[:, None]))
+    tetrahedra = tetrahedra[np.linalg.norm(offset, axis=1) <= alpha]
+
+    # Cada face com o vértice oposto; as da fronteira aparecem uma única vez.
+    faces = np.concatenate([tetrahedra[:, [1, 2, 3]], tetrahedra[:, [0, 2, 3]],
+                            tetrahedra[:, [0, 1, 3]], tetrahedra[:, [0, 1, 2]]])
+    opposite = np.concatenate([tetrahedra[:, k] for k in range(4)])
+    ordered = np.sort(faces, axis=1).astype(np.int64)
+    keys = (ordered[:, 0] << 42) | (ordered[:, 1] << 21) | ordered[:, 2]
+    _, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    boundary = first[counts == 1]
+    faces, opposite = faces[boundary], opposite[boundary]
+
+    normals = np.cross(points[faces[:, 1]] - points[faces[:, 0]], points[faces[:, 2]] - points[faces[:, 0]])
+    inward = np.einsum('ij,ij->i', normals, points[opposite] - points[faces[:, 0]]) > 0
+    faces[inward] = faces[inward][:, [0, 2, 1]]
+
+    used, triangles = np.unique(faces, return_inverse=True)
+    return points[used], triangles.reshape(-1, 3).astype(np.int32)
+
+@register_backend('alpha', full_cloud=True, budget_s=120.0,
+                  description="Alpha shape de Delaunay 3D (scipy) com suavização Laplaciana.")
+def alpha_backend(points, params):
+    if len(points) >= 1 << 21:
+        raise ValueError("Demasiados pontos para o alpha shape: aumente voxel_mm.")
+    vertices, triangles = alpha_shape_surface(points, params.alpha_mm)
+    return laplacian_smooth(vertices, triangles, params.smoothing_iterations, params.smoothing_relaxation), triangles
+
+@register_backend('delaunay_pyvista', full_cloud=True, budget_s=300.0, requires=('pyvista',),
+                  description="Caminho antigo: delaunay_3d, fill_holes e smooth do pyvista.")
+def pyvista_backend(points, params):
+    import pyvista as pv
+    surface = pv.PolyData(points).delaunay_3d(alpha=params.alpha_mm).extract_surface()
+    surface = surface.fill_holes(hole_size=1000.0)  # 1 m, como no caminho antigo
+    surface = surface.smooth(n_iter=params.smoothing_iterations, relaxation_factor=params.smoothing_relaxation)
+    surface = surface.triangulate()
+    return np.asarray(surface.points, dtype=np.float64), surface.faces.reshape(-1, 4)[:, 1:].astype(np.int32)
+
+@register_backend('poisson', full_cloud=True, budget_s=300.0, requires=('open3d',),
+                  description="Reconstrução de Poisson (open3d), normais orientadas para fora do eixo.")
+def poisson_backend(points, params):
+    import open3d as o3d
+    cloud = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(points))
+    cloud.estimate_normals(o3d.geometry.KDTreeSearchParamHybrid(radius=4 * params.voxel_mm, max_nn=30))
+    # Num scan do prato rotativo, a superfície é vista de fora: as normais apontam para longe do eixo.
+    normals = np.asarray(cloud.normals)
+    radial = points - np.append(points[:, :2].mean(axis=0), 0.0)
+    radial[:, 2] = 0.0
+    normals[np.einsum('ij,ij->i', normals, radial) < 0] *= -1
+    cloud.normals = o3d.utility.Vector3dVector(normals)
+    result, densities = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(cloud, depth=params.poisson_depth)
+    densities = np.asarray(densities)
+    result.remove_vertices_by_mask(densities < np.quantile(densities, POISSON_DENSITY_QUANTILE))
+    return np.asarray(result.vertices), np.asarray(result.triangles, dtype=np.int32)
+
+
+# --- COMPARAÇÃO ---
+
+def _backend_worker(connection, points, params, backend):
+    """Executado no processo de cada método: envia ('ok', resultado) ou (estado, mensagem)."""
+    try:
+        start_rss_mb = peak_rss_mb()
+        started_at = time.perf_counter()
+        vertices, triangles = mesh(points, params, backend)
+        seconds = time.perf_counter() - started_at
+        end_rss_mb = peak_rss_mb()
+        memory_mb = None if start_rss_mb is None or end_rss_mb is None else max(0.0, end_rss_mb - start_rss_mb)
+        connection.send(('ok', {'vertices': vertices, 'triangles': triangles, 'tempo_s': seconds,
+                                'memoria_mb': memory_mb}))
+    except Exception as e:
+        connection.send((STATUS_FAILED, str(e) or type(e).__name__))
+    finally:
+        connection.close()
+
+def run_backend(points, params, backend, budget_s=None):
+    """
+    Corre um método num processo à parte, terminado ao fim de `budget_s`
+    segundos (por omissão, o do método). Devolve (estado, resultado ou mensagem).
+    A memória é o crescimento do pico de memória residente do processo (inclui
+    as bibliotecas nativas, como o VTK ou o open3d).
+    """
+    entry = BACKENDS[backend]
+    if not entry.available:
+        return STATUS_UNAVAILABLE, f"precisa de {', '.join(entry.requires)}"
+    budget_s = entry.budget_s if budget_s is None else budget_s
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_backend_worker, args=(sender, points, params, backend))
+    process.start()
+    sender.close()
+    try:
+        if not receiver.poll(budget_s):
+            process.terminate()
+            return STATUS_TIMEOUT, f"mais de {budget_s:g} s"
+        try:
+            return receiver.recv()
+        except EOFError:
+            return STATUS_FAILED, "o processo terminou sem resultado"
+    finally:
+        process.join()
+        receiver.close()
+
+def cloud_deviation(points, vertices, triangles, sample_points=DEVIATION_SAMPLE_POINTS, seed=0):
+    """Distância (mm) de uma amostra dos pontos originais à superfície da malha: média, p95 e máximo."""
+    from mesh_lod import point_to_mesh_distance
+
+    if len(points) > sample_points:
+        points = points[np.random.default_rng(seed).choice(len(points), sample_points, replace=False)]
+    distance = point_to_mesh_distance(points, vertices, triangles)
+    return {'media_mm': float(distance.mean()), 'p95_mm': float(np.percentile(distance, 95)),
+            'max_mm': float(distance.max())}
+
+def compare_backends(points, backends, params=MeshParams(), budget_s=None, output_dir=None):
+    """Corre cada método sobre os mesmos pontos e devolve uma linha de resultados por método."""
+    import mesh_io
+
+    rows = []
+    for backend in backends:
+        status, value = run_backend(points, params, backend, budget_s)
+        row = {'metodo': backend, 'estado': STATUS_DONE if status == 'ok' else status}
+        if status == 'ok':
+            row.update(tempo_s=value['tempo_s'], memoria_mb=value['memoria_mb'],
+                       triangulos=len(value['triangles']),
+                       desvio=cloud_deviation(points, value['vertices'], value['triangles']))
+            if output_dir:
+                mesh_io.write_binary_stl(os.path.join(output_dir, f"{backend}.stl"),
+                                         value['vertices'] * 0.001, value['triangles'])
+        else:
+            row['mensagem'] = value
+        rows.append(row)
+        print(f"[{row['estado']}] {backend}" + (f" ({row['mensagem']})" if 'mensagem' in row else ""))
+    return rows
+
+def cheapest_within(rows, tolerance_mm):
+    """O método mais rápido cujo desvio (p95) fica dentro de `tolerance_mm`, ou None."""
+    candidates = [row for row in rows if row['estado'] == STATUS_DONE and row['desvio']['p95_mm'] <= tolerance_mm]
+    return min(candidates, key=lambda row: row['tempo_s'], default=None)
+
+def print_table(rows):
+    print(f"\n{'Método':18s} {'Estado':>15s} {'Tempo':>9s} {'Mem. MB':>8s} {'Triâng.':>9s} "
+          f"{'Desvio médio':>13s} {'p95':>8s} {'máx.':>8s}")
+    for row in rows:
+        if row['estado'] != STATUS_DONE:
+            print(f"{row['metodo']:18s} {row['estado']:>15s}  {row.get('mensagem', '')}")
+            continue
+        deviation = row['desvio']
+        memory = '-' if row['memoria_mb'] is None else f"{row['memoria_mb']:.1f}"
+        print(f"{row['metodo']:18s} {row['estado']:>15s} {row['tempo_s']:7.2f} s {memory:>8s} "
+              f"{row['triangulos']:9d} {deviation['media_mm']:10.3f} mm {deviation['p95_mm']:8.3f} "
+              f"{deviation['max_mm']:8.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara os métodos de geração de malha no mesmo scan.")
+    parser.add_argument('entrada', help="Ficheiro de pontos (.p3ds ou .txt).")
+    parser.add_argument('--metodos', nargs='+', choices=sorted(BACKENDS), default=list(BACKENDS))
+    parser.add_argument('--limite', type=float, help="Tempo limite de cada método (s); por omissão, o de cada um.")
+    parser.add_argument('--voxel', type=float, default=MeshParams.voxel_mm,
+                        help="Redução da nuvem nos métodos sem camadas (mm).")
+    parser.add_argument('--alpha', type=float, default=MeshParams.alpha_mm, help="Alpha (mm) dos métodos de Delaunay.")
+    parser.add_argument('--tolerancia', type=float, help="Desvio máximo aceite (p95, mm) para recomendar um método.")
+    parser.add_argument('--pasta-stl', help="Grava a malha de cada método nesta pasta.")
+    parser.add_argument('--json', help="Grava os resultados neste ficheiro JSON.")
+    args = parser.parse_args()
+
+    points = np.asarray(load_points(args.entrada), dtype=np.float64)
+    params = replace(MeshParams(), voxel_mm=args.voxel, alpha_mm=args.alpha)
+    if args.pasta_stl:
+        os.makedirs(args.pasta_stl, exist_ok=True)
+    print(f"{len(points)} pontos de '{args.entrada}'. Métodos disponíveis: {', '.join(available_backends())}.")
+    rows = compare_backends(points, args.metodos, params, args.limite, args.pasta_stl)
+    print_table(rows)
+
+    if args.tolerancia is not None:
+        best = cheapest_within(rows, args.tolerancia)
+        if best is None:
+            print(f"\nNenhum método ficou dentro de {args.tolerancia:g} mm (p95).")
+        else:
+            print(f"\nMétodo mais rápido dentro de {args.tolerancia:g} mm (p95): {best['metodo']} "
+                  f"({best['tempo_s']:.2f} s).")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'entrada': args.entrada, 'pontos': len(points), 'parametros': asdict(params),
+                       'resultados': rows}, f, indent=2, ensure_ascii=False)
+        print(f"Resultados gravados em '{args.json}'.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
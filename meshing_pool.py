@@ -0,0 +1,166 @@
+# --- START OF FILE meshing_pool.py ---
+"""
+Fila de trabalhos de geração de malha servida por um pool de processos.
+
+O recetor entrega cada scan terminado a `MeshingPool.submit()` e volta logo a
+receber dados. Os processos de trabalho importam o `generate_stl` (e com ele o
+scipy) apenas quando recebem o primeiro trabalho, e geram a malha no modo
+`headless`: sem janela e sem carregar o open3d.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+
+MESHING_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+
+STATUS_QUEUED = "em espera"
+STATUS_RUNNING = "em curso"
+STATUS_DONE = "concluido"
+STATUS_FAILED = "falhou"
+
+
+def _run_meshing_job(data_path, stl_path, spline_workers=1):
+    """Executado no processo de trabalho. Devolve as marcas de tempo e o nº de triângulos."""
+    started_at = time.perf_counter()
+    from generate_stl import build_universal_solid  # Importação pesada só no processo de trabalho
+    mesh = build_universal_solid(data_path, stl_path, workers=spline_workers, headless=True)
+    finished_at = time.perf_counter()
+    stage_times = metrics.get_metrics().take_stages()
+    if mesh is None:
+        raise RuntimeError(f"Não foi possível gerar a malha a partir de '{data_path}'.")
+    return {
+        'started_at': started_at,
+        'finished_at': finished_at,
+        'triangle_count': len(mesh.triangles),
+        'stage_times': stage_times,
+    }
+
+
+def _run_finalize_job(vertices, triangles, stl_path):
+    """
+    Executado no processo de trabalho para uma malha já construída em direto
+    (IncrementalMesher): falta apenas juntar vértices, normais e gravar.
+    """
+    started_at = time.perf_counter()
+    from generate_stl import finalize_mesh
+    mesh = finalize_mesh(vertices, triangles, stl_path, headless=True)
+    return {
+        'started_at': started_at,
+        'finished_at': time.perf_counter(),
+        'triangle_count': len(mesh.triangles),
+        'stage_times': metrics.get_metrics().take_stages(),
+    }
+
+
+class MeshingJob:
+    """
+    Um pedido de geração de malha e o respetivo estado. As marcas de tempo são
+    de `time.perf_counter()`, um relógio monotónico comum a todos os processos
+    da máquina; `submitted_at` é tirada antes de o trabalho entrar no pool.
+    """
+
+    def __init__(self, job_id, data_path, stl_path, future, submitted_at):
+        self.job_id = job_id
+        self.data_path = data_path
+        self.stl_path = stl_path
+        self.future = future
+        self.submitted_at = submitted_at
+        self.started_at = None
+        self.finished_at = None
+        self.triangle_count = None
+        self.stage_times = {}
+        self.error = None
+
+    @property
+    def status(self):
+        if self.future.done():
+            return STATUS_FAILED if self.future.cancelled() or self.future.exception() else STATUS_DONE
+        return STATUS_RUNNING if self.future.running() else STATUS_QUEUED
+
+    @property
+    def wait_time_s(self):
+        return None if self.started_at is None else self.started_at - self.submitted_at
+
+    @property
+    def run_time_s(self):
+        return None if self.finished_at is None else self.finished_at - self.started_at
+
+    def describe(self):
+        text = f"[{self.job_id}] malha {self.status}"
+        if self.finished_at is not None:
+            text += (f" ({self.triangle_count} triângulos, {self.wait_time_s:.1f} s na fila,"
+                     f" {self.run_time_s:.1f} s a gerar) -> '{self.stl_path}'")
+        elif self.error:
+            text += f": {self.error}"
+        return text
+
+
+class MeshingPool:
+    """
+    Pool de processos que gera as malhas em segundo plano. Os processos só são
+    criados no primeiro `submit()`, por isso criar o pool não custa nada.
+    Os núcleos são repartidos entre os trabalhos: cada um reconstrói as suas
+    camadas com `spline_workers` processos.
+
+    Se `metrics` estiver ativo, os processos de trabalho ativam também as suas
+    métricas (no mesmo ficheiro JSON-lines) e devolvem a duração de cada fase.
+    """
+
+    def __init__(self, max_workers=MESHING_WORKERS, on_job_done=None, spline_workers=None, metrics=None):
+        self.max_workers = max_workers
+        self.spline_workers = spline_workers or max(1, (os.cpu_count() or 1) // max_workers)
+        self.on_job_done = on_job_done
+        self.metrics_config = (True, metrics.log_path) if metrics is not None and metrics.enabled else None
+        self.executor = None
+        self.jobs = {}
+
+    def submit(self, job_id, data_path, stl_path):
+        """Gera a malha a partir do ficheiro de pontos completo."""
+        return self._submit(job_id, data_path, stl_path,
+                            _run_meshing_job, data_path, stl_path, self.spline_workers)
+
+    def submit_mesh(self, job_id, data_path, stl_path, vertices, triangles):
+        """Finaliza e grava uma malha cujos vértices e triângulos já foram calculados."""
+        return self._submit(job_id, data_path, stl_path,
+                            _run_finalize_job, vertices, triangles, stl_path)
+
+    def _submit(self, job_id, data_path, stl_path, fn, *args):
+        if self.executor is None:
+            if self.metrics_config is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                    initializer=metrics.configure, initargs=self.metrics_config)
+        submitted_at = time.perf_counter()
+        future = self.executor.submit(fn, *args)
+        job = MeshingJob(job_id, data_path, stl_path, future, submitted_at)
+        self.jobs[job_id] = job
+        future.add_done_callback(lambda f, job=job: self._job_done(job))
+        return job
+
+    def _job_done(self, job):
+        try:
+            result = job.future.result()
+            job.started_at = result['started_at']
+            job.finished_at = result['finished_at']
+            job.triangle_count = result['triangle_count']
+            job.stage_times = result['stage_times']
+        except Exception as e:
+            job.error = str(e) or type(e).__name__
+        if self.on_job_done is not None:
+            self.on_job_done(job)
+
+    def counts(self):
+        """Número de trabalhos em cada estado."""
+        counts = {STATUS_QUEUED: 0, STATUS_RUNNING: 0, STATUS_DONE: 0, STATUS_FAILED: 0}
+        for job in self.jobs.values():
+            counts[job.status] += 1
+        return counts
+
+    def shutdown(self, wait=True):
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait, cancel_futures=not wait)
+            self.executor = None
@@ -0,0 +1,241 @@
+# --- START OF FILE metrics.py ---
+"""
+Métricas de funcionamento do recetor e do gerador de malha.
+
+Enquanto não for chamado `configure(enabled=True, ...)`, `get_metrics()`
+devolve um registo nulo, cujos métodos não fazem nada: o custo para o
+código instrumentado é apenas o de uma chamada vazia por lote (nunca por ponto).
+
+Com as métricas ativas, os valores podem ser exportados de duas formas:
+
+    * um ficheiro JSON-lines (`log_path`), com um evento por linha
+      (fim de sessão, camada concluída, fase da malha, ...) e instantâneos
+      periódicos de todos os contadores;
+    * um endpoint HTTP local no formato de texto do Prometheus
+      (`serve_prometheus`), servido pelo próprio loop asyncio do recetor.
+
+Nomes das métricas: p3d_<nome>_total para contadores, p3d_<nome>_seconds
+para histogramas de tempo, etc. As etiquetas são passadas como argumentos
+nomeados: `metrics.inc('bytes_received_total', n, protocol='binario')`.
+"""
+
+import asyncio
+import bisect
+import contextlib
+import json
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows: o pico de memória vem do psutil, se estiver instalado
+
+PREFIX = "p3d_"
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def peak_rss_mb():
+    """Pico de memória residente do processo (MB), ou None se não houver forma de o medir."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory = psutil.Process().memory_info()
+    return getattr(memory, 'peak_wset', memory.rss) / (1024 * 1024)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+
+class Metrics:
+    """Registo de contadores, medidores e histogramas. Pode ser usado a partir de várias threads."""
+
+    enabled = True
+
+    def __init__(self, log_path=None):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.log_path = log_path
+        self.log_handle = open(log_path, 'a', encoding='utf-8') if log_path else None
+        self.last_stages = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def event(self, kind, **fields):
+        """Acrescenta uma linha ao ficheiro JSON-lines (se configurado)."""
+        if self.log_handle is None:
+            return
+        line = json.dumps({'ts': time.time(), 'evento': kind, **fields}, ensure_ascii=False)
+        with self.lock:
+            self.log_handle.write(line + "\n")
+            self.log_handle.flush()
+
+    @contextlib.contextmanager
+    def stage(self, name, **fields):
+        """
+        Mede a duração de uma fase da malha e quanto ela fez subir o pico de
+        memória residente do processo (fim - início, como no
+        meshing_backends.py). O pico nunca desce, por isso o valor absoluto
+        acumularia o das fases anteriores; o aumento é 0 numa fase que ficou
+        abaixo do pico já atingido.
+        """
+        start_peak_mb = peak_rss_mb()
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started_at
+            end_peak_mb = peak_rss_mb()
+            growth_mb = (None if start_peak_mb is None or end_peak_mb is None
+                         else max(0.0, end_peak_mb - start_peak_mb))
+            self.observe('mesh_stage_seconds', elapsed, stage=name)
+            if growth_mb is not None:
+                self.set('mesh_stage_peak_rss_growth_mb', growth_mb, stage=name)
+            self.last_stages[name] = elapsed
+            self.event('fase_malha', fase=name, duracao_s=elapsed, aumento_pico_rss_mb=growth_mb, **fields)
+
+    def take_stages(self):
+        """Devolve (e esquece) as durações das fases desde a última chamada."""
+        stages, self.last_stages = self.last_stages, {}
+        return stages
+
+    def snapshot(self):
+        """Todos os valores atuais, num dicionário serializável em JSON."""
+        def label_text(labels):
+            return ",".join(f"{k}={v}" for k, v in labels)
+        with self.lock:
+            return {
+                'contadores': {f"{n}{{{label_text(l)}}}": v for (n, l), v in self.counters.items()},
+                'medidores': {f"{n}{{{label_text(l)}}}": v for (n, l), v in self.gauges.items()},
+                'histogramas': {f"{n}{{{label_text(l)}}}": {'n': h.count, 'soma': h.sum, 'max': h.max}
+                                for (n, l), h in self.histograms.items()},
+            }
+
+    def log_snapshot(self):
+        self.event('instantaneo', **self.snapshot())
+
+    def prometheus_text(self):
+        """Exporta tudo no formato de texto do Prometheus (versão 0.0.4)."""
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        lines = []
+        with self.lock:
+            for kind, values in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted({n for n, _ in values}):
+                    lines.append(f"# TYPE {PREFIX}{name} {kind}")
+                    for (n, labels), value in values.items():
+                        if n == name:
+                            lines.append(f"{PREFIX}{name}{fmt(labels)} {value}")
+            for name in sorted({n for n, _ in self.histograms}):
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                for (n, labels), h in self.histograms.items():
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(h.buckets, h.counts):
+                        cumulative += count
+                        lines.append(f"{PREFIX}{name}_bucket{fmt(labels, [('le', bound)])} {cumulative}")
+                    lines.append(f"{PREFIX}{name}_bucket{fmt(labels, [('le', '+Inf')])} {h.count}")
+                    lines.append(f"{PREFIX}{name}_sum{fmt(labels)} {h.sum}")
+                    lines.append(f"{PREFIX}{name}_count{fmt(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        if self.log_handle is not None:
+            self.log_handle.close()
+            self.log_handle = None
+
+
+class NullMetrics:
+    """Registo desativado: aceita as mesmas chamadas e não faz nada."""
+
+    enabled = False
+    _null_stage = contextlib.nullcontext()
+
+    def inc(self, name, value=1, **labels): pass
+    def set(self, name, value, **labels): pass
+    def observe(self, name, value, **labels): pass
+    def event(self, kind, **fields): pass
+    def stage(self, name, **fields): return self._null_stage
+    def take_stages(self): return {}
+    def log_snapshot(self): pass
+    def close(self): pass
+
+
+_metrics = NullMetrics()
+
+def get_metrics():
+    return _metrics
+
+def configure(enabled=True, log_path=None):
+    """Ativa (ou desativa) as métricas deste processo. Devolve o registo em uso."""
+    global _metrics
+    _metrics.close()
+    _metrics = Metrics(log_path) if enabled else NullMetrics()
+    return _metrics
+
+
+async def serve_prometheus(metrics, host='127.0.0.1', port=9108):
+    """
+    Servidor HTTP mínimo: responde a qualquer pedido com `metrics.prometheus_text()`.
+    Devolve o asyncio.Server (com port=0 o sistema escolhe uma porta livre).
+    """
+    async def handle(reader, writer):
+        try:
+            # Lê o pedido até à linha em branco; o caminho é ignorado.
+            while (await asyncio.wait_for(reader.readline(), 5.0)).strip():
+                pass
+            body = metrics.prometheus_text().encode('utf-8')
+            writer.write(b"HTTP/1.1 200 OK\r\n"
+                         b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('ascii')
+                         + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,297 @@
+# --- START OF FILE point_feed.py ---
+"""
+Canal local de publicação dos pontos recebidos (pub/sub em TCP, 127.0.0.1).
+
+O recetor publica cada lote de pontos já convertidos assim que o recebe, sem
+esperar pelo ficheiro; o visualizador, o gravador e outras ferramentas podem
+subscrever ao mesmo tempo. Cada subscritor tem a sua própria fila limitada
+(FEED_QUEUE_MESSAGES lotes de pontos): se não acompanhar o ritmo, os lotes que
+não cabem na fila são descartados para esse subscritor (e contados), sem nunca
+atrasar a receção nem os outros subscritores. As mensagens de controlo (início
+e fim de sessão, pontos perdidos) nunca são descartadas: não contam para o
+limite, e são no máximo algumas por sessão.
+
+Mensagens (little-endian): [tipo: 1 byte][id da sessão: uint16 + bytes]
+[tamanho dos dados: uint32][instante da publicação: float64][dados]
+
+    'S'  início de sessão  dados: JSON {"ficheiro": ..., "perfil": ...}
+    'P'  pontos            dados: float32 (N, 3), em mm
+    'L'  pontos perdidos   dados: JSON {"pontos": N} (fila do subscritor cheia)
+    'E'  fim de sessão     dados: JSON {"pontos": N, "completa": true/false}
+
+    python point_feed.py monitor            # mostra as sessões e a latência
+    python point_feed.py gravar pasta/      # grava cada sessão num .p3ds
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import select
+import socket
+import struct
+import sys
+import time
+import numpy as np
+
+FEED_HOST = '127.0.0.1'
+FEED_PORT = 5001
+FEED_QUEUE_MESSAGES = 256  # Lotes de pontos em espera por subscritor antes de começar a descartar
+
+MESSAGE_HEADER = struct.Struct('<cHId')
+SESSION_START = b'S'
+POINTS = b'P'
+POINTS_LOST = b'L'
+SESSION_END = b'E'
+
+
+def encode_message(kind, session_id, payload, published_at=None):
+    sid = session_id.encode('utf-8')
+    header = MESSAGE_HEADER.pack(kind, len(sid), len(payload),
+                                 time.time() if published_at is None else published_at)
+    return header + sid + payload
+
+def encode_json(kind, session_id, **fields):
+    return encode_message(kind, session_id, json.dumps(fields, ensure_ascii=False).encode('utf-8'))
+
+def encode_points(session_id, points):
+    return encode_message(POINTS, session_id, np.ascontiguousarray(points, dtype='<f4').tobytes())
+
+
+class FeedMessage:
+    def __init__(self, kind, session_id, published_at, payload):
+        self.kind = kind
+        self.session_id = session_id
+        self.published_at = published_at
+        self.payload = payload
+
+    @property
+    def points(self):
+        return np.frombuffer(self.payload, dtype='<f4').reshape(-1, 3)
+
+    @property
+    def fields(self):
+        return json.loads(self.payload.decode('utf-8'))
+
+def decode_messages(buffer):
+    """Extrai as mensagens completas de `buffer` (bytearray), que fica só com o resto."""
+    messages = []
+    pos = 0
+    while len(buffer) - pos >= MESSAGE_HEADER.size:
+        kind, sid_size, payload_size, published_at = MESSAGE_HEADER.unpack_from(buffer, pos)
+        end = pos + MESSAGE_HEADER.size + sid_size + payload_size
+        if len(buffer) < end:
+            break
+        sid_start = pos + MESSAGE_HEADER.size
+        session_id = bytes(buffer[sid_start:sid_start + sid_size]).decode('utf-8')
+        messages.append(FeedMessage(kind, session_id, published_at, bytes(buffer[sid_start + sid_size:end])))
+        pos = end
+    del buffer[:pos]
+    return messages
+
+
+class _Subscriber:
+    """Uma ligação de um subscritor, com a sua fila limitada e a tarefa que a esvazia."""
+
+    def __init__(self, writer, queue_size):
+        self.writer = writer
+        self.queue = asyncio.Queue()  # (mensagem, é um lote de pontos); só os lotes são limitados
+        self.max_points_messages = queue_size
+        self.queued_points_messages = 0
+        self.lost_points = {}  # Pontos descartados por sessão, ainda por anunciar
+        self.task = asyncio.create_task(self.send_loop())
+
+    def offer(self, message, session_id=None, point_count=0):
+        """
+        Põe a mensagem na fila. Um lote de pontos (com `session_id`) é descartado
+        se a fila já tiver o máximo de lotes; as mensagens de controlo entram sempre.
+        """
+        is_points = session_id is not None
+        if is_points and self.queued_points_messages >= self.max_points_messages:
+            self.lost_points[session_id] = self.lost_points.get(session_id, 0) + point_count
+            return False
+        if self.lost_points:
+            # Antes da próxima mensagem: avisa quantos pontos se perderam.
+            for sid, lost in self.lost_points.items():
+                self.queue.put_nowait((encode_json(POINTS_LOST, sid, pontos=lost), False))
+            self.lost_points.clear()
+        self.queue.put_nowait((message, is_points))
+        self.queued_points_messages += is_points
+        return True
+
+    async def send_loop(self):
+        while True:
+            message, is_points = await self.queue.get()
+            self.queued_points_messages -= is_points
+            self.writer.write(message)
+            await self.writer.drain()
+
+
+class PointFeed:
+    """Servidor de publicação, a correr no loop asyncio do recetor. `publish_*` nunca bloqueia."""
+
+    def __init__(self, host=FEED_HOST, port=FEED_PORT, queue_size=FEED_QUEUE_MESSAGES, metrics=None):
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.metrics = metrics
+        self.subscribers = set()
+        self.handlers = set()
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_subscriber, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def handle_subscriber(self, reader, writer):
+        subscriber = _Subscriber(writer, self.queue_size)
+        self.subscribers.add(subscriber)
+        self.handlers.add(asyncio.current_task())
+        self._count_subscribers()
+        try:
+            # Os subscritores não enviam nada: espera que a ligação feche ou que o envio falhe.
+            read_task = asyncio.ensure_future(reader.read())
+            done, pending = await asyncio.wait([read_task, subscriber.task], return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            for task in done:
+                if not task.cancelled():
+                    task.exception()  # Erro de envio ou de leitura: a ligação fechou
+        except ConnectionError:
+            pass
+        finally:
+            subscriber.task.cancel()
+            self.subscribers.discard(subscriber)
+            self.handlers.discard(asyncio.current_task())
+            self._count_subscribers()
+            writer.close()
+
+    def _count_subscribers(self):
+        if self.metrics is not None:
+            self.metrics.set('feed_subscribers', len(self.subscribers))
+
+    def _publish(self, message, session_id=None, point_count=0):
+        for subscriber in self.subscribers:
+            if not subscriber.offer(message, session_id, point_count) and self.metrics is not None:
+                self.metrics.inc('feed_dropped_points_total', point_count)
+
+    def publish_session_start(self, session_id, data_path, profile_name):
+        if self.subscribers:
+            self._publish(encode_json(SESSION_START, session_id, ficheiro=data_path, perfil=profile_name))
+
+    def publish_points(self, session_id, points):
+        if self.subscribers and len(points):
+            self._publish(encode_points(session_id, points), session_id, len(points))
+
+    def publish_session_end(self, session_id, point_count, complete):
+        if self.subscribers:
+            self._publish(encode_json(SESSION_END, session_id, pontos=point_count, completa=complete))
+
+    async def close(self):
+        for subscriber in list(self.subscribers):
+            subscriber.task.cancel()
+        # Cada ligação termina assim que a sua tarefa de envio é cancelada.
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        self.server.close()
+        await self.server.wait_closed()
+
+
+class PointFeedClient:
+    """
+    Subscritor síncrono (sem asyncio), para ciclos como o do matplotlib:
+    `poll()` devolve de imediato as mensagens já recebidas.
+    """
+
+    def __init__(self, host=FEED_HOST, port=FEED_PORT, timeout_s=2.0):
+        self.sock = socket.create_connection((host, port), timeout=timeout_s)
+        self.sock.setblocking(False)
+        self.buffer = bytearray()
+        self.closed = False
+
+    def poll(self):
+        while not self.closed:
+            try:
+                data = self.sock.recv(1 << 20)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                data = b''
+            if not data:
+                self.closed = True  # O recetor terminou
+                break
+            self.buffer += data
+        return decode_messages(self.buffer)
+
+    def wait(self, timeout_s):
+        """Como `poll()`, mas espera até `timeout_s` segundos pela primeira mensagem."""
+        if not self.closed:
+            select.select([self.sock], [], [], timeout_s)
+        return self.poll()
+
+    def close(self):
+        self.sock.close()
+        self.closed = True
+
+
+def monitor(client):
+    counts = {}
+    while not client.closed:
+        for message in client.wait(1.0):
+            latency_ms = (time.time() - message.published_at) * 1000
+            if message.kind == SESSION_START:
+                counts[message.session_id] = 0
+                print(f"[{message.session_id}] início -> {message.fields['ficheiro']}")
+            elif message.kind == POINTS:
+                counts[message.session_id] = counts.get(message.session_id, 0) + len(message.points)
+                print(f"[{message.session_id}] {counts[message.session_id]:8d} pontos (latência {latency_ms:.1f} ms)")
+            elif message.kind == POINTS_LOST:
+                print(f"[{message.session_id}] [Aviso] {message.fields['pontos']} pontos descartados (fila cheia).")
+            elif message.kind == SESSION_END:
+                print(f"[{message.session_id}] fim: {message.fields['pontos']} pontos.")
+
+def record(client, output_dir):
+    from point_store import PointStoreWriter
+    os.makedirs(output_dir, exist_ok=True)
+    writers = {}
+    try:
+        while not client.closed:
+            for message in client.wait(1.0):
+                if message.kind == POINTS:
+                    writer = writers.get(message.session_id)
+                    if writer is None:
+                        path = os.path.join(output_dir, f"{message.session_id}.p3ds")
+                        writer = writers[message.session_id] = PointStoreWriter(path)
+                        print(f"A gravar '{path}'...")
+                    writer.write(message.points)
+                elif message.kind == SESSION_END and message.session_id in writers:
+                    writers.pop(message.session_id).close()
+                    print(f"[{message.session_id}] gravado ({message.fields['pontos']} pontos).")
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Subscreve os pontos publicados pelo scanner_receiver.")
+    parser.add_argument('comando', choices=('monitor', 'gravar'))
+    parser.add_argument('pasta', nargs='?', default="feed", help="Pasta de saída (gravar).")
+    parser.add_argument('--porta', type=int, default=FEED_PORT)
+    args = parser.parse_args()
+    try:
+        client = PointFeedClient(port=args.porta)
+    except OSError as e:
+        print(f"[ERRO] Não foi possível ligar ao recetor em {FEED_HOST}:{args.porta}: {e}")
+        return 1
+    try:
+        if args.comando == 'monitor':
+            monitor(client)
+        else:
+            record(client, args.pasta)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
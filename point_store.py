@@ -0,0 +1,346 @@
+# --- START OF FILE point_store.py ---
+"""
+Formato binário (append-only) para as nuvens de pontos do scanner.
+
+Estrutura do ficheiro (little-endian):
+    [cabeçalho de 72 bytes][registo 0][registo 1]...
+
+    Cabeçalho: magic 'P3DS', versão, flags, tamanho do cabeçalho, tamanho do
+    registo, número de registos, número de camadas, calibração usada
+    (SENSOR_OFFSET_MM, OFFSET_X, OFFSET_Y), o nome do perfil de calibração e,
+    desde a versão 4, o número de pontos válidos (nas versões anteriores o
+    cabeçalho tem 64 bytes e termina no nome do perfil).
+    Registo: x, y, z em float32 (mm) e, se a flag FLAG_RAW estiver ativa, também
+    a leitura em bruto que lhe deu origem (distância, ângulo, altura) em float32,
+    para que o scan possa ser re-projetado com outro perfil de calibração.
+
+Desde a versão 3, as leituras rejeitadas pelo perfil (fora de 0 < d <
+SENSOR_OFFSET_MM) também são gravadas, com x e y a NaN e a altura da leitura,
+para que outro perfil as possa aproveitar. A flag FLAG_REJECTED indica que o
+ficheiro tem registos destes; `open_points`, `PointTail` e os restantes
+leitores devolvem só os pontos válidos. No cabeçalho, `point_count` conta
+todos os registos (é o que permite mapear o ficheiro) e `valid_count` só os
+pontos válidos (o que os leitores devolvem).
+
+Os registos são sempre escritos antes de os contadores do cabeçalho serem
+atualizados, por isso um leitor que consulte o cabeçalho nunca vê pontos
+incompletos. A leitura é feita por `np.memmap`, sem qualquer parsing.
+"""
+
+import os
+import struct
+import sys
+import time
+import numpy as np
+
+MAGIC = b'P3DS'
+VERSION = 4
+FLAG_RAW = 0x1       # Os registos incluem as leituras em bruto
+FLAG_REJECTED = 0x2  # Há registos de leituras rejeitadas pelo perfil (x, y = NaN)
+HEADER_FORMAT = '<4sHHHHQIddd16s'          # Comum a todas as versões (64 bytes)
+VALID_COUNT_FORMAT = '<Q'                    # Versão 4: número de pontos válidos
+_BASE_HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+HEADER_SIZE = _BASE_HEADER_SIZE + struct.calcsize(VALID_COUNT_FORMAT)  # 72 bytes
+POINT_DTYPE = np.dtype([('xyz', '<f4', (3,))])
+RAW_POINT_DTYPE = np.dtype([('xyz', '<f4', (3,)), ('raw', '<f4', (3,))])
+
+# Offsets dos campos do cabeçalho atualizados a cada flush.
+_FLAGS_OFFSET = 6
+_FLAGS_FORMAT = '<H'
+_COUNTS_OFFSET = 12
+_COUNTS_FORMAT = '<QI'
+_VALID_COUNT_OFFSET = 64
+
+LAYER_TOLERANCE_MM = 0.1  # Igual à tolerância usada em generate_stl para separar camadas
+
+
+def is_point_store(filepath):
+    """Indica se o ficheiro está no formato binário (verifica o magic)."""
+    try:
+        with open(filepath, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+def read_header(filepath):
+    """
+    Lê o cabeçalho de um ficheiro binário e devolve-o como dicionário. Nos
+    ficheiros da versão 3 com leituras rejeitadas, que não guardam
+    `valid_count`, os pontos válidos são contados nos registos.
+    """
+    with open(filepath, 'rb') as f:
+        raw = f.read(HEADER_SIZE)
+    if len(raw) < _BASE_HEADER_SIZE or raw[:4] != MAGIC:
+        raise ValueError(f"'{filepath}' não é um ficheiro de pontos binário válido.")
+    (magic, version, flags, header_size, record_size, point_count, layer_count,
+     sensor_offset_mm, offset_x, offset_y, profile) = struct.unpack_from(HEADER_FORMAT, raw)
+    if version > VERSION:
+        raise ValueError(f"Versão {version} do formato não suportada (máximo {VERSION}).")
+    if version >= 4:
+        if len(raw) < HEADER_SIZE:
+            raise ValueError(f"'{filepath}' não é um ficheiro de pontos binário válido.")
+        valid_count, = struct.unpack_from(VALID_COUNT_FORMAT, raw, _VALID_COUNT_OFFSET)
+    elif flags & FLAG_REJECTED and point_count:
+        xyz = np.memmap(filepath, dtype=np.dtype((np.float32, record_size // 4)), mode='r',
+                        offset=header_size, shape=(point_count,))
+        valid_count = int(np.count_nonzero(~np.isnan(xyz[:, 0])))
+    else:
+        valid_count = point_count
+    return {
+        'version': version,
+        'flags': flags,
+        'header_size': header_size,
+        'record_size': record_size,
+        'point_count': point_count,
+        'valid_count': valid_count,
+        'layer_count': layer_count,
+        'sensor_offset_mm': sensor_offset_mm,
+        'offset_x': offset_x,
+        'offset_y': offset_y,
+        'profile': profile.rstrip(b'\0').decode('utf-8', errors='replace'),
+    }
+
+def record_dtype(header):
+    """Tipo dos registos de um ficheiro, de acordo com as flags do cabeçalho."""
+    dtype = RAW_POINT_DTYPE if header['flags'] & FLAG_RAW else POINT_DTYPE
+    if dtype.itemsize != header['record_size']:
+        raise ValueError(f"Tamanho de registo inesperado ({header['record_size']} bytes).")
+    return dtype
+
+def open_records(filepath):
+    """Mapeia todos os registos do ficheiro em memória (array estruturado, sem cópia)."""
+    header = read_header(filepath)
+    dtype = record_dtype(header)
+    count = header['point_count']
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(filepath, dtype=dtype, mode='r', offset=header['header_size'], shape=(count,))
+
+def valid_points(xyz):
+    """Descarta os registos de leituras rejeitadas (x = NaN)."""
+    return xyz[~np.isnan(xyz[:, 0])]
+
+def open_points(filepath):
+    """
+    Mapeia o ficheiro binário em memória e devolve uma vista (N, 3) float32
+    dos pontos em mm. Não copia nem interpreta os dados, exceto se o ficheiro
+    tiver leituras rejeitadas (FLAG_REJECTED): aí devolve uma cópia sem elas.
+    """
+    xyz = open_records(filepath)['xyz']
+    return valid_points(xyz) if read_header(filepath)['flags'] & FLAG_REJECTED else xyz
+
+def open_raw(filepath):
+    """
+    Vista (N, 3) float32 das leituras em bruto (distância, ângulo, altura), ou
+    None se não existirem. Inclui as leituras que o perfil rejeitou.
+    """
+    records = open_records(filepath)
+    return records['raw'] if 'raw' in records.dtype.names else None
+
+def load_points(filepath):
+    """
+    Carrega uma nuvem de pontos em mm, qualquer que seja o formato: binário
+    (via memmap), grelha camada x ângulo (scan_grid.py) ou o texto "x,y,z" original.
+    """
+    if is_point_store(filepath):
+        return open_points(filepath)
+    from scan_grid import ScanGrid, is_scan_grid
+    if is_scan_grid(filepath):
+        return ScanGrid.load(filepath).to_xyz()
+    return np.loadtxt(filepath, delimiter=",", ndmin=2)
+
+def count_layers(z, previous_z=None, tolerance=LAYER_TOLERANCE_MM):
+    """Conta as mudanças de camada (saltos de Z acima da tolerância) num lote de alturas."""
+    if len(z) == 0:
+        return 0
+    if previous_z is None:
+        return 1 + int(np.count_nonzero(np.abs(np.diff(z)) > tolerance))
+    return int(np.count_nonzero(np.abs(np.diff(z, prepend=previous_z)) > tolerance))
+
+
+class PointStoreWriter:
+    """
+    Escreve pontos num ficheiro binário em lotes. Os pontos ficam em memória
+    até passarem `flush_interval_s` segundos ou haver `flush_interval_points`
+    pontos pendentes; cada flush acrescenta os registos e atualiza o cabeçalho.
+    Com `store_raw=True`, cada `write()` recebe também as leituras em bruto;
+    as que o perfil rejeitou vêm com x, y = NaN (ver
+    `calibration_profiles.project_records`).
+    Se for dado, `on_flush(ages)` é chamado depois de cada escrita em disco com
+    a lista (segundos em memória, nº de pontos) de cada `write()` incluído.
+    """
+
+    def __init__(self, filepath, calibration=(0.0, 0.0, 0.0), profile_name="",
+                 flush_interval_s=0.25, flush_interval_points=4096, store_raw=False, on_flush=None):
+        self.filepath = filepath
+        self.store_raw = store_raw
+        self.dtype = RAW_POINT_DTYPE if store_raw else POINT_DTYPE
+        self.flags = FLAG_RAW if store_raw else 0
+        self.flags_written = self.flags
+        self.flush_interval_s = flush_interval_s
+        self.flush_interval_points = flush_interval_points
+        self.pending = []
+        self.pending_count = 0
+        self.on_flush = on_flush
+        self.pending_times = []
+        self.point_count = 0
+        self.valid_count = 0
+        self.layer_count = 0
+        self.last_z = None
+        self.last_flush = time.monotonic()
+
+        sensor_offset_mm, offset_x, offset_y = calibration
+        self.file_handle = open(filepath, 'wb')
+        self.file_handle.write(struct.pack(
+            HEADER_FORMAT, MAGIC, VERSION, self.flags, HEADER_SIZE, self.dtype.itemsize, 0, 0,
+            sensor_offset_mm, offset_x, offset_y, profile_name.encode('utf-8')[:16]))
+        self.file_handle.write(struct.pack(VALID_COUNT_FORMAT, 0))
+        self.file_handle.flush()
+
+    def write(self, points, raw=None):
+        if len(points):
+            records = np.empty(len(points), dtype=self.dtype)
+            records['xyz'] = points
+            if self.store_raw:
+                records['raw'] = raw
+                if not self.flags & FLAG_REJECTED and np.isnan(records['xyz'][:, 0]).any():
+                    self.flags |= FLAG_REJECTED
+            self.pending.append(records)
+            self.pending_count += len(points)
+            if self.on_flush is not None:
+                self.pending_times.append((time.monotonic(), len(points)))
+        if (self.pending_count >= self.flush_interval_points
+                or time.monotonic() - self.last_flush >= self.flush_interval_s):
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            batch = np.concatenate(self.pending)
+            self.pending = []
+            self.pending_count = 0
+
+            z = batch['xyz'][:, 2]
+            self.layer_count += count_layers(z, self.last_z)
+            self.last_z = z[-1]
+            self.point_count += len(batch)
+            self.valid_count += len(batch) - int(np.count_nonzero(np.isnan(batch['xyz'][:, 0])))
+
+            self.file_handle.seek(0, os.SEEK_END)
+            self.file_handle.write(batch.tobytes())
+            self.file_handle.flush()
+            if self.flags != self.flags_written:
+                # Antes dos contadores: um leitor nunca vê registos rejeitados sem a flag.
+                self.file_handle.seek(_FLAGS_OFFSET)
+                self.file_handle.write(struct.pack(_FLAGS_FORMAT, self.flags))
+                self.flags_written = self.flags
+            self.file_handle.seek(_VALID_COUNT_OFFSET)
+            self.file_handle.write(struct.pack(VALID_COUNT_FORMAT, self.valid_count))
+            self.file_handle.seek(_COUNTS_OFFSET)
+            self.file_handle.write(struct.pack(_COUNTS_FORMAT, self.point_count, self.layer_count))
+        self.file_handle.flush()
+        self.last_flush = time.monotonic()
+        if self.pending_times:
+            ages = [(self.last_flush - written_at, n) for written_at, n in self.pending_times]
+            self.pending_times = []
+            self.on_flush(ages)
+
+    def close(self):
+        if not self.file_handle.closed:
+            self.flush()
+            self.file_handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PointTail:
+    """
+    Acompanha um ficheiro de pontos que ainda está a ser escrito e devolve
+    apenas os pontos novos a cada chamada de `read_new()`. Funciona com o
+    formato binário e com o formato de texto.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.points_read = 0
+        self.text_handle = None
+
+    def read_new(self):
+        if not os.path.exists(self.filepath):
+            return None
+        if self.text_handle is None and is_point_store(self.filepath):
+            return self._read_new_binary()
+        return self._read_new_text()
+
+    def _read_new_binary(self):
+        header = read_header(self.filepath)
+        count = header['point_count']
+        if count < self.points_read:
+            # O ficheiro foi recriado por um novo scan.
+            self.points_read = 0
+        if count == self.points_read:
+            return None
+        with open(self.filepath, 'rb') as f:
+            f.seek(header['header_size'] + self.points_read * header['record_size'])
+            records = np.fromfile(f, dtype=record_dtype(header), count=count - self.points_read)
+        self.points_read += len(records)
+        points = valid_points(records['xyz']) if header['flags'] & FLAG_REJECTED else records['xyz']
+        return points if len(points) else None
+
+    def _read_new_text(self):
+        if self.text_handle is None:
+            self.text_handle = open(self.filepath, 'r')
+        new_lines = self.text_handle.readlines()
+        if not new_lines:
+            return None
+        new_points = []
+        for line in new_lines:
+            line = line.strip()
+            if line:
+                try:
+                    new_points.append([float(val) for val in line.split(',')])
+                except (ValueError, IndexError):
+                    # Ignora linhas mal formatadas
+                    pass
+        self.points_read += len(new_points)
+        return np.array(new_points) if new_points else None
+
+    def close(self):
+        if self.text_handle is not None:
+            self.text_handle.close()
+            self.text_handle = None
+
+
+def text_to_store(text_filepath, store_filepath, calibration=(0.0, 0.0, 0.0), profile_name=""):
+    """Converte um ficheiro de texto "x,y,z" para o formato binário."""
+    points = np.loadtxt(text_filepath, delimiter=",", ndmin=2)
+    with PointStoreWriter(store_filepath, calibration, profile_name) as writer:
+        writer.write(points)
+    return len(points)
+
+def store_to_text(store_filepath, text_filepath):
+    """Converte um ficheiro binário para o formato de texto "x,y,z" original."""
+    points = np.asarray(open_points(store_filepath), dtype=np.float64)
+    with open(text_filepath, 'w') as f:
+        f.write(("%.6f,%.6f,%.6f\n" * len(points)) % tuple(points.ravel()))
+    return len(points)
+
+def main(argv):
+    if len(argv) != 4 or argv[1] not in ('para-binario', 'para-texto'):
+        print("Uso: python point_store.py para-binario <entrada.txt> <saida.p3ds>")
+        print("     python point_store.py para-texto <entrada.p3ds> <saida.txt>")
+        return 1
+    command, source, target = argv[1:]
+    if command == 'para-binario':
+        n = text_to_store(source, target)
+    else:
+        n = store_to_text(source, target)
+    print(f"{n} pontos convertidos: '{source}' -> '{target}' "
+          f"({os.path.getsize(source)} -> {os.path.getsize(target)} bytes).")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
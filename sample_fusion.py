@@ -0,0 +1,189 @@
+# --- START OF FILE sample_fusion.py ---
+"""
+Fusão, no PC, das várias amostras que o sensor faz em cada ângulo.
+
+O firmware original faz NUMERO_DE_AMOSTRAS leituras por ângulo e envia só a
+média. No modo de amostras em bruto (wifi_rotacao_amostras_brutas.ino, que pede
+"HELLO P3DB/1 RAW"), envia todas as amostras, cada uma com o seu ângulo e
+altura, e é o recetor que as junta num único ponto por ângulo. Assim o prato
+pode parar menos tempo em cada passo e as amostras ficam gravadas (em
+scans/amostras/) para poderem ser filtradas de novo mais tarde.
+
+As amostras do mesmo ângulo chegam seguidas; cada sequência com o mesmo
+(ângulo, altura) é um grupo. Em cada grupo, de forma vetorizada:
+
+    1. descartam-se as amostras inválidas (distância <= 0, o firmware envia 0
+       quando o sensor indica fora de alcance);
+    2. rejeitam-se os outliers a mais de `mad_limit` desvios robustos
+       (1,4826 x MAD) da mediana;
+    3. o ponto final é a mediana, a média aparada ou a média das restantes.
+
+Para voltar a fundir as amostras gravadas com outros parâmetros:
+
+    python sample_fusion.py scans/amostras/<sessão>.p3ds refundido.p3ds --metodo media_aparada
+"""
+
+import argparse
+import sys
+import numpy as np
+
+import point_store
+
+FUSION_METHODS = ('mediana', 'media_aparada', 'media')
+FUSION_METHOD = 'mediana'
+TRIM_FRACTION = 0.2      # Fração descartada em cada ponta na média aparada
+OUTLIER_MAD_LIMIT = 3.0  # Rejeita amostras a mais de N desvios robustos da mediana (None = não rejeita)
+MIN_SIGMA_MM = 1.0       # O sensor mede em mm inteiros: abaixo disto, amostras iguais dariam MAD = 0
+MAD_TO_SIGMA = 1.4826
+
+
+def group_starts(samples):
+    """Índices onde começa cada sequência de amostras com o mesmo (ângulo, altura)."""
+    if len(samples) == 0:
+        return np.empty(0, dtype=np.intp)
+    changed = (np.diff(samples[:, 1]) != 0) | (np.diff(samples[:, 2]) != 0)
+    return np.concatenate(([0], np.flatnonzero(changed) + 1))
+
+def _sorted_by_group(values, group_ids):
+    """Ordena por grupo e, dentro de cada grupo, por valor. Devolve (valores, grupos)."""
+    order = np.lexsort((values, group_ids))
+    return values[order], group_ids[order]
+
+def _group_bounds(group_ids, n_groups):
+    counts = np.bincount(group_ids, minlength=n_groups)
+    return np.cumsum(counts) - counts, counts
+
+def _group_median(sorted_values, starts, counts):
+    """Mediana de cada grupo (valores já ordenados dentro de cada grupo; grupos vazios dão NaN)."""
+    median = np.full(len(counts), np.nan)
+    filled = counts > 0
+    low = starts[filled] + (counts[filled] - 1) // 2
+    high = starts[filled] + counts[filled] // 2
+    median[filled] = (sorted_values[low] + sorted_values[high]) / 2
+    return median
+
+def fuse_samples(samples, method=FUSION_METHOD, trim=TRIM_FRACTION, mad_limit=OUTLIER_MAD_LIMIT):
+    """
+    Junta as amostras (N, 3) (distância, ângulo, altura) num ponto por grupo.
+    Devolve (leituras (M, 3), amostras usadas em cada leitura). Os grupos sem
+    nenhuma amostra válida não dão origem a nenhuma leitura.
+    """
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Método de fusão '{method}' desconhecido. Disponíveis: {', '.join(FUSION_METHODS)}.")
+    starts = group_starts(samples)
+    n_groups = len(starts)
+    if n_groups == 0:
+        return np.empty((0, 3)), np.empty(0, dtype=np.intp)
+
+    group_ids = np.repeat(np.arange(n_groups), np.diff(np.append(starts, len(samples))))
+    valid = samples[:, 0] > 0
+    distance, group_ids = _sorted_by_group(samples[valid, 0], group_ids[valid])
+    first, counts = _group_bounds(group_ids, n_groups)
+
+    if mad_limit is not None and len(distance):
+        median = _group_median(distance, first, counts)
+        deviation = np.abs(distance - median[group_ids])
+        sorted_deviation, _ = _sorted_by_group(deviation, group_ids)
+        sigma = np.maximum(MAD_TO_SIGMA * _group_median(sorted_deviation, first, counts), MIN_SIGMA_MM)
+        # Filtrar mantém a ordem, por isso as distâncias continuam ordenadas em cada grupo.
+        keep = deviation <= mad_limit * sigma[group_ids]
+        distance, group_ids = distance[keep], group_ids[keep]
+        first, counts = _group_bounds(group_ids, n_groups)
+
+    if method == 'mediana':
+        value = _group_median(distance, first, counts)
+    else:
+        weights = np.ones(len(distance))
+        if method == 'media_aparada':
+            cut = np.floor(trim * counts).astype(np.intp)
+            rank = np.arange(len(distance)) - first[group_ids]
+            weights[(rank < cut[group_ids]) | (rank >= (counts - cut)[group_ids])] = 0.0
+        used = np.bincount(group_ids, weights=weights, minlength=n_groups)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            value = np.bincount(group_ids, weights=distance * weights, minlength=n_groups) / used
+
+    filled = counts > 0
+    fused = samples[starts[filled]].astype(np.float64)
+    fused[:, 0] = value[filled]
+    return fused, counts[filled]
+
+
+class SampleFuser:
+    """
+    Fusão em fluxo contínuo: cada lote recebido pode terminar a meio das amostras
+    de um ângulo, por isso o último grupo fica pendente até chegar o lote seguinte
+    (ou até `flush()`, no fim do scan).
+    """
+
+    def __init__(self, method=FUSION_METHOD, trim=TRIM_FRACTION, mad_limit=OUTLIER_MAD_LIMIT):
+        self.method = method
+        self.trim = trim
+        self.mad_limit = mad_limit
+        self.pending = np.empty((0, 3))
+        self.sample_count = 0
+        self.used_count = 0
+
+    @property
+    def rejected_count(self):
+        """Amostras inválidas ou rejeitadas como outliers (já processadas)."""
+        return self.sample_count - len(self.pending) - self.used_count
+
+    def add(self, samples, end=False):
+        """Acrescenta amostras e devolve as leituras dos grupos já completos."""
+        self.sample_count += len(samples)
+        if len(self.pending):
+            samples = np.concatenate((self.pending, samples))
+        if end:
+            ready, self.pending = samples, np.empty((0, 3))
+        else:
+            starts = group_starts(samples)
+            cut = starts[-1] if len(starts) else 0
+            ready, self.pending = samples[:cut], samples[cut:]
+        fused, used = fuse_samples(ready, self.method, self.trim, self.mad_limit)
+        self.used_count += int(used.sum())
+        return fused
+
+    def flush(self):
+        return self.add(np.empty((0, 3)), end=True)
+
+    def describe(self):
+        return (f"{self.sample_count} amostras em bruto ({self.method}), "
+                f"{self.rejected_count} inválidas ou rejeitadas")
+
+
+def refuse_file(samples_path, output_path, method=FUSION_METHOD, trim=TRIM_FRACTION,
+                mad_limit=OUTLIER_MAD_LIMIT):
+    """Funde de novo as amostras gravadas num ficheiro .p3ds de pontos. Devolve (amostras, pontos)."""
+    from calibration_profiles import profile_from_header, project_records
+
+    header = point_store.read_header(samples_path)
+    samples = point_store.open_raw(samples_path)
+    if samples is None:
+        raise ValueError(f"'{samples_path}' não contém leituras em bruto.")
+    readings, _ = fuse_samples(np.asarray(samples, dtype=np.float64), method, trim, mad_limit)
+    # Usa a mesma calibração com que as amostras foram gravadas.
+    profile = profile_from_header(header)
+    # Como no recetor, as leituras rejeitadas pelo perfil também são gravadas (x, y = NaN).
+    records, valid = project_records(readings, profile)
+    with point_store.PointStoreWriter(output_path, profile.constants, profile.name, store_raw=True) as writer:
+        writer.write(records, readings)
+    return len(samples), int(np.count_nonzero(valid))
+
+def main():
+    parser = argparse.ArgumentParser(description="Funde de novo as amostras em bruto de um scan.")
+    parser.add_argument('amostras', help="Ficheiro de amostras (scans/amostras/<sessão>.p3ds).")
+    parser.add_argument('saida', help="Ficheiro de pontos a criar (.p3ds).")
+    parser.add_argument('--metodo', choices=FUSION_METHODS, default=FUSION_METHOD)
+    parser.add_argument('--aparar', type=float, default=TRIM_FRACTION,
+                        help="Fração descartada em cada ponta (media_aparada).")
+    parser.add_argument('--limite-mad', type=float, default=OUTLIER_MAD_LIMIT,
+                        help="Limite de rejeição, em desvios robustos (0 = sem rejeição).")
+    args = parser.parse_args()
+
+    n_samples, n_points = refuse_file(args.amostras, args.saida, args.metodo, args.aparar,
+                                      args.limite_mad or None)
+    print(f"{n_samples} amostras fundidas em {n_points} pontos ({args.metodo}) -> '{args.saida}'.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
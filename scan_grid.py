@@ -0,0 +1,264 @@
+# --- START OF FILE scan_grid.py ---
+"""
+Grelha camada x ângulo: a representação em memória de um scan do prato rotativo.
+
+O firmware mede sempre nos mesmos ângulos (0..359, de PASSO_ANGULAR_GRAUS em
+PASSO_ANGULAR_GRAUS) em cada camada. Em vez de uma lista de pontos XYZ, o
+`ScanGrid` guarda:
+
+    radius   (camadas, ângulos) float32   raio (SENSOR_OFFSET_MM - distância), em mm
+    valid    (camadas, ângulos) bool      células com uma leitura dentro do alcance
+    z        (camadas,)         float64   altura de cada camada, em mm
+
+mais o perfil de calibração com que o raio é convertido em XYZ. São 5 bytes
+por ponto, contra 12 (XYZ float32) ou 24 (XYZ float64, ou o registo .p3ds com
+as leituras em bruto).
+
+Cada leitura vai diretamente para a sua célula: a camada é a de altura igual
+(dentro de LAYER_TOLERANCE_MM), ou uma nova; o ângulo é o índice na grelha.
+Não há separação de camadas por saltos de Z. Uma leitura fora do alcance, ou
+um ângulo que nunca chegou, fica como um buraco explícito (`valid` a False) na
+camada certa, em vez de encurtar a camada ou de a fazer desaparecer. As camadas
+ficam pela ordem em que começaram, como no ficheiro. Uma segunda leitura da
+mesma célula substitui a primeira.
+
+No fim de cada sessão, o recetor constrói a grelha a partir das leituras em
+bruto do .p3ds (fora do loop de receção, com o passo GRID_ANGLE_STEP_DEG) e
+grava-a em <sessão>.grid.npz; o generate_stl.py e o `point_store.load_points`
+aceitam estes ficheiros. Para converter um scan já gravado (precisa das
+leituras em bruto):
+
+    python scan_grid.py scans/peca.p3ds
+    python scan_grid.py scans/peca.p3ds peca.grid.npz
+"""
+
+import argparse
+import json
+import os
+import sys
+from dataclasses import asdict
+import numpy as np
+
+import point_store
+from calibration_profiles import CalibrationProfile, profile_from_header
+from point_store import LAYER_TOLERANCE_MM
+
+ANGLE_STEP_DEG = 1.0           # PASSO_ANGULAR_GRAUS do firmware
+ANGLE_TOLERANCE_DEG = 0.25     # Leituras mais longe do que isto de um ângulo da grelha são descartadas
+INITIAL_LAYER_CAPACITY = 64    # Camadas reservadas ao início; a capacidade duplica quando enche
+GRID_EXTENSION = ".grid.npz"
+
+
+def is_scan_grid(filepath):
+    """Indica se o ficheiro é uma grelha gravada por `ScanGrid.save` (pela extensão)."""
+    return filepath.endswith(GRID_EXTENSION)
+
+def grid_path(data_path):
+    """Caminho da grelha gravada ao lado de um ficheiro de pontos (<base>.grid.npz)."""
+    return os.path.splitext(data_path)[0] + GRID_EXTENSION
+
+
+class ScanGrid:
+    """
+    Grelha (camadas, ângulos) de um scan. `add()` aceita lotes de leituras
+    (distância, ângulo, altura) de qualquer tamanho, pela ordem em que chegam.
+    `radius`, `valid` e `z` são vistas das camadas já preenchidas.
+    """
+
+    def __init__(self, profile, angle_step_deg=ANGLE_STEP_DEG, tolerance=LAYER_TOLERANCE_MM,
+                 capacity=INITIAL_LAYER_CAPACITY):
+        self.profile = profile
+        self.angle_step_deg = angle_step_deg
+        self.angle_count = int(round(360.0 / angle_step_deg))
+        self.tolerance = tolerance
+        self.layer_count = 0
+        self._radius = np.zeros((capacity, self.angle_count), dtype=np.float32)
+        self._valid = np.zeros((capacity, self.angle_count), dtype=bool)
+        self._z = np.zeros(capacity)
+        angles_rad = np.deg2rad(self.angles_deg)
+        self._cos, self._sin = np.cos(angles_rad), np.sin(angles_rad)
+        self.reading_count = 0
+        self.out_of_range_count = 0   # Leituras fora de 0 < d < SENSOR_OFFSET_MM (ficam como buracos)
+        self.off_grid_count = 0       # Leituras com um ângulo fora da grelha (descartadas)
+
+    # --- Vistas ---
+
+    @property
+    def radius(self):
+        return self._radius[:self.layer_count]
+
+    @property
+    def valid(self):
+        return self._valid[:self.layer_count]
+
+    @property
+    def z(self):
+        return self._z[:self.layer_count]
+
+    @property
+    def angles_deg(self):
+        return np.arange(self.angle_count) * self.angle_step_deg
+
+    @property
+    def point_count(self):
+        return int(np.count_nonzero(self.valid))
+
+    @property
+    def hole_count(self):
+        return self.layer_count * self.angle_count - self.point_count
+
+    @property
+    def nbytes(self):
+        return self.radius.nbytes + self.valid.nbytes + self.z.nbytes
+
+    def __len__(self):
+        return self.layer_count
+
+    # --- Preenchimento ---
+
+    def _grow(self, layer_count):
+        capacity = len(self._z)
+        if layer_count <= capacity:
+            return
+        while capacity < layer_count:
+            capacity *= 2
+        for name in ('_radius', '_valid', '_z'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.layer_count] = old[:self.layer_count]
+            setattr(self, name, new)
+
+    def _layer_indices(self, heights):
+        """Camada de cada altura: a já existente dentro da tolerância, ou uma nova (pela ordem de chegada)."""
+        values, first, inverse = np.unique(heights, return_index=True, return_inverse=True)
+        indices = np.empty(len(values), dtype=np.intp)
+        for k in np.argsort(first):
+            z = self.z
+            nearest = int(np.abs(z - values[k]).argmin()) if len(z) else -1
+            if nearest >= 0 and abs(z[nearest] - values[k]) <= self.tolerance:
+                indices[k] = nearest
+            else:
+                self._grow(self.layer_count + 1)
+                self._z[self.layer_count] = values[k]
+                indices[k] = self.layer_count
+                self.layer_count += 1
+        return indices[inverse.ravel()]
+
+    def add(self, readings):
+        """Acrescenta leituras (N, 3): distância (mm), ângulo (graus), altura (mm)."""
+        readings = np.asarray(readings, dtype=np.float64)
+        self.reading_count += len(readings)
+        if len(readings) == 0:
+            return
+        steps = readings[:, 1] / self.angle_step_deg
+        columns = np.rint(steps)
+        on_grid = np.abs(steps - columns) * self.angle_step_deg <= ANGLE_TOLERANCE_DEG
+        self.off_grid_count += len(readings) - int(np.count_nonzero(on_grid))
+        readings, columns = readings[on_grid], columns[on_grid].astype(np.intp) % self.angle_count
+
+        # Todas as alturas criam a sua camada, mesmo que nenhuma leitura dela seja válida.
+        layers = self._layer_indices(readings[:, 2])
+        distance = readings[:, 0]
+        in_range = (distance > 0) & (distance < self.profile.sensor_offset_mm)
+        self.out_of_range_count += len(readings) - int(np.count_nonzero(in_range))
+        layers, columns = layers[in_range], columns[in_range]
+        self._radius[layers, columns] = self.profile.sensor_offset_mm - distance[in_range]
+        self._valid[layers, columns] = True
+
+    @classmethod
+    def from_readings(cls, readings, profile, angle_step_deg=ANGLE_STEP_DEG, tolerance=LAYER_TOLERANCE_MM):
+        grid = cls(profile, angle_step_deg, tolerance)
+        grid.add(readings)
+        return grid
+
+    @classmethod
+    def from_store(cls, filepath, angle_step_deg=ANGLE_STEP_DEG):
+        """Grelha de um scan .p3ds gravado com as leituras em bruto, com o perfil do cabeçalho."""
+        raw = point_store.open_raw(filepath)
+        if raw is None:
+            raise ValueError(f"'{filepath}' não tem leituras em bruto (foi gravado sem elas).")
+        profile = profile_from_header(point_store.read_header(filepath))
+        return cls.from_readings(raw, profile, angle_step_deg)
+
+    # --- Conversão para XYZ ---
+
+    def _project(self, radius, z, cos, sin):
+        profile = self.profile
+        points = np.empty((len(radius), 3))
+        points[:, 0] = profile.offset_x + radius * cos + profile.tilt_x * z
+        points[:, 1] = profile.offset_y + radius * sin + profile.tilt_y * z
+        points[:, 2] = z
+        return points
+
+    def to_xyz(self):
+        """Pontos (N, 3) float64 em mm das células válidas, por camada e, em cada camada, por ângulo."""
+        layers, columns = np.nonzero(self.valid)
+        return self._project(self.radius[layers, columns], self.z[layers], self._cos[columns], self._sin[columns])
+
+    def layer_points(self, layer):
+        """Pontos (n, 3) em mm de uma camada (só as células válidas)."""
+        columns = np.flatnonzero(self.valid[layer])
+        return self._project(self.radius[layer, columns], np.full(len(columns), self.z[layer]),
+                             self._cos[columns], self._sin[columns])
+
+    def angle_points(self, column):
+        """Pontos (n, 3) em mm de um ângulo ao longo de todas as camadas (só as células válidas)."""
+        layers = np.flatnonzero(self.valid[:, column])
+        return self._project(self.radius[layers, column], self.z[layers],
+                             np.full(len(layers), self._cos[column]), np.full(len(layers), self._sin[column]))
+
+    def layers(self, min_points=0):
+        """
+        Pontos de cada camada com mais de `min_points` pontos válidos (o que o
+        `generate_stl.split_layers` devolveria, sem separação por Z): lista de
+        vistas de um único array.
+        """
+        counts = np.count_nonzero(self.valid, axis=1)
+        layers = np.split(self.to_xyz(), np.cumsum(counts)[:-1])
+        return [layer for layer, count in zip(layers, counts) if count > min_points]
+
+    # --- Ficheiro ---
+
+    def save(self, filepath):
+        np.savez(filepath, radius=self.radius, valid=self.valid, z=self.z,
+                 angle_step_deg=self.angle_step_deg, tolerance=self.tolerance,
+                 profile=json.dumps(asdict(self.profile), ensure_ascii=False))
+
+    @classmethod
+    def load(cls, filepath):
+        with np.load(filepath, allow_pickle=False) as data:
+            grid = cls(CalibrationProfile(**json.loads(str(data['profile']))), float(data['angle_step_deg']),
+                       float(data['tolerance']), capacity=max(1, len(data['z'])))
+            grid.layer_count = len(data['z'])
+            grid._radius[:grid.layer_count] = data['radius']
+            grid._valid[:grid.layer_count] = data['valid']
+            grid._z[:grid.layer_count] = data['z']
+        return grid
+
+    def describe(self):
+        text = (f"{self.layer_count} camadas x {self.angle_count} ângulos, {self.point_count} pontos, "
+                f"{self.hole_count} buracos ({self.out_of_range_count} leituras fora do alcance")
+        if self.off_grid_count:
+            text += f", {self.off_grid_count} fora da grelha de ângulos"
+        return text + f"), {self.nbytes / max(1, self.point_count):.1f} bytes/ponto"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converte um scan .p3ds na grelha camada x ângulo.")
+    parser.add_argument('entrada', help="Ficheiro de pontos .p3ds (com as leituras em bruto).")
+    parser.add_argument('saida', nargs='?', help=f"Grelha a criar (por omissão, <entrada>{GRID_EXTENSION}).")
+    parser.add_argument('--passo', type=float, default=ANGLE_STEP_DEG, help="Passo angular do scan (graus).")
+    args = parser.parse_args()
+
+    try:
+        grid = ScanGrid.from_store(args.entrada, args.passo)
+    except (OSError, ValueError) as e:
+        print(f"[ERRO] {e}")
+        return 1
+    output = args.saida or grid_path(args.entrada)
+    grid.save(output)
+    print(f"{grid.describe()} -> '{output}'.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
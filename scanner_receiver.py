@@ -1,44 +1,61 @@
 # --- START OF FILE scanner_receiver.py (COM PERFIS DE CALIBRAÇÃO REFINADOS) ---
 
+import asyncio
 import socket
 import numpy as np
 import os
-import sys
+import time
 
-try:
-    from generate_stl import build_universal_solid 
-    GENERATE_STL_AVAILABLE = True
-except ImportError:
-    print("[Aviso] Ficheiro 'generate_stl.py' não encontrado.")
-    GENERATE_STL_AVAILABLE = False
+from point_store import PointStoreWriter, count_layers
+from calibration_profiles import DEFAULT_PROFILE, load_profiles, project_records
+from wire_protocol import negotiate, TextDecoder
+from meshing_pool import MeshingPool, MESHING_WORKERS, STATUS_QUEUED, STATUS_RUNNING
+from sample_fusion import SampleFuser
+from point_feed import PointFeed, FEED_PORT
+from scan_grid import ANGLE_STEP_DEG, ScanGrid, grid_path
+from metrics import configure as configure_metrics, get_metrics, serve_prometheus
+
+# As malhas são gravadas pelos processos do MeshingPool no modo headless, por isso
+# o open3d nunca é carregado pelo servidor. A malha em direto (incremental_mesher.py,
+# que importa o generate_stl e o scipy) só é importada, fora do loop asyncio, quando
+# chega o primeiro lote de pontos.
 
 HOST = '0.0.0.0'
 PORT = 5000
-DATA_FILENAME = "3dScanner_Data.txt"
-OUTPUT_STL_FILENAME = "output_universal_solid.stl"
+SCANS_DIR = "scans"  # Cada sessão grava <id>.p3ds, <id>.grid.npz e <id>.stl nesta pasta
+
+# --- CONFIGURAÇÃO DA RECEÇÃO ---
+RECV_BUFFER_SIZE = 65536        # Bytes lidos do socket de cada vez
+FLUSH_INTERVAL_SECONDS = 0.25   # Tempo máximo que um ponto fica em memória antes de ir para disco
+FLUSH_INTERVAL_POINTS = 4096    # Número de pontos pendentes que força uma escrita imediata
+IDLE_TIMEOUT_SECONDS = 120.0    # Um scanner sem enviar dados durante este tempo é desligado
+MIN_POINTS_FOR_STL = 50         # Scans com menos pontos não são enviados para geração de malha
+LIVE_MESHING = True             # Constrói a malha camada a camada durante o scan (ver incremental_mesher.py)
+ACCEPT_RAW_SAMPLES = True       # Aceita que o firmware envie todas as amostras, fundidas aqui (ver sample_fusion.py)
+RAW_SAMPLES_DIR = "amostras"    # Subpasta de SCANS_DIR com as amostras em bruto de cada sessão
+GRID_ANGLE_STEP_DEG = ANGLE_STEP_DEG  # PASSO_ANGULAR_GRAUS do firmware, para a grelha de cada sessão (scan_grid.py)
 
 # =======================================================================
 # ===               CONFIGURAÇÃO DE CALIBRAÇÃO COM PERFIS             ===
 # =======================================================================
-# Descomente o perfil que pretende usar antes de executar o script.
-
-# --- PERFIL 1: Para objetos CURVOS/ORGÂNICOS (Cilindros, estátuas, etc.) ---
-# Descrição: Alta precisão para superfícies suaves.
-# SENSOR_OFFSET_MM = 107.35 
-# OFFSET_X = -24.0
-# OFFSET_Y = -4.0
-
-# --- PERFIL 2: Para objetos QUADRADOS/CANTOS VIVOS (Caixas, peças) ---
-# Descrição: Compensa o efeito do "cone de luz" em cantos vivos.
-# VALOR REFINADO APÓS O SEGUNDO TESTE
-# --- PERFIL 2: Para objetos QUADRADOS/CANTOS VIVOS (Caixas, peças) ---
-# VOLTANDO AO VALOR ANTERIOR PARA VERIFICAR A CONSISTÊNCIA
-SENSOR_OFFSET_MM = 105.10 
-OFFSET_X = -24.0
-OFFSET_Y = -4.0
+# Os perfis ('curvo', 'quadrado', ou outros acrescentados em
+# calibration_profiles.json) estão definidos em calibration_profiles.py.
+CALIBRATION_PROFILE = DEFAULT_PROFILE
+
+# Perfil próprio de cada prato, indexado pelo IP do scanner:
+#   "192.168.20.80": "curvo"
+# Os scanners que não estão aqui usam CALIBRATION_PROFILE. Os perfis são lidos
+# (e os nomes validados) uma vez, ao arrancar o servidor.
+SCANNER_PROFILES = {}
 
 # =======================================================================
 
+# --- MÉTRICAS (ver metrics.py) ---
+METRICS_ENABLED = False          # Desligadas, a instrumentação não custa praticamente nada
+METRICS_LOG_PATH = "metrics.jsonl"   # Eventos e instantâneos em JSON-lines (None = sem ficheiro)
+METRICS_HTTP_PORT = 9108         # Texto Prometheus em http://127.0.0.1:9108/metrics (None = desligado)
+METRICS_SNAPSHOT_SECONDS = 10.0  # Intervalo entre instantâneos no ficheiro JSON-lines
+
 
 def get_local_ip():
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -47,78 +64,440 @@ def get_local_ip():
     finally: s.close()
     return IP
 
-def process_data(data_line: str):
-    try:
-        parts = data_line.strip().split(',')
-        distance = int(parts[0].split(':')[1])
-        theta_deg = int(parts[1].split(':')[1])
-        height = float(parts[2].split(':')[1])
-        return distance, theta_deg, height
-    except (ValueError, IndexError, TypeError) as e:
-        print(f"\n[Erro] Formato de dados inválido: '{data_line}'. Erro: {e}"); return None
+class ScanSession:
+    """
+    Estado de um scan em curso: buffer de receção, ficheiro de saída e
+    perfil de calibração. Cada ligação ao servidor tem a sua própria sessão.
+    As leituras em bruto são gravadas junto dos pontos, para permitir re-projetar
+    o scan mais tarde com outro perfil. No fim, a grelha camada x ângulo da
+    sessão (scan_grid.py) é construída a partir do .p3ds e gravada em
+    <id>.grid.npz. Com `live_meshing`, a malha vai sendo
+    construída à medida que cada camada termina. Com um `feed` (point_feed.py),
+    cada lote de pontos é também publicado aos subscritores locais. No modo de amostras em bruto
+    (`enable_sample_fusion`), as amostras são gravadas à parte e fundidas num
+    ponto por ângulo antes de seguirem o caminho normal.
+    """
+
+    def __init__(self, session_id, peer, profile, output_dir=SCANS_DIR, live_meshing=False, metrics=None,
+                 feed=None, angle_step_deg=GRID_ANGLE_STEP_DEG):
+        self.session_id = session_id
+        self.peer = peer
+        self.profile = profile
+        self.metrics = metrics or get_metrics()
+        self.data_path = os.path.join(output_dir, f"{session_id}.p3ds")
+        self.stl_path = os.path.join(output_dir, f"{session_id}.stl")
+        self.grid_path = grid_path(self.data_path)
+        self.angle_step_deg = angle_step_deg
+        self.grid = None             # Construída no fim da sessão (`build_grid`)
+        self.writer = PointStoreWriter(self.data_path, profile.constants, profile.name,
+                                       flush_interval_s=FLUSH_INTERVAL_SECONDS,
+                                       flush_interval_points=FLUSH_INTERVAL_POINTS,
+                                       store_raw=True,
+                                       on_flush=self.record_flush if self.metrics.enabled else None)
+        self.decoder = TextDecoder()
+        self.live_meshing = live_meshing
+        self.mesher = None           # Criado na primeira chamada a `update_mesher`
+        self.mesher_pending = []     # Pontos (float32) ainda não entregues à malha em direto
+        self.point_feed = feed
+        self.fuser = None
+        self.samples_writer = None
+        self.point_count = 0
+        self.rejected_count = 0
+        self.layer_z = None
+        self.layer_started_at = None
+        self.bytes_received = 0
+        self.started_at = time.monotonic()
+        self.complete = False
+
+    def log(self, message):
+        print(f"[{self.session_id}] {message}")
+
+    def feed(self, data_bytes):
+        """Processa os bytes recebidos. Devolve True quando chega o sinal 'END'."""
+        self.bytes_received += len(data_bytes)
+
+        # Descodifica de uma vez todas as leituras completas recebidas até agora.
+        readings, scan_complete, n_invalid = self.decoder.feed(data_bytes)
+        if n_invalid:
+            unit = "linha(s)" if self.decoder.protocol == "texto" else "byte(s)"
+            self.log(f"[Erro] {n_invalid} {unit} com formato de dados inválido ignorado(s).")
+
+        if self.fuser is not None:
+            self.store_samples(readings)
+            readings = self.fuser.add(readings, end=scan_complete)
+
+        n_points = self.store_readings(readings)
+        if self.metrics.enabled:
+            self.record_batch(len(data_bytes), readings, n_points, n_invalid)
+
+        if scan_complete:
+            self.complete = True
+        return scan_complete
+
+    def store_readings(self, readings):
+        """Projeta as leituras, grava os pontos e passa-os à malha em direto. Devolve o nº de pontos."""
+        # Todas as leituras vão para o ficheiro (as rejeitadas com x, y = NaN), para
+        # que um perfil com outro alcance as possa aproveitar ao re-projetar.
+        records, valid = project_records(readings, self.profile)
+        self.writer.write(records, readings)
+        points = records[valid]
+        if self.point_feed is not None:
+            self.point_feed.publish_points(self.session_id, points)
+        self.point_count += len(points)
+        self.rejected_count += len(readings) - len(points)
+        if self.live_meshing and len(points):
+            # Em float32, tal como ficam no ficheiro: a malha é a mesma que se
+            # obteria a partir do .p3ds.
+            self.mesher_pending.append(points.astype(np.float32))
+        return len(points)
+
+    def take_mesher_points(self):
+        pending, self.mesher_pending = self.mesher_pending, []
+        return pending
+
+    def update_mesher(self, batches):
+        """
+        Entrega lotes de pontos à malha em direto, que reconstrói as camadas que
+        terminarem. Corre numa thread (`run_in_executor`), nunca no loop asyncio.
+        """
+        if self.mesher is None:
+            from incremental_mesher import IncrementalMesher
+            self.mesher = IncrementalMesher()
+        for points in batches:
+            self.mesher.add_points(points)
+
+    def finish_mesher(self, batches):
+        """Entrega os últimos pontos e fecha a malha em direto (também numa thread)."""
+        self.update_mesher(batches)
+        return self.mesher.finish()
+
+    def enable_sample_fusion(self, output_dir=SCANS_DIR):
+        """Passa ao modo de amostras em bruto: grava-as em <output_dir>/amostras/ e funde-as."""
+        samples_dir = os.path.join(output_dir, RAW_SAMPLES_DIR)
+        os.makedirs(samples_dir, exist_ok=True)
+        self.samples_path = os.path.join(samples_dir, f"{self.session_id}.p3ds")
+        self.samples_writer = PointStoreWriter(self.samples_path, self.profile.constants, self.profile.name,
+                                               flush_interval_s=FLUSH_INTERVAL_SECONDS,
+                                               flush_interval_points=FLUSH_INTERVAL_POINTS,
+                                               store_raw=True)
+        self.fuser = SampleFuser()
+
+    def store_samples(self, samples):
+        # Todas as amostras, como em `store_readings` (as rejeitadas com x, y = NaN):
+        # o fusor recebe-as todas, por isso fundi-las de novo a partir do ficheiro
+        # (sample_fusion.refuse_file) dá as mesmas leituras que em direto.
+        records, _ = project_records(samples, self.profile)
+        self.samples_writer.write(records, samples)
+        self.metrics.inc('raw_samples_total', len(samples))
+
+    def record_batch(self, n_bytes, readings, n_points, n_invalid):
+        """Atualiza as métricas de um lote recebido (só é chamado com as métricas ativas)."""
+        protocol = self.decoder.protocol
+        self.metrics.inc('bytes_received_total', n_bytes, protocol=protocol)
+        self.metrics.inc('readings_received_total', len(readings), protocol=protocol)
+        self.metrics.inc('points_stored_total', n_points)
+        # Leituras fora de 0 < d < SENSOR_OFFSET_MM do perfil.
+        self.metrics.inc('readings_rejected_total', len(readings) - n_points)
+        if n_invalid:
+            self.metrics.inc('parse_failures_total', n_invalid, protocol=protocol)
+        if len(readings) == 0:
+            return
+
+        # Duração de cada camada: do primeiro lote com uma nova altura até ao seguinte.
+        now = time.monotonic()
+        z = readings[:, 2]
+        if self.layer_z is None:
+            self.layer_z, self.layer_started_at = z[0], now
+        if count_layers(z, self.layer_z):
+            duration = now - self.layer_started_at
+            self.metrics.observe('layer_duration_seconds', duration)
+            self.metrics.event('camada', sessao=self.session_id, altura_mm=float(self.layer_z), duracao_s=duration)
+            self.layer_started_at = now
+        self.layer_z = z[-1]
+
+    def record_flush(self, ages):
+        """Tempo entre a receção de cada lote e a sua escrita no ficheiro."""
+        for age_s, _ in ages:
+            self.metrics.observe('recv_to_disk_seconds', age_s)
+
+    def close(self):
+        if self.fuser is not None:
+            # Scan interrompido: o último ângulo ainda estava à espera de mais amostras.
+            remaining = self.fuser.flush()
+            if len(remaining):
+                self.store_readings(remaining)
+            self.samples_writer.close()
+            self.metrics.inc('raw_samples_rejected_total', self.fuser.rejected_count)
+        self.writer.close()
+
+    def build_grid(self):
+        """
+        Constrói a grelha a partir das leituras em bruto do .p3ds já fechado e
+        grava-a. Corre numa thread, depois da receção: durante o scan não há
+        trabalho extra por lote nem uma segunda cópia da sessão em memória.
+        """
+        self.grid = ScanGrid.from_store(self.data_path, self.angle_step_deg)
+        self.grid.save(self.grid_path)
+        return self.grid
+
+
+class ScannerServer:
+    """
+    Servidor asyncio que aceita qualquer número de scanners em simultâneo.
+    Uma ligação lenta ou parada nunca bloqueia as restantes: cada uma corre na
+    sua própria corrotina e é desligada ao fim de IDLE_TIMEOUT_SECONDS sem dados.
+    """
+
+    def __init__(self, host=HOST, port=PORT, output_dir=SCANS_DIR, idle_timeout_s=IDLE_TIMEOUT_SECONDS,
+                 meshing_workers=MESHING_WORKERS, live_meshing=LIVE_MESHING, metrics=None,
+                 metrics_port=METRICS_HTTP_PORT, feed_port=None, angle_step_deg=GRID_ANGLE_STEP_DEG):
+        self.host = host
+        self.port = port
+        self.output_dir = output_dir
+        self.idle_timeout_s = idle_timeout_s
+        self.angle_step_deg = angle_step_deg
+        self.sessions = {}
+        self.session_counter = 0
+        self.default_profile = None
+        self.scanner_profiles = {}   # IP -> CalibrationProfile, resolvidos em `start()`
+        self.server = None
+        self.metrics = metrics or get_metrics()
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        self.snapshot_task = None
+        # Canal local onde os pontos são publicados (None = desligado). Só o
+        # `run_server` o liga por omissão (FEED_PORT); benchmarks e outros
+        # servidores no mesmo PC não disputam a porta (0 = uma porta livre).
+        self.feed_port = feed_port
+        self.feed = None
+        # Com meshing_workers=0 os scans são apenas gravados (útil em testes e benchmarks).
+        self.meshing_pool = MeshingPool(meshing_workers, on_job_done=self.on_meshing_done,
+                                        metrics=self.metrics) if meshing_workers else None
+        self.live_meshing = live_meshing and self.meshing_pool is not None
+
+    def resolve_profiles(self):
+        """
+        Lê os perfis de calibração uma única vez e resolve CALIBRATION_PROFILE e
+        SCANNER_PROFILES. Um nome desconhecido ou um calibration_profiles.json
+        inválido impedem o arranque, em vez de falharem a cada ligação.
+        """
+        profiles = load_profiles()
+        unknown = sorted({CALIBRATION_PROFILE, *SCANNER_PROFILES.values()} - set(profiles))
+        if unknown:
+            raise ValueError(f"Perfil(is) de calibração desconhecido(s): {', '.join(unknown)}. "
+                             f"Disponíveis: {', '.join(sorted(profiles))}.")
+        self.default_profile = profiles[CALIBRATION_PROFILE]
+        self.scanner_profiles = {ip: profiles[name] for ip, name in SCANNER_PROFILES.items()}
+
+    async def start(self):
+        self.resolve_profiles()
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        # Com port=0 o sistema escolhe uma porta livre.
+        self.port = self.server.sockets[0].getsockname()[1]
+        if self.feed_port is not None:
+            try:
+                self.feed = await PointFeed(port=self.feed_port, metrics=self.metrics).start()
+            except OSError as e:
+                print(f"[Aviso] Canal de pontos indisponível na porta {self.feed_port} ({e}).")
+        if self.metrics.enabled:
+            if self.metrics_port is not None:
+                self.metrics_server = await serve_prometheus(self.metrics, port=self.metrics_port)
+                self.metrics_port = self.metrics_server.sockets[0].getsockname()[1]
+            self.snapshot_task = asyncio.create_task(self.log_snapshots())
+        return self
+
+    async def log_snapshots(self):
+        while True:
+            await asyncio.sleep(METRICS_SNAPSHOT_SECONDS)
+            self.metrics.log_snapshot()
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self, wait_for_meshing=True):
+        self.server.close()
+        await self.server.wait_closed()
+        if self.meshing_pool is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.meshing_pool.shutdown, wait_for_meshing)
+        if self.feed is not None:
+            await self.feed.close()
+        if self.snapshot_task is not None:
+            self.snapshot_task.cancel()
+            self.metrics.log_snapshot()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            await self.metrics_server.wait_closed()
+
+    def new_session_id(self):
+        self.session_counter += 1
+        return f"{time.strftime('%Y%m%d-%H%M%S')}-{self.session_counter:03d}"
+
+    async def handle_connection(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        peer_ip = peer[0] if peer else ''
+        profile = self.scanner_profiles.get(peer_ip, self.default_profile)
+        session = None
+        try:
+            session = ScanSession(self.new_session_id(), peer, profile, self.output_dir, self.live_meshing,
+                                  self.metrics, self.feed, self.angle_step_deg)
+            self.sessions[session.session_id] = session
+            self.metrics.inc('sessions_total')
+            self.metrics.set('sessions_active', len(self.sessions))
+            session.log(f"[+] Scanner conectado de {peer} (perfil '{profile.name}') -> '{session.data_path}'")
+            if self.feed is not None:
+                self.feed.publish_session_start(session.session_id, session.data_path, profile.name)
+
+            # A primeira linha decide o protocolo: "HELLO P3DB/1" pede o binário;
+            # qualquer outra coisa é já uma leitura do protocolo de texto.
+            first_line = await asyncio.wait_for(reader.readline(), self.idle_timeout_s)
+            session.decoder, reply = negotiate(first_line, ACCEPT_RAW_SAMPLES)
+            if reply is not None:
+                writer.write(reply)
+                await writer.drain()
+                first_line = b''
+            if session.decoder.raw_samples:
+                session.enable_sample_fusion(self.output_dir)
+                session.log(f"Protocolo: {session.decoder.protocol}, amostras em bruto "
+                            f"(fusão por {session.fuser.method}) -> '{session.samples_path}'.")
+            else:
+                session.log(f"Protocolo: {session.decoder.protocol}.")
+            if first_line and session.feed(first_line):
+                session.log("[+] Sinal de 'END' recebido.")
+                return
+            await self.update_live_mesh(session)
 
-def main():
-    if os.path.exists(DATA_FILENAME):
-        print(f"A limpar ficheiro de dados anterior: {DATA_FILENAME}")
-        os.remove(DATA_FILENAME)
-
-    local_ip = get_local_ip()
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind((HOST, PORT))
-        s.listen()
-        print("\n--- Servidor de Scanner 3D Iniciado ---")
-        print(f"-> IP do servidor: {local_ip}")
-        print(f"-> A aguardar conexão do scanner na porta {PORT}...")
-        conn, addr = s.accept()
-        with conn, open(DATA_FILENAME, "a") as f_points:
-            print(f"\n[+] Scanner conectado de {addr}")
-            point_count = 0
-            buffer = ""
-            scan_complete = False
-            
             while True:
+                data_bytes = await asyncio.wait_for(reader.read(RECV_BUFFER_SIZE), self.idle_timeout_s)
+                if not data_bytes:
+                    session.log("[!] Conexão fechada pelo scanner.")
+                    break
+                if session.feed(data_bytes):
+                    session.log("[+] Sinal de 'END' recebido.")
+                    break
+                await self.update_live_mesh(session)
+        except asyncio.TimeoutError:
+            session.log(f"[!] Sem dados há {self.idle_timeout_s:.0f} s. A desligar o scanner.")
+        except (ConnectionResetError, BrokenPipeError):
+            session.log("[!] A conexão foi perdida.")
+        except OSError as e:
+            # Por exemplo, não foi possível criar ou escrever o ficheiro do scan.
+            if session is None:
+                print(f"[Erro] Não foi possível abrir uma sessão para {peer}: {e}")
+            else:
+                session.log(f"[Erro] {e}")
+        finally:
+            writer.close()
+            if session is not None:
+                session.close()
                 try:
-                    data_bytes = conn.recv(1024)
-                    if not data_bytes: print("\n[!] Conexão fechada pelo scanner."); break
-                    buffer += data_bytes.decode('utf-8')
-                    
-                    while '\n' in buffer:
-                        line, buffer = buffer.split('\n', 1)
-                        line = line.strip()
-                        if not line: continue
-                        
-                        if line.upper() == "END":
-                            print("\n[+] Sinal de 'END' recebido.")
-                            scan_complete = True
-                            break
-                        
-                        result = process_data(line)
-                        if result:
-                            distance_d, theta_deg, height = result
-                            if 0 < distance_d < SENSOR_OFFSET_MM:
-                                radius = SENSOR_OFFSET_MM - float(distance_d)
-                                theta_rad = np.deg2rad(theta_deg)
-                                x = OFFSET_X + radius * np.cos(theta_rad)
-                                y = OFFSET_Y + radius * np.sin(theta_rad)
-                                z = height
-                                point_count += 1
-                                f_points.write(f"{x:.6f},{y:.6f},{z:.6f}\n")
-                                f_points.flush()
-                    
-                    if scan_complete:
-                        break
-                                
-                except (ConnectionResetError, BrokenPipeError): print("\n[!] A conexão foi perdida."); break
-                except KeyboardInterrupt: print("\n[!] Interrupção manual."); break
-
-    print(f"\n\nRecolha de dados concluída. {point_count} pontos guardados.")
-    if GENERATE_STL_AVAILABLE and point_count > 50:
-        print(f"\nA iniciar a geração do STL...")
+                    # A sessão continua registada até o scan ser entregue (a malha em
+                    # direto e a grelha são fechadas numa thread).
+                    await self.on_session_closed(session)
+                finally:
+                    del self.sessions[session.session_id]
+                    self.metrics.set('sessions_active', len(self.sessions))
+
+    async def update_live_mesh(self, session):
+        """
+        Reconstrói as camadas já terminadas numa thread: o ajuste das splines de
+        um scanner não atrasa a receção dos outros. Enquanto isso, só a leitura
+        desta ligação fica à espera.
+        """
+        if session.live_meshing and session.mesher_pending:
+            await asyncio.get_running_loop().run_in_executor(None, session.update_mesher,
+                                                             session.take_mesher_points())
+
+    async def on_session_closed(self, session):
+        elapsed = time.monotonic() - session.started_at
+        session.log(f"Recolha de dados concluída. {session.point_count} pontos guardados em {elapsed:.1f} s.")
+        if self.feed is not None:
+            self.feed.publish_session_end(session.session_id, session.point_count, session.complete)
         try:
-            build_universal_solid(DATA_FILENAME, OUTPUT_STL_FILENAME)
-        except Exception as e:
-            print(f"[Erro] Falha na geração do STL: {e}")
+            grid = await asyncio.get_running_loop().run_in_executor(None, session.build_grid)
+            session.log(f"Grelha: {grid.describe()}.")
+        except (OSError, ValueError) as e:
+            session.log(f"[Aviso] Não foi possível gravar a grelha ({e}).")
+        if session.fuser is not None:
+            session.log(f"{session.fuser.describe()}.")
+        if session.decoder.lost:
+            session.log(f"[Aviso] {session.decoder.lost} leitura(s) perdida(s) (falhas na sequência).")
+            self.metrics.inc('readings_lost_total', session.decoder.lost)
+        self.metrics.event('sessao', sessao=session.session_id, protocolo=session.decoder.protocol,
+                           bytes=session.bytes_received, pontos=session.point_count,
+                           rejeitadas=session.rejected_count, perdidas=session.decoder.lost,
+                           duracao_s=elapsed, completa=session.complete)
+        if session.complete:
+            await self.on_scan_complete(session)
+
+    async def on_scan_complete(self, session):
+        if self.meshing_pool is None or session.point_count <= MIN_POINTS_FOR_STL:
+            return
+        mesh = None
+        if session.live_meshing:
+            mesh = await asyncio.get_running_loop().run_in_executor(None, session.finish_mesher,
+                                                                    session.take_mesher_points())
+        if mesh is not None:
+            # As paredes já foram construídas durante o scan: só falta finalizar e gravar.
+            job = self.meshing_pool.submit_mesh(session.session_id, session.data_path, session.stl_path, *mesh)
+            session.log(f"Malha em direto: {session.mesher.ring_count} camadas.")
+        else:
+            if session.mesher is not None and session.mesher.error:
+                session.log(f"[Aviso] Malha em direto indisponível ({session.mesher.error}); "
+                            "a gerar a partir do ficheiro.")
+            # A partir da grelha, onde as camadas já estão separadas, se todas as
+            # leituras couberam nela; senão (passo angular diferente), do .p3ds.
+            source_path = session.data_path
+            if session.grid is not None and session.grid.off_grid_count == 0:
+                source_path = session.grid_path
+            elif session.grid is not None:
+                session.log(f"[Aviso] {session.grid.off_grid_count} leitura(s) fora da grelha de "
+                            f"{session.angle_step_deg:g}° (GRID_ANGLE_STEP_DEG); a malha é gerada a partir do .p3ds.")
+            job = self.meshing_pool.submit(session.session_id, source_path, session.stl_path)
+        counts = self.meshing_pool.counts()
+        session.log(f"Scan enviado para geração do STL ({job.status}; "
+                    f"{counts[STATUS_QUEUED]} em espera, {counts[STATUS_RUNNING]} em curso).")
+
+    def on_meshing_done(self, job):
+        # Chamado a partir de uma thread do pool quando um trabalho termina.
+        print(job.describe())
+        self.metrics.inc('mesh_jobs_total', status=job.status)
+        if job.finished_at is not None:
+            self.metrics.observe('mesh_queue_seconds', job.wait_time_s)
+            self.metrics.observe('mesh_job_seconds', job.run_time_s)
+            for stage, seconds in job.stage_times.items():
+                self.metrics.observe('mesh_stage_seconds', seconds, stage=stage)
+
+async def run_server():
+    if METRICS_ENABLED:
+        configure_metrics(enabled=True, log_path=METRICS_LOG_PATH)
+    try:
+        server = await ScannerServer(feed_port=FEED_PORT).start()
+    except (OSError, ValueError) as e:
+        print(f"[ERRO] Não foi possível iniciar o servidor: {e}")
+        return
+    print("\n--- Servidor de Scanner 3D Iniciado ---")
+    print(f"-> IP do servidor: {get_local_ip()}")
+    print(f"-> A aguardar conexões de scanners na porta {server.port}...")
+    print(f"-> Os dados de cada scan são guardados em '{server.output_dir}/'")
+    if server.feed is not None:
+        print(f"-> Pontos publicados em direto em 127.0.0.1:{server.feed.port} (ver point_feed.py)")
+    if server.metrics_server is not None:
+        print(f"-> Métricas em http://127.0.0.1:{server.metrics_port}/metrics")
+    try:
+        await server.serve_forever()
+    finally:
+        if server.meshing_pool is not None:
+            server.meshing_pool.shutdown(wait=False)
+
+def main():
+    try:
+        asyncio.run(run_server())
+    except KeyboardInterrupt:
+        print("\n[!] Interrupção manual.")
 
 if __name__ == "__main__":
     main()
-    print("\n--- Processo do Scanner Concluído ---")
\ No newline at end of file
+    print("\n--- Processo do Scanner Concluído ---")
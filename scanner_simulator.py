@@ -0,0 +1,265 @@
+# --- START OF FILE scanner_simulator.py ---
+"""
+Simulador do scanner: fala o mesmo protocolo que o wifi_rotacao_2_scan.ino
+("D:<mm>,A:<graus>,Z:<mm>" por linha e "END" no fim), ou o protocolo binário
+opcional de wire_protocol.py (--binario), para testar o scanner_receiver sem o
+Arduino.
+
+Exemplos:
+    python scanner_simulator.py --forma cilindro --camadas 40
+    python scanner_simulator.py --forma caixa --passo 2 --taxa 2000 --ruido 0.8
+    python scanner_simulator.py --forma replay --ficheiro 3dScanner_Data.txt
+    python scanner_simulator.py --scanners 8 --fragmentar --cair-apos 5000
+    python scanner_simulator.py --binario --perdas 0.01
+    python scanner_simulator.py --binario --amostras 5   # amostras em bruto, fundidas no recetor
+"""
+
+import argparse
+import asyncio
+import itertools
+import random
+import time
+import numpy as np
+
+from point_store import load_points
+import wire_protocol
+from calibration_profiles import get_profile
+from scanner_receiver import PORT, CALIBRATION_PROFILE
+
+HOST = '127.0.0.1'
+SENSOR_OFFSET_MM = get_profile(CALIBRATION_PROFILE).sensor_offset_mm  # Geometria do perfil do recetor
+
+SEND_BATCH_POINTS = 90  # Pontos enviados de cada vez (o firmware envia um por um, a ~40 por segundo)
+
+
+# Cada forma devolve o raio (mm) para cada par (ângulo em radianos, altura em mm).
+
+def cylinder_radius(theta_rad, z_mm, radius_mm=30.0):
+    return np.full_like(theta_rad, radius_mm)
+
+def box_radius(theta_rad, z_mm, half_width_mm=25.0, half_depth_mm=15.0):
+    """Distância do centro à parede de uma caixa retangular, para cada ângulo."""
+    with np.errstate(divide='ignore'):
+        to_x = half_width_mm / np.abs(np.cos(theta_rad))
+        to_y = half_depth_mm / np.abs(np.sin(theta_rad))
+    return np.minimum(to_x, to_y)
+
+def twisted_radius(theta_rad, z_mm, radius_mm=28.0, lobes=3, lobe_mm=5.0, twist_deg_per_mm=3.0,
+                   bulge_mm=4.0, bulge_period_mm=60.0):
+    """Forma "orgânica": secção com lóbulos que roda com a altura e engrossa/afina ao longo de Z."""
+    twist = np.deg2rad(twist_deg_per_mm) * z_mm
+    return (radius_mm + lobe_mm * np.sin(lobes * (theta_rad + twist))
+            + bulge_mm * np.sin(2 * np.pi * z_mm / bulge_period_mm))
+
+SHAPES = {
+    'cilindro': cylinder_radius,
+    'caixa': box_radius,
+    'torcido': twisted_radius,
+}
+
+def generate_readings(shape='cilindro', angle_step_deg=1, layers=20, layer_height_mm=1.0,
+                      noise_mm=0.0, sensor_offset_mm=SENSOR_OFFSET_MM, seed=None):
+    """
+    Gera as leituras (distância, ângulo, altura) de um objeto sintético centrado
+    no prato, como o firmware as enviaria. Devolve um array (N, 3).
+    """
+    rng = np.random.default_rng(seed)
+    # Índices inteiros: com passos fracionários, arange(0, 360, passo) acumula erro.
+    angles = np.arange(int(round(360.0 / angle_step_deg))) * angle_step_deg
+    heights = np.arange(layers) * layer_height_mm
+    theta_grid, z_grid = np.meshgrid(angles, heights)
+    radius = SHAPES[shape](np.deg2rad(theta_grid.ravel()).astype(np.float64), z_grid.ravel().astype(np.float64))
+    distance = sensor_offset_mm - radius
+    if noise_mm > 0:
+        distance = distance + rng.normal(0.0, noise_mm, distance.shape)
+    # O firmware envia a distância como inteiro.
+    return np.column_stack((np.rint(distance), theta_grid.ravel(), z_grid.ravel()))
+
+def replay_readings(filepath, sensor_offset_mm=SENSOR_OFFSET_MM):
+    """
+    Converte um scan já guardado (texto ou binário) de volta em leituras do sensor.
+    O objeto é recentrado no prato (centróide XY na origem), por isso a forma é
+    preservada qualquer que tenha sido a calibração usada quando foi gravado.
+    """
+    points = np.asarray(load_points(filepath), dtype=np.float64)
+    xy = points[:, :2] - points[:, :2].mean(axis=0)
+    radius = np.hypot(xy[:, 0], xy[:, 1])
+    theta_deg = np.rint(np.rad2deg(np.arctan2(xy[:, 1], xy[:, 0]))) % 360
+    return np.column_stack((np.rint(sensor_offset_mm - radius), theta_deg, points[:, 2]))
+
+def expand_samples(readings, samples_per_reading, noise_mm=1.0, outlier_rate=0.03,
+                   invalid_rate=0.01, seed=None):
+    """
+    Transforma cada leitura em `samples_per_reading` amostras do sensor, como as
+    envia o firmware no modo de amostras em bruto: ruído gaussiano, alguns
+    outliers (reflexos, +-10 a 40 mm) e algumas leituras fora de alcance (0).
+    """
+    rng = np.random.default_rng(seed)
+    samples = np.repeat(readings, samples_per_reading, axis=0)
+    distance = samples[:, 0] + rng.normal(0.0, noise_mm, len(samples))
+    outlier = rng.random(len(samples)) < outlier_rate
+    distance[outlier] += rng.choice((-1, 1), outlier.sum()) * rng.uniform(10.0, 40.0, outlier.sum())
+    distance[rng.random(len(samples)) < invalid_rate] = 0
+    samples[:, 0] = np.clip(np.rint(distance), 0, None)
+    return samples
+
+def format_readings(readings):
+    """Formata um lote de leituras como o sprintf do firmware (termina em '\\r\\n')."""
+    columns = (readings[:, 0].astype(int).tolist(), readings[:, 1].astype(int).tolist(), readings[:, 2].tolist())
+    values = tuple(itertools.chain.from_iterable(zip(*columns)))
+    return (("D:%d,A:%d,Z:%.2f\r\n" * len(readings)) % values).encode('ascii')
+
+
+class SimulatedScanner:
+    """
+    Um scanner simulado. Envia as leituras em lotes de SEND_BATCH_POINTS a uma
+    taxa opcional e regista quando cada lote foi enviado (para medir latência).
+    """
+
+    def __init__(self, readings, rate_pts_s=0.0, fragment=False, max_fragment_bytes=64,
+                 drop_after_points=None, binary=False, loss_rate=0.0, seed=None, raw_samples=0):
+        self.readings = readings
+        self.binary = binary
+        self.raw_samples = raw_samples
+        self.loss_rate = loss_rate
+        self.rate_pts_s = rate_pts_s
+        self.fragment = fragment
+        self.max_fragment_bytes = max_fragment_bytes
+        self.drop_after_points = drop_after_points
+        self.random = random.Random(seed)
+        self.rng = np.random.default_rng(seed)
+        self.sent_log = []  # (instante, pontos enviados até aqui)
+        self.points_sent = 0
+        self.local_port = None
+        self.end_sent_at = None
+        self.dropped = False
+        self.protocol = "texto"
+        self.raw_accepted = False
+
+    async def handshake(self, reader, writer):
+        """
+        Pede o protocolo binário e/ou as amostras em bruto, como faz o firmware
+        com PROTOCOLO_BINARIO ativo ou o wifi_rotacao_amostras_brutas.
+        """
+        options = [wire_protocol.BINARY_PROTOCOL] if self.binary else []
+        if self.raw_samples:
+            options.append(wire_protocol.RAW_SAMPLES_OPTION)
+        writer.write(b"HELLO " + b" ".join(options) + b"\r\n")
+        await writer.drain()
+        accepted = (await reader.readline()).split()[1:]
+        if wire_protocol.BINARY_PROTOCOL in accepted:
+            self.protocol = "binario"
+        if self.raw_samples and wire_protocol.RAW_SAMPLES_OPTION in accepted:
+            self.raw_accepted = True
+            self.readings = expand_samples(self.readings, self.raw_samples, seed=self.rng.integers(1 << 32))
+
+    def encode(self, batch, first_seq):
+        # Cada leitura leva o seu número de sequência, mesmo as que depois se "perdem".
+        seq = first_seq + np.arange(len(batch))
+        if self.loss_rate > 0:
+            keep = self.rng.random(len(batch)) >= self.loss_rate
+            batch, seq = batch[keep], seq[keep]
+        if self.protocol == "binario":
+            return wire_protocol.encode_frames(batch, seq)
+        return format_readings(batch)
+
+    async def run(self, host=HOST, port=PORT):
+        reader, writer = await asyncio.open_connection(host, port)
+        self.local_port = writer.get_extra_info('sockname')[1]
+        if self.binary or self.raw_samples:
+            await self.handshake(reader, writer)
+        started_at = time.perf_counter()
+        try:
+            for start in range(0, len(self.readings), SEND_BATCH_POINTS):
+                batch = self.readings[start:start + SEND_BATCH_POINTS]
+                if self.drop_after_points is not None and self.points_sent + len(batch) > self.drop_after_points:
+                    # Simula uma queda da ligação a meio do scan.
+                    writer.transport.abort()
+                    self.dropped = True
+                    return
+                await self.send(writer, self.encode(batch, start))
+                self.points_sent += len(batch)
+                self.sent_log.append((time.perf_counter(), self.points_sent))
+
+                if self.rate_pts_s > 0:
+                    delay = started_at + self.points_sent / self.rate_pts_s - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+            await self.send(writer, wire_protocol.encode_end() if self.protocol == "binario" else b"END\r\n")
+            self.end_sent_at = time.perf_counter()
+        finally:
+            if not self.dropped:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except (ConnectionResetError, BrokenPipeError):
+                    pass
+
+    async def send(self, writer, payload):
+        if not self.fragment:
+            writer.write(payload)
+            await writer.drain()
+            return
+        # Parte os dados em pedaços pequenos e irregulares, como numa rede Wi-Fi fraca.
+        pos = 0
+        while pos < len(payload):
+            size = self.random.randint(1, self.max_fragment_bytes)
+            writer.write(payload[pos:pos + size])
+            await writer.drain()
+            pos += size
+
+
+def build_readings(args):
+    if args.forma == 'replay':
+        if not args.ficheiro:
+            raise SystemExit("[ERRO] --forma replay precisa de --ficheiro.")
+        return replay_readings(args.ficheiro)
+    if args.passo != int(args.passo) and not args.binario:
+        # O protocolo de texto envia o ângulo em graus inteiros ("A:%d").
+        raise SystemExit("[ERRO] Um --passo fracionário precisa de --binario (centésimos de grau).")
+    return generate_readings(args.forma, args.passo, args.camadas, args.altura_camada, args.ruido)
+
+def add_arguments(parser):
+    parser.add_argument('--forma', choices=sorted(SHAPES) + ['replay'], default='cilindro')
+    parser.add_argument('--ficheiro', help="Scan a reproduzir com --forma replay (.txt ou .p3ds).")
+    parser.add_argument('--passo', type=float, default=1.0,
+                        help="Passo angular em graus (fracionário só com --binario).")
+    parser.add_argument('--camadas', type=int, default=20)
+    parser.add_argument('--altura-camada', type=float, default=1.0, help="Altura de cada camada (mm).")
+    parser.add_argument('--taxa', type=float, default=0.0, help="Pontos por segundo por scanner (0 = sem limite).")
+    parser.add_argument('--ruido', type=float, default=0.0, help="Desvio padrão do ruído na distância (mm).")
+    parser.add_argument('--fragmentar', action='store_true', help="Envia os dados em pedaços irregulares.")
+    parser.add_argument('--cair-apos', type=int, default=None, help="Corta a ligação depois de N pontos.")
+    parser.add_argument('--scanners', type=int, default=1, help="Número de scanners simulados em simultâneo.")
+    parser.add_argument('--binario', action='store_true', help="Pede o protocolo binário no início da ligação.")
+    parser.add_argument('--perdas', type=float, default=0.0, help="Fração de leituras que não chegam a ser enviadas.")
+    parser.add_argument('--amostras', type=int, default=0,
+                        help="Envia N amostras em bruto por ângulo (com ruído e outliers) para fusão no recetor.")
+
+def make_scanners(readings, args):
+    return [SimulatedScanner(readings, args.taxa, args.fragmentar, drop_after_points=args.cair_apos,
+                             binary=args.binario, loss_rate=args.perdas, seed=i, raw_samples=args.amostras)
+            for i in range(args.scanners)]
+
+async def run_scanners(readings, args, host, port):
+    scanners = make_scanners(readings, args)
+    await asyncio.gather(*[scanner.run(host, port) for scanner in scanners])
+    return scanners
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulador do scanner 3D.")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--porta', type=int, default=PORT)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    readings = build_readings(args)
+    print(f"A enviar {len(readings)} leituras por scanner ({args.scanners} scanner(s)) para {args.host}:{args.porta}...")
+    started_at = time.perf_counter()
+    scanners = asyncio.run(run_scanners(readings, args, args.host, args.porta))
+    elapsed = time.perf_counter() - started_at
+    total = sum(scanner.points_sent for scanner in scanners)
+    print(f"Enviados {total} pontos em {elapsed:.2f} s ({total / elapsed:.0f} pontos/s).")
+
+if __name__ == "__main__":
+    main()
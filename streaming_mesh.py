@@ -0,0 +1,191 @@
+# --- START OF FILE streaming_mesh.py ---
+"""
+Geração da malha sem carregar o scan inteiro em memória (para scans enormes).
+
+O ficheiro de pontos é lido em blocos de `STREAM_CHUNK_POINTS` pontos; as
+camadas são separadas à medida que os blocos chegam (com os mesmos critérios
+do `generate_stl.split_layers`) e cada camada é reconstruída assim que termina.
+Só ficam em memória o bloco atual, a camada aberta, o anel anterior (para as
+paredes) e o primeiro anel (para a tampa da base): o pico de memória não
+depende do tamanho do scan.
+
+As paredes entre cada par de anéis são escritas logo num STL binário, e o
+número de triângulos do cabeçalho é corrigido no fim. Os triângulos são os
+mesmos, e pela mesma ordem, do `build_universal_solid` em modo headless; só
+não há `merge_close_vertices` (que num STL, sem índices, não altera a forma).
+
+    python streaming_mesh.py scans/enorme.p3ds enorme.stl --contornos fourier
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+import point_store
+from generate_stl import (CONTOUR_METHOD, CONTOUR_METHODS, FOURIER_HARMONICS, LAYER_TOLERANCE_MM,
+                          MIN_POINTS_PER_LAYER, NUM_POINTS_PER_LAYER, SPLINE_SMOOTHING,
+                          resample_layer, resample_layers_fourier, wall_triangles)
+from metrics import get_metrics
+from mesh_io import StreamingSTLWriter
+from scan_grid import ScanGrid, is_scan_grid
+
+STREAM_CHUNK_POINTS = 1 << 16  # Pontos lidos do disco de cada vez
+
+
+def iter_point_chunks(filepath, chunk_points=STREAM_CHUNK_POINTS):
+    """
+    Lê um ficheiro de pontos (.p3ds, grelha .grid.npz ou texto "x,y,z") em
+    blocos (N, 3) float64, em mm. A grelha é pequena (5 bytes por ponto) e é
+    lida de uma vez; só a conversão para XYZ é feita por blocos.
+    """
+    if is_scan_grid(filepath):
+        points = ScanGrid.load(filepath).to_xyz()
+        for start in range(0, len(points), chunk_points):
+            yield points[start:start + chunk_points]
+        return
+
+    if point_store.is_point_store(filepath):
+        header = point_store.read_header(filepath)
+        dtype = point_store.record_dtype(header)
+        remaining = header['point_count']
+        with open(filepath, 'rb') as f:
+            f.seek(header['header_size'])
+            while remaining > 0:
+                records = np.fromfile(f, dtype=dtype, count=min(chunk_points, remaining))
+                if len(records) == 0:
+                    break
+                remaining -= len(records)
+                xyz = records['xyz']
+                if header['flags'] & point_store.FLAG_REJECTED:
+                    xyz = point_store.valid_points(xyz)
+                yield xyz.astype(np.float64)
+        return
+
+    with open(filepath, 'r') as f:
+        while True:
+            lines = [line for line in (f.readline() for _ in range(chunk_points)) if line.strip()]
+            if not lines:
+                break
+            yield np.loadtxt(lines, delimiter=",", ndmin=2)
+
+def iter_layers(chunks, tolerance=LAYER_TOLERANCE_MM, min_points=MIN_POINTS_PER_LAYER):
+    """
+    Junta os blocos em camadas completas: uma nova camada começa sempre que Z
+    salta mais do que `tolerance`, e as camadas com `min_points` pontos ou menos
+    são descartadas (como em `split_layers`).
+    """
+    current = []
+    count = 0
+    last_z = None
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        z = chunk[:, 2]
+        breaks = np.flatnonzero(np.abs(np.diff(z, prepend=z[0] if last_z is None else last_z)) > tolerance)
+        start = 0
+        for cut in breaks:
+            if cut > start:
+                current.append(chunk[start:cut])
+                count += cut - start
+            if count > min_points:
+                yield np.concatenate(current)
+            current, count, start = [], 0, cut
+        current.append(chunk[start:])
+        count += len(chunk) - start
+        last_z = z[-1]
+    if count > min_points:
+        yield np.concatenate(current)
+
+def _cap(ring, top):
+    """Vértices (anel + centro, em mm) e triângulos em leque de uma tampa, como em `cap_triangles`."""
+    n = len(ring)
+    j = np.arange(n)
+    j_next = (j + 1) % n
+    vertices = np.concatenate((ring, ring.mean(axis=0)[None]))
+    if top:
+        return vertices, np.column_stack((np.full(n, n), j, j_next))
+    return vertices, np.column_stack((np.full(n, n), j_next, j))
+
+def _write_layers(writer, layers, num_points_per_layer, contour_method):
+    """Reconstrói cada camada e escreve as paredes e, no fim, as tampas. Devolve (triângulos, camadas, pontos)."""
+    walls = wall_triangles(0, 2, num_points_per_layer)
+    first_ring = previous_ring = None
+    layer_count = point_count = 0
+    for layer in layers:
+        if contour_method == "fourier":
+            ring = resample_layers_fourier([layer], num_points_per_layer, FOURIER_HARMONICS)[0]
+        else:
+            ring = resample_layer(layer, num_points_per_layer, SPLINE_SMOOTHING)
+        if previous_ring is None:
+            first_ring = ring
+        else:
+            writer.write(np.concatenate((previous_ring, ring)) * 0.001, walls)
+        previous_ring = ring
+        layer_count += 1
+        point_count += len(layer)
+
+    if layer_count >= 2:
+        for ring, top in ((first_ring, False), (previous_ring, True)):
+            vertices, triangles = _cap(ring, top)
+            writer.write(vertices * 0.001, triangles)
+    return writer.triangle_count, layer_count, point_count
+
+def build_streaming_solid(input_filepath, output_filepath, num_points_per_layer=NUM_POINTS_PER_LAYER,
+                          contour_method=CONTOUR_METHOD, chunk_points=STREAM_CHUNK_POINTS):
+    """
+    Gera o STL camada a camada, com memória constante. Devolve o número de
+    triângulos escritos, ou None (e apaga o ficheiro incompleto) se não houver
+    pelo menos duas camadas válidas.
+    """
+    if os.path.splitext(output_filepath)[1].lower() != '.stl':
+        raise ValueError("A geração em fluxo só escreve STL binário (.stl).")
+    if contour_method not in CONTOUR_METHODS:
+        raise ValueError(f"Método de reconstrução '{contour_method}' desconhecido. "
+                         f"Disponíveis: {', '.join(CONTOUR_METHODS)}.")
+
+    print(f"\n A gerar a malha em fluxo a partir de '{input_filepath}' ({contour_method})")
+    try:
+        with get_metrics().stage('fluxo', metodo=contour_method), StreamingSTLWriter(output_filepath) as writer:
+            triangle_count, layer_count, point_count = _write_layers(
+                writer, iter_layers(iter_point_chunks(input_filepath, chunk_points)),
+                num_points_per_layer, contour_method)
+    except BaseException:
+        # Não deixa para trás um STL incompleto (com o número de triângulos já corrigido).
+        if os.path.exists(output_filepath):
+            os.remove(output_filepath)
+        raise
+
+    if layer_count < 2:
+        os.remove(output_filepath)
+        print(f"[ERRO] Não foram detectadas camadas suficientes ({layer_count}; precisa de pelo menos 2).")
+        return None
+    print(f"{layer_count} camadas ({point_count} pontos) -> {triangle_count} triângulos.")
+    print(f"[SUCESSO] Malha 3D sólida exportada para '{output_filepath}'.")
+    return triangle_count
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera o STL de um scan enorme sem o carregar em memória.")
+    parser.add_argument('entrada', help="Ficheiro de pontos (.p3ds ou .txt).")
+    parser.add_argument('saida', help="STL a criar.")
+    parser.add_argument('--contornos', choices=CONTOUR_METHODS, default=CONTOUR_METHOD)
+    parser.add_argument('--pontos-por-camada', type=int, default=NUM_POINTS_PER_LAYER)
+    parser.add_argument('--pontos-por-bloco', type=int, default=STREAM_CHUNK_POINTS,
+                        help="Pontos lidos do disco de cada vez.")
+    args = parser.parse_args()
+
+    started_at = time.perf_counter()
+    try:
+        triangle_count = build_streaming_solid(args.entrada, args.saida, args.pontos_por_camada,
+                                               args.contornos, args.pontos_por_bloco)
+    except (OSError, ValueError) as e:
+        print(f"[ERRO] {e}")
+        return 1
+    if triangle_count is None:
+        return 1
+    print(f"Concluído em {time.perf_counter() - started_at:.1f} s.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
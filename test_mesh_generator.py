@@ -4,9 +4,11 @@ import os
 import sys
 
 try:
-    from generate_stl import build_universal_solid
-except ImportError:
-    print("[ERRO] O ficheiro 'generate_stl.py' não foi encontrado na mesma pasta.")
+    from generate_stl import CONTOUR_METHOD, build_universal_solid
+    from mesh_cache import MeshCache
+    import metrics
+except ImportError as e:
+    print(f"[ERRO] Não foi possível importar o gerador de malha (generate_stl.py e módulos auxiliares): {e}")
     sys.exit(1)
 
 def main():
@@ -15,15 +17,35 @@ def main():
     """
     print("--- INICIANDO CONSTRUÇÃO DE MALHA UNIVERSAL ---")
     
-    input_data_file = "3dScanner_Data.txt"
+    # Prefere o ficheiro binário escrito pelo recetor; o de texto continua a ser aceite.
+    input_data_file = "3dScanner_Data.p3ds"
+    if not os.path.exists(input_data_file):
+        input_data_file = "3dScanner_Data.txt"
     output_stl_file = "output_universal_solid.stl"
     
     if not os.path.exists(input_data_file):
         print(f"\n[ERRO] O ficheiro de dados '{input_data_file}' não foi encontrado.")
         return
 
+    # Com "--sem-janela" a malha é gravada sem abrir o visualizador nem carregar o open3d.
+    headless = "--sem-janela" in sys.argv[1:]
+    # As fases já calculadas para os mesmos pontos e parâmetros são lidas de
+    # '.mesh_cache/'; "--sem-cache" força a reconstrução completa.
+    cache = None if "--sem-cache" in sys.argv[1:] else MeshCache()
+    # Com "--metricas" a duração e o aumento do pico de memória de cada fase são
+    # acrescentados a 'metrics.jsonl' e mostrados no fim.
+    if "--metricas" in sys.argv[1:]:
+        metrics.configure(enabled=True, log_path="metrics.jsonl")
+
+    # Com "--fourier" os contornos de todas as camadas são reconstruídos de uma
+    # só vez por uma série de Fourier truncada, em vez de uma spline por camada.
+    contour_method = "fourier" if "--fourier" in sys.argv[1:] else CONTOUR_METHOD
+
     try:
-        build_universal_solid(input_data_file, output_stl_file)
+        build_universal_solid(input_data_file, output_stl_file, headless=headless, cache=cache,
+                              contour_method=contour_method)
+        for stage, seconds in metrics.get_metrics().take_stages().items():
+            print(f"  {stage:18s} {seconds * 1000:8.1f} ms")
     except Exception as e:
         print(f"\n[ERRO CRÍTICO] Ocorreu um erro inesperado: {e}")
         import traceback
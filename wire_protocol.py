@@ -0,0 +1,187 @@
+# --- START OF FILE wire_protocol.py ---
+"""
+Protocolos de comunicação entre o scanner e o recetor.
+
+Texto (firmware original): uma leitura por linha, "D:<mm>,A:<graus>,Z:<mm>",
+terminando com a linha "END".
+
+Binário (opcional, escolhido no início da ligação):
+    scanner -> "HELLO P3DB/1\\r\\n"
+    recetor -> "OK P3DB/1\\r\\n"   (ou "OK TEXT\\r\\n" se não suportar a versão)
+    depois, tramas: [0xA5 0x5A][n: uint16][n registos de 10 bytes]
+    Registo (little-endian): seq uint32, distância uint16 (mm),
+    ângulo uint16 (centésimos de grau), altura uint16 (centésimos de mm).
+    Uma trama com n = 0 marca o fim do scan (equivalente a "END").
+
+O número de sequência permite detetar leituras perdidas. Um firmware antigo
+que não envia "HELLO" continua a usar o protocolo de texto.
+
+Amostras em bruto (opcional): com "HELLO P3DB/1 RAW" o scanner pede para
+enviar todas as amostras de cada ângulo em vez da média. Se o recetor aceitar,
+a resposta termina em " RAW" ("OK P3DB/1 RAW\r\n") e as amostras são fundidas
+no PC (ver sample_fusion.py); caso contrário o firmware continua a fazer a média.
+"""
+
+import re
+import struct
+import numpy as np
+
+HANDSHAKE_PREFIX = b'HELLO'
+BINARY_PROTOCOL = b'P3DB/1'
+BINARY_ACCEPTED = b'OK ' + BINARY_PROTOCOL + b'\r\n'
+BINARY_REFUSED = b'OK TEXT\r\n'
+RAW_SAMPLES_OPTION = b'RAW'
+
+FRAME_MAGIC = b'\xA5\x5A'
+FRAME_HEADER = struct.Struct('<2sH')
+RECORD_DTYPE = np.dtype([('seq', '<u4'), ('distance', '<u2'), ('angle', '<u2'), ('z', '<u2')])
+ANGLE_SCALE = 100.0   # centésimos de grau
+HEIGHT_SCALE = 100.0  # centésimos de mm
+MAX_RECORDS_PER_FRAME = 4096
+
+# Uma leitura completa por linha: "D:<mm>,A:<graus>,Z:<mm>" (versões antigas usavam "H:").
+_RECORD_RE = re.compile(rb'^[ \t]*D:[ \t]*(-?\d+)[ \t]*,[ \t]*A:[ \t]*(-?\d+)[ \t]*,[ \t]*[ZH]:[ \t]*(-?\d+(?:\.\d*)?)[ \t]*\r?$', re.M)
+_END_RE = re.compile(rb'^[ \t]*END[ \t]*\r?$', re.M | re.I)
+_NON_EMPTY_LINE_RE = re.compile(rb'^[ \t]*[^\s]', re.M)
+
+
+def negotiate(first_line, accept_raw_samples=True):
+    """
+    Analisa a primeira linha recebida. Devolve (decoder, resposta), onde
+    `resposta` são os bytes a enviar ao scanner (ou None se não houver handshake).
+    `decoder.raw_samples` indica se o scanner vai enviar as amostras em bruto.
+    """
+    if not first_line.lstrip().startswith(HANDSHAKE_PREFIX):
+        return TextDecoder(), None
+    options = first_line.split()[1:]
+    if BINARY_PROTOCOL in options:
+        decoder, reply = BinaryDecoder(), BINARY_ACCEPTED
+    else:
+        decoder, reply = TextDecoder(), BINARY_REFUSED
+    if accept_raw_samples and RAW_SAMPLES_OPTION in options:
+        decoder.raw_samples = True
+        reply = reply.rstrip(b'\r\n') + b' ' + RAW_SAMPLES_OPTION + b'\r\n'
+    return decoder, reply
+
+def parse_chunk(block: bytes):
+    """
+    Converte um bloco de linhas completas (terminado em '\\n') num array (N, 3)
+    com as colunas distância, ângulo e altura, tudo de uma só vez.
+    Devolve (leituras, fim_do_scan, linhas_invalidas). As linhas depois de
+    'END' são ignoradas.
+    """
+    end_match = _END_RE.search(block)
+    if end_match:
+        block = block[:end_match.start()]
+
+    records = _RECORD_RE.findall(block)
+    n_invalid = len(_NON_EMPTY_LINE_RE.findall(block)) - len(records)
+    if records:
+        readings = np.array(records, dtype=np.bytes_).astype(np.float64)
+    else:
+        readings = np.empty((0, 3))
+    return readings, end_match is not None, n_invalid
+
+
+class TextDecoder:
+    """Descodifica o protocolo de texto, um bloco de linhas completas de cada vez."""
+
+    protocol = "texto"
+    raw_samples = False
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.lost = 0  # O protocolo de texto não permite detetar perdas
+
+    def feed(self, data_bytes):
+        """Devolve (leituras (N, 3), fim_do_scan, unidades_invalidas)."""
+        self.buffer += data_bytes
+        cut = self.buffer.rfind(b'\n')
+        if cut < 0:
+            return np.empty((0, 3)), False, 0
+        block = bytes(self.buffer[:cut + 1])
+        del self.buffer[:cut + 1]
+        return parse_chunk(block)
+
+
+class BinaryDecoder:
+    """
+    Descodifica as tramas binárias com `np.frombuffer`, sem copiar registo a
+    registo. Bytes que não pertencem a uma trama válida são descartados até ao
+    próximo marcador e contados como inválidos.
+    """
+
+    protocol = "binario"
+    raw_samples = False
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.next_seq = None
+        self.lost = 0
+
+    def feed(self, data_bytes):
+        """Devolve (leituras (N, 3), fim_do_scan, bytes_invalidos)."""
+        self.buffer += data_bytes
+        chunks = []
+        n_invalid = 0
+        end = False
+        pos = 0
+        while len(self.buffer) - pos >= FRAME_HEADER.size:
+            magic, count = FRAME_HEADER.unpack_from(self.buffer, pos)
+            if magic != FRAME_MAGIC or count > MAX_RECORDS_PER_FRAME:
+                # Perdeu-se o alinhamento: avança até ao próximo marcador.
+                found = self.buffer.find(FRAME_MAGIC, pos + 1)
+                skip_to = found if found >= 0 else len(self.buffer) - 1
+                n_invalid += skip_to - pos
+                pos = skip_to
+                continue
+            if count == 0:
+                end = True
+                pos += FRAME_HEADER.size
+                break
+            frame_size = FRAME_HEADER.size + count * RECORD_DTYPE.itemsize
+            if len(self.buffer) - pos < frame_size:
+                break
+            chunks.append(np.frombuffer(self.buffer, dtype=RECORD_DTYPE, count=count,
+                                        offset=pos + FRAME_HEADER.size).copy())
+            pos += frame_size
+        del self.buffer[:pos]
+
+        if not chunks:
+            return np.empty((0, 3)), end, n_invalid
+        records = np.concatenate(chunks)
+        self.count_lost(records['seq'])
+
+        readings = np.empty((len(records), 3))
+        readings[:, 0] = records['distance']
+        readings[:, 1] = records['angle'] / ANGLE_SCALE
+        readings[:, 2] = records['z'] / HEIGHT_SCALE
+        return readings, end, n_invalid
+
+    def count_lost(self, seq):
+        seq = seq.astype(np.int64)
+        if self.next_seq is not None:
+            self.lost += max(0, int(seq[0]) - self.next_seq)
+        gaps = np.diff(seq) - 1
+        self.lost += int(gaps[gaps > 0].sum())
+        self.next_seq = int(seq[-1]) + 1
+
+
+def encode_frames(readings, seq, records_per_frame=90):
+    """
+    Codifica leituras (distância, ângulo, altura) e os respetivos números de
+    sequência em tramas binárias (usado pelo simulador).
+    """
+    records = np.empty(len(readings), dtype=RECORD_DTYPE)
+    records['seq'] = seq
+    records['distance'] = np.clip(np.rint(readings[:, 0]), 0, 0xFFFF)
+    records['angle'] = np.rint(readings[:, 1] * ANGLE_SCALE)
+    records['z'] = np.clip(np.rint(readings[:, 2] * HEIGHT_SCALE), 0, 0xFFFF)
+    frames = []
+    for start in range(0, len(records), records_per_frame):
+        frame = records[start:start + records_per_frame]
+        frames.append(FRAME_HEADER.pack(FRAME_MAGIC, len(frame)) + frame.tobytes())
+    return b''.join(frames)
+
+def encode_end():
+    return FRAME_HEADER.pack(FRAME_MAGIC, 0)